@@ -1,12 +1,23 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 import asyncio
 from utils.chat_utils import (query_classifier,
                             add_to_chat_history,
                             get_history_from_sesh_id, 
                             check_if_final_department,
-                            check_if_final_department_id)
+                            check_if_final_department_id,
+                            session_turn,
+                            session_store,
+                            session_locks,
+                            session_archive,
+                            SESSION_FINAL_TTL,
+                            SESSION_IDLE_TTL,
+                            SESSION_ARCHIVE_INTERVAL)
+from utils.session_archive import run_session_archiver
+from utils.classification_stream import classification_events, format_sse
+from utils.resilience import ModelUnavailableError, retry_after_header
 import uvicorn
 
 app = FastAPI()
@@ -29,26 +40,35 @@ class HistoryItem(BaseModel):
 class ChatRequest(BaseModel):
     query: str
     session_id: str  # Optional session ID
+    bypass_cache: bool = False  # Always ask the model, e.g. when re-checking a classification
+    classification_mode: Optional[Literal["hierarchical", "flat"]] = None  # Defaults to CLASSIFICATION_MODE
 
 
-@app.post("/continue_chat_classify")
-async def classify_grievance(request: ChatRequest):
+# Seconds between keep-alive comments on an idle event stream
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+
+
+async def classification_turn(request: ChatRequest) -> dict:
     """
-    Endpoint to classify a grievance query.
+    One classification turn: the query goes into the history, the session
+    descends as far as it can, and the answer goes into the history.
     """
-    if await check_if_final_department_id(request.session_id)== True:
-        import uuid
-        return{"result": request.query, 
-               "path": "nothing here",
-               "sesh_id": str(uuid.uuid4())}
+    # One turn per session at a time; the session is flushed once when the turn ends
+    async with session_turn(request.session_id):
+        if await check_if_final_department_id(request.session_id)== True:
+            import uuid
+            return{"result": request.query, 
+                   "path": "nothing here",
+                   "sesh_id": str(uuid.uuid4())}
     
-    try:
         await add_to_chat_history(request.session_id, "user", request.query)
 
         # Call the query_classifier function
         result, path = await query_classifier(
             query=request.query,
-            chat_session_id=request.session_id
+            chat_session_id=request.session_id,
+            use_cache=not request.bypass_cache,
+            mode=request.classification_mode
         )
 
         await add_to_chat_history(request.session_id, "assistant", result)
@@ -64,9 +84,77 @@ async def classify_grievance(request: ChatRequest):
         return {"result": dept_res,
                 "path": path}
 
+
+@app.post("/continue_chat_classify")
+async def classify_grievance(request: ChatRequest):
+    """
+    Endpoint to classify a grievance query.
+    """
+    try:
+        return await classification_turn(request)
+    except ModelUnavailableError as e:
+        # Overloaded model API: tell the client when to come back instead of a bare 500
+        logger.warning(f"Model API unavailable for session {request.session_id}: {e}")
+        raise HTTPException(status_code=503, detail="The classifier is overloaded, please retry shortly.",
+                            headers={"Retry-After": retry_after_header(e)})
     except Exception as e:
         # Handle exceptions and return a 500 error
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/continue_chat_classify/stream")
+async def classify_grievance_stream(request: ChatRequest):
+    """
+    Streaming variant of /continue_chat_classify, as server-sent events.
+
+    Events, in order:
+        level     {"department", "path"}  each time the path advances
+        question  {"delta"}               pieces of the clarifying question, as the model writes them
+        summary   {"result", "path"}      the same body /continue_chat_classify returns
+    or, instead of the summary, error {"detail", "status", "retry_after"}.
+    Comment lines keep the connection alive while a model call runs. If the
+    client goes away, the turn still completes, so the session stays consistent.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_turn():
+        with classification_events(lambda event, data: queue.put_nowait((event, data))):
+            return await classification_turn(request)
+
+    async def events():
+        turn = asyncio.create_task(run_turn())
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, turn}, timeout=SSE_KEEPALIVE_INTERVAL,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    event, data = getter.result()
+                    yield format_sse(event, data)
+                    continue
+                getter.cancel()
+                if turn in done:
+                    break
+                yield ": keep-alive\n\n"
+
+            while not queue.empty():
+                event, data = queue.get_nowait()
+                yield format_sse(event, data)
+            try:
+                yield format_sse("summary", turn.result())
+            except ModelUnavailableError as e:
+                logger.warning(f"Model API unavailable for session {request.session_id}: {e}")
+                yield format_sse("error", {"detail": "The classifier is overloaded, please retry shortly.",
+                                           "status": 503, "retry_after": int(retry_after_header(e))})
+            except Exception as e:
+                yield format_sse("error", {"detail": str(e), "status": 500, "retry_after": None})
+        finally:
+            if not turn.done():
+                # The client went away: let the turn finish in the background
+                turn.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     
 @app.post("/initiate_chat")
 async def initiate_chat():
@@ -114,6 +202,29 @@ async def get_chat_history(session_id: str):
         logger.error(f"Error in get_chat_history: {str(e)}")
         return {"error": str(e), "dept_res": "Error retrieving department resolution", "path": []}
     
+@app.on_event("startup")
+async def start_session_archiver():
+    """
+    Starts the background task that moves expired sessions into the archive.
+    """
+    if SESSION_ARCHIVE_INTERVAL > 0:
+        app.state.session_archiver = asyncio.create_task(run_session_archiver(
+            session_store, session_locks, session_archive,
+            final_ttl=SESSION_FINAL_TTL,
+            idle_ttl=SESSION_IDLE_TTL,
+            interval=SESSION_ARCHIVE_INTERVAL
+        ))
+
+@app.on_event("shutdown")
+async def flush_sessions_on_shutdown():
+    """
+    Writes back any session that is still dirty in the session cache.
+    """
+    archiver = getattr(app.state, "session_archiver", None)
+    if archiver is not None:
+        archiver.cancel()
+    session_store.flush_all()
+
 @app.get("/health")
 async def health_check():
     """
@@ -10,16 +10,19 @@ from urllib.parse import urljoin, urlparse
 # API_BASE_URL = "http://34.93.126.124:8000"
 API_BASE_URL="http://127.0.0.1:8000"
 CLASSIFY_ENDPOINT = "/continue_chat_classify"
+CLASSIFY_STREAM_ENDPOINT = "/continue_chat_classify/stream"  # Server-sent events: levels, question tokens, summary
 HEALTH_CHECK_ENDPOINT = "/health" # Common endpoint for health checks
 INITIATE_CHAT_ENDPOINT = "/initiate_chat" # New endpoint for initiating chat sessions
 GET_CHAT_HISTORY_ENDPOINT = "/chat_history" # Endpoint to get chat history
 
 API_URL = urljoin(API_BASE_URL, CLASSIFY_ENDPOINT)
+STREAM_API_URL = urljoin(API_BASE_URL, CLASSIFY_STREAM_ENDPOINT)
 HEALTH_CHECK_URL = urljoin(API_BASE_URL, HEALTH_CHECK_ENDPOINT)
 INITIATE_CHAT_URL = urljoin(API_BASE_URL, INITIATE_CHAT_ENDPOINT)
 
 
 REQUEST_TIMEOUT = 45  # seconds for API calls
+STREAM_READ_TIMEOUT = 60  # seconds without any event (the API sends keep-alives every 15s)
 HEALTH_CHECK_TIMEOUT = 5 # seconds for health check
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # seconds
@@ -45,6 +48,7 @@ if 'session_id' not in st.session_state:
 
 # --- Sidebar ---
 debug_mode = st.sidebar.checkbox("Debug Mode", value=False)
+stream_mode = st.sidebar.checkbox("Stream Responses", value=True)
 
 
 if st.sidebar.button("Force API Health Check"):
@@ -95,6 +99,100 @@ def load_chat_session_data(session_id):
             st.sidebar.error(f"Failed to load chat session data: {str(e)}")
         return None
 
+def read_sse(response):
+    """(event, data) pairs from a server-sent event stream."""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if event is not None:
+                yield event, json.loads("\n".join(data))
+            event, data = None, []
+        elif line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data.append(line[len("data: "):])
+
+def fetch_finished_turn(session_id, user_query):
+    """
+    Result of a streamed turn whose connection broke after it had started.
+
+    The server finishes the turn even without a client, so it is not sent
+    again; /chat_history is polled until the assistant's reply follows the
+    user's message (or REQUEST_TIMEOUT passes).
+    """
+    url = urljoin(API_BASE_URL, f"{GET_CHAT_HISTORY_ENDPOINT}/{session_id}")
+    deadline = time.monotonic() + REQUEST_TIMEOUT
+    while True:
+        try:
+            response = requests.get(url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            chat_data = response.json()
+            history = chat_data.get("history") or []
+            if len(history) >= 2 and history[-1].get("role") == "assistant" and history[-2].get("content") == user_query:
+                result = history[-1].get("content")
+                # A resolved turn stores the path itself; show the resolution text as the plain endpoint does
+                if isinstance(result, list):
+                    result = chat_data.get("dept_res", result)
+                return {"result": result, "path": chat_data.get("path", [])}
+        except requests.exceptions.RequestException as e:
+            if debug_mode:
+                st.sidebar.error(f"Fetching the finished turn failed: {str(e)}")
+        if time.monotonic() >= deadline:
+            return {"response": "The connection was lost while your message was being processed.",
+                    "result": "The connection was lost while your message was being processed. Use /get_resolved_depts to see the current state."}
+        time.sleep(RETRY_DELAY)
+
+def query_api_streaming(user_query, session_id, path_placeholder, answer_placeholder):
+    """
+    Queries the streaming endpoint, showing each resolved level and the
+    clarifying question as they arrive. Returns the summary, like
+    query_api_with_retries() returns the response body.
+
+    The turn is sent again through the plain endpoint only if no event
+    arrived at all; once one has, the server has the turn and its result is
+    read back with fetch_finished_turn() instead.
+    """
+    payload = {"query": user_query, "session_id": session_id}
+    question = ""
+    received = False
+    try:
+        with requests.post(STREAM_API_URL, json=payload, stream=True, timeout=(HEALTH_CHECK_TIMEOUT, STREAM_READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            for event, data in read_sse(response):
+                received = True
+                if debug_mode:
+                    st.sidebar.write(f"Event {event}:", data)
+                if event == "level":
+                    st.session_state.current_resolved_path = data["path"]
+                    path_placeholder.markdown(" → ".join(data["path"]))
+                elif event == "question":
+                    question += data["delta"]
+                    answer_placeholder.markdown(question)
+                elif event == "error":
+                    if data.get("retry_after"):
+                        st.toast(f"⚠️ {data['detail']} Retry in {data['retry_after']}s.", icon="⚠️")
+                    return {"response": data["detail"], "result": data["detail"]}
+                elif event == "summary":
+                    if "sesh_id" in data:
+                        # The previous grievance was resolved: continue in the new session, as query_api_with_retries does
+                        st.session_state.session_id = data["sesh_id"]
+                        st.session_state.current_resolved_path = None
+                        notice = f"{data['result']}\n\nPrevious grievance has been resolved. Starting a new session."
+                        return query_api_streaming(notice, data["sesh_id"], path_placeholder, answer_placeholder)
+                    return data
+    except requests.exceptions.RequestException as e:
+        if debug_mode:
+            st.sidebar.error(f"Streaming request failed: {str(e)}")
+        if not received:
+            # The turn never started: fall back to the plain endpoint
+            return query_api_with_retries([], user_query, session_id)
+        return fetch_finished_turn(session_id, user_query)
+    if received:
+        return fetch_finished_turn(session_id, user_query)
+    return {"response": "The stream ended without a summary."}
+
 def query_api_with_retries(actual_chat_history, user_query, session_id=None): 
     """
     Queries the API with the chat history and user query, including retries.
@@ -111,6 +209,7 @@ def query_api_with_retries(actual_chat_history, user_query, session_id=None):
         st.sidebar.write("Sending payload:", payload)
 
     for attempt in range(MAX_RETRIES):
+        retry_delay = RETRY_DELAY
         try:
             response = requests.post(API_URL, json=payload, timeout=REQUEST_TIMEOUT)
             response_data = response.json()
@@ -175,6 +274,9 @@ def query_api_with_retries(actual_chat_history, user_query, session_id=None):
                 st.session_state.api_operational = False
                 return {"response": "Sorry, there was a persistent error connecting to the API. Please notify an administrator."}
         except requests.exceptions.HTTPError as e:
+            if response.status_code == 503 and response.headers.get("Retry-After", "").isdigit():
+                # The API is overloaded; wait as long as it asks instead of re-sending right away
+                retry_delay = max(RETRY_DELAY, int(response.headers["Retry-After"]))
             error_msg = f"API returned an error: {response.status_code} {response.reason} (Attempt {attempt + 1}/{MAX_RETRIES}). Response: {response.text[:200]}"
             st.toast(f"⚠️ {error_msg}", icon="⚠️")
             if debug_mode: st.sidebar.error(error_msg)
@@ -201,9 +303,9 @@ def query_api_with_retries(actual_chat_history, user_query, session_id=None):
                 return {"response": "Sorry, an unexpected error occurred while communicating with the API."}
 
         if attempt < MAX_RETRIES - 1:
-            time.sleep(RETRY_DELAY)
+            time.sleep(retry_delay)
             if debug_mode:
-                st.sidebar.info(f"Retrying in {RETRY_DELAY}s...")
+                st.sidebar.info(f"Retrying in {retry_delay}s...")
         else:
             st.error("API Error: Failed after all retries.")
             return {"response": "Sorry, the API is not responding after multiple attempts."}
@@ -325,11 +427,23 @@ elif user_input:
             api_call_history_for_payload = []
 
 
-        api_response = query_api_with_retries(
-            actual_chat_history=api_call_history_for_payload,
-            user_query=user_input,
-            session_id=st.session_state.session_id  # Include session ID in API calls
-        )
+        if stream_mode:
+            with chat_container:
+                with st.chat_message("assistant"):
+                    path_placeholder = st.empty()
+                    answer_placeholder = st.empty()
+            api_response = query_api_streaming(
+                user_query=user_input,
+                session_id=st.session_state.session_id,
+                path_placeholder=path_placeholder,
+                answer_placeholder=answer_placeholder
+            )
+        else:
+            api_response = query_api_with_retries(
+                actual_chat_history=api_call_history_for_payload,
+                user_query=user_input,
+                session_id=st.session_state.session_id  # Include session ID in API calls
+            )
 
         # Extract and store the resolved department path if available in the response
         if "path" in api_response:
@@ -0,0 +1,77 @@
+"""
+Benchmark: cost of getting a classifier model per classification level.
+
+Compares what attempt_classification used to do on every level (vertexai.init,
+a new GenerativeModel with safety settings and a new ChatSession) with what
+VertexGeminiBackend does per call (model from model_pool, a new ChatSession).
+No request is sent, so the SDK is initialized with anonymous credentials and,
+unless GOOGLE_CLOUD_PROJECT is set, a placeholder project.
+
+    python tests/bench_model_construction.py [iterations]
+"""
+import os
+import sys
+import time
+import asyncio
+import vertexai
+import vertexai.generative_models
+from google.auth.credentials import AnonymousCredentials
+from utils.llm_backends import VertexGeminiBackend
+from utils.models import SAFETY_SETTINGS, init_vertexai, model_pool
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+MODEL_NAME = "gemini-2.5-flash-preview-05-20"
+HISTORY = [
+    vertexai.generative_models.Content(role="user", parts=[vertexai.generative_models.Part.from_text("PM Kisan installment not received")]),
+    vertexai.generative_models.Content(role="model", parts=[vertexai.generative_models.Part.from_text("Which installment was not received?")]),
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+backend = VertexGeminiBackend(MODEL_NAME)
+
+
+async def unpooled():
+    # The constructor as it was before the pool
+    vertexai.init()
+    model = vertexai.generative_models.GenerativeModel(model_name=MODEL_NAME, safety_settings=SAFETY_SETTINGS)
+    return vertexai.generative_models.ChatSession(model=model, history=HISTORY)
+
+
+async def pooled():
+    # What VertexGeminiBackend.generate_json builds before sending a call with history
+    model = await backend._model(None)
+    return vertexai.generative_models.ChatSession(model=model, history=list(HISTORY))
+
+
+async def measure(name, build):
+    await build()  # warm up
+    timings = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        await build()
+        timings.append(time.perf_counter() - start)
+    print(
+        f"{name:<10} mean {sum(timings) / len(timings) * 1e6:9.1f} us   "
+        f"p50 {percentile(timings, 50) * 1e6:9.1f} us   "
+        f"p99 {percentile(timings, 99) * 1e6:9.1f} us"
+    )
+
+
+async def main():
+    init_vertexai(
+        project=os.getenv("GOOGLE_CLOUD_PROJECT", "bench-model-construction"),
+        location=os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1"),
+        credentials=AnonymousCredentials()
+    )
+    print(f"{ITERATIONS} model constructions per variant (one per classification level)\n")
+    await measure("unpooled", unpooled)
+    await measure("pooled", pooled)
+    print(f"\n{len(model_pool)} pooled model objects")
+
+if __name__ == "__main__":
+    asyncio.run(main())
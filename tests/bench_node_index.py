@@ -0,0 +1,109 @@
+"""
+Benchmark: node index build time, per-query ranking cost and top-k recall.
+
+Builds the NodeIndex over every department in utils/ and data/, then reports:
+- build, save, load and tree-digest time
+- ranking latency per level width (one query against the children of each
+  non-leaf node)
+- for each k, on the labeled grievances of data/PM_Kisan/test.csv: at the
+  levels wide enough to prune, how often the correct child is among the
+  top k (recall), and the options and prompt tokens offered per level
+
+    python tests/bench_node_index.py
+"""
+import os
+import time
+import json
+import tempfile
+from collections import defaultdict
+import numpy as np
+from utils.department_tree import TreeRegistry
+from utils.local_classifier import load_labeled_csv
+from utils.name_resolver import name_resolver
+from utils.node_index import OTHER_OPTION, NodeIndex, nodes_digest, tree_nodes
+from utils.token_usage import approx_tokens
+
+TEST_CSV = "data/PM_Kisan/test.csv"
+TOP_K = (3, 5, 8, 10)
+QUERY = "PM Kisan installment amount not received in my bank account"
+REPEATS = 200
+
+
+def tree_path(registry, names):
+    path = []
+    for name in names:
+        resolved, _ = name_resolver.resolve(name, registry.children(path))
+        if resolved is None:
+            break
+        path.append(resolved)
+    return path
+
+
+def main():
+    registry = TreeRegistry(["utils", "data"])
+    # Discover the trees first, so the build time is the index alone
+    registry.children([])
+
+    start = time.perf_counter()
+    index = NodeIndex.build(registry)
+    build = time.perf_counter() - start
+    file_path = os.path.join(tempfile.mkdtemp(prefix="bench_node_index_"), "node_index.npz")
+    start = time.perf_counter()
+    index.save(file_path)
+    save = time.perf_counter() - start
+    start = time.perf_counter()
+    index = NodeIndex.load(file_path)
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    assert nodes_digest(*tree_nodes(registry)) == index.digest
+    digest = time.perf_counter() - start
+    print(f"{len(index)} departments, matrix {index.matrix.shape[0]} x {index.matrix.shape[1]} "
+          f"({os.path.getsize(file_path) / 2**20:.1f} MiB)")
+    print(f"Build: {build * 1000:.1f} ms, save: {save * 1000:.1f} ms, load: {load * 1000:.1f} ms, "
+          f"digest check: {digest * 1000:.1f} ms")
+
+    # Ranking cost grows with the size of the parent's subtree, not just its width
+    stack = [[]]
+    parents = []
+    while stack:
+        path = stack.pop()
+        children = registry.children(path)
+        if children:
+            parents.append(path)
+            stack.extend(path + [child] for child in children)
+    timings = defaultdict(list)
+    for path in parents:
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            index.rank(QUERY, path)
+        timings[len(registry.children(path))].append((time.perf_counter() - start) / REPEATS)
+    print("\nRanking latency by level width:")
+    print(f"{'width':>5}  {'levels':>6}  {'mean us':>8}  {'max us':>8}")
+    for width in sorted(timings):
+        values = np.array(timings[width]) * 1e6
+        print(f"{width:>5}  {len(values):>6}  {values.mean():>8.1f}  {values.max():>8.1f}")
+
+    texts, labels = load_labeled_csv(TEST_CSV)
+    print(f"\nTop-k recall on {len(texts)} labeled grievances (levels with more than k + 1 children):")
+    print(f"{'k':>3}  {'levels':>6}  {'recall':>7}  {'options':>7}  {'tokens':>6}  {'full tokens':>11}")
+    for k in TOP_K:
+        levels = hits = options = tokens = full_tokens = 0
+        for text, label in zip(texts, labels):
+            path = tree_path(registry, label)
+            for depth in range(len(path)):
+                children = registry.children(path[:depth])
+                if len(children) <= k + 1:
+                    continue
+                shown = [child for child, _ in index.rank(text, path[:depth])[:k]]
+                levels += 1
+                hits += path[depth] in shown
+                options += len(shown) + 1
+                tokens += approx_tokens(json.dumps(shown + [OTHER_OPTION], indent=2))
+                full_tokens += approx_tokens(json.dumps(children, indent=2))
+        if levels:
+            print(f"{k:>3}  {levels:>6}  {hits / levels:>7.1%}  {options / levels:>7.1f}  {tokens / levels:>6.0f}  "
+                  f"{full_tokens / levels:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
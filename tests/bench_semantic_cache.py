@@ -0,0 +1,119 @@
+"""
+Benchmark: semantic cache build time and lookup latency at 100k entries.
+
+Builds 100k distinct synthetic grievances by combining 3-5 sentences from the
+PM-KISAN grievances in data/PM_Kisan/ and adding fresh beneficiary IDs,
+Aadhaar and survey numbers. The lookups are half refilings of a cached
+grievance (new identifiers, ~4% of the words dropped or replaced) and half
+new combinations. The benchmark reports:
+- vectorizing and LSH search latency, and the two together (what lookup() costs)
+- a brute-force scan of the whole matrix for comparison
+- LSH recall: of the lookups whose brute-force best match clears
+  MIN_SIMILARITY, the share for which the cache finds one as well
+
+    python tests/bench_semantic_cache.py [entries]
+"""
+import re
+import csv
+import sys
+import time
+import random
+import numpy as np
+from utils.semantic_cache import HashedTfidfVectorizer, SemanticCache
+
+ENTRIES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+LOOKUPS = 2000
+MIN_SIMILARITY = 0.8
+CSV_FILES = ("data/PM_Kisan/train.csv", "data/PM_Kisan/test.csv", "data/PM_Kisan/PM_Kisan_Grivience_data.csv")
+
+
+def load(csv_path):
+    with open(csv_path, "r", newline="") as file:
+        return [(row["translated_grievance"], row["target_grievance_category"].split("/")) for row in csv.DictReader(file)]
+
+
+def identifiers(rng):
+    return f"Beneficiary ID PMK{rng.randrange(10**9)} Aadhaar {rng.randrange(10**11, 10**12)} survey number {rng.randrange(500)}/{rng.randrange(9)}"
+
+
+def refile(text, vocabulary, rng):
+    words = []
+    for word in re.sub(r"Beneficiary ID .*$", "", text).split():
+        roll = rng.random()
+        if roll < 0.02:
+            continue
+        if roll < 0.04:
+            word = rng.choice(vocabulary)
+        words.append(word)
+    return " ".join(words) + " " + identifiers(rng)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    rng = random.Random(7)
+    grievances = [item for csv_path in CSV_FILES for item in load(csv_path)]
+    sentences = sorted({
+        sentence.strip()
+        for text, _ in grievances
+        for sentence in re.split(r"(?<=[.?!])\s+", text)
+        if len(sentence.split()) > 4
+    })
+    vocabulary = sorted({word for text, _ in grievances for word in text.split() if word.isalpha()})
+    paths = [path for _, path in grievances]
+
+    def new_grievance():
+        return " ".join(rng.sample(sentences, rng.randint(3, 5))) + " " + identifiers(rng)
+
+    vectorizer = HashedTfidfVectorizer.from_csv("data/PM_Kisan/train.csv")
+    cache = SemanticCache(vectorizer, max_entries=ENTRIES, min_similarity=0.0)
+
+    texts = []
+    start = time.perf_counter()
+    while len(cache) < ENTRIES:
+        text = new_grievance()
+        if cache.add(text, rng.choice(paths)):
+            texts.append(text)
+    build = time.perf_counter() - start
+    print(f"built {len(cache)} entries from {len(sentences)} sentences in {build:.1f} s, {build / len(cache) * 1e6:.0f} us per add")
+
+    matrix = cache._matrix
+    print(f"matrix {matrix.shape[0]} x {matrix.shape[1]} float32, {matrix.nbytes / 2**20:.1f} MiB")
+
+    queries = [refile(rng.choice(texts), vocabulary, rng) if i % 2 else new_grievance() for i in range(LOOKUPS)]
+    vectorize = []
+    timings = []
+    totals = []
+    brute = []
+    near_duplicates = 0
+    found = 0
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        vector = vectorizer.transform(query)
+        vectorize.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        matches = cache._search(vector, cache._projections(vector), 5)
+        timings.append(time.perf_counter() - start)
+        totals.append(vectorize[-1] + timings[-1])
+        results.append((vector, matches))
+    # A separate pass: scanning the whole matrix evicts the CPU caches the lookups use
+    for vector, matches in results:
+        start = time.perf_counter()
+        best = float(np.max(matrix @ vector))
+        brute.append(time.perf_counter() - start)
+        if best >= MIN_SIMILARITY:
+            near_duplicates += 1
+            found += bool(matches) and matches[0][1] >= MIN_SIMILARITY
+
+    print(f"vectorize     p50 {percentile(vectorize, 50) * 1e6:7.1f} us   p99 {percentile(vectorize, 99) * 1e6:7.1f} us")
+    print(f"LSH search    p50 {percentile(timings, 50) * 1e6:7.1f} us   p99 {percentile(timings, 99) * 1e6:7.1f} us")
+    print(f"lookup total  p50 {percentile(totals, 50) * 1e6:7.1f} us   p99 {percentile(totals, 99) * 1e6:7.1f} us")
+    print(f"brute force   p50 {percentile(brute, 50) * 1e6:7.1f} us   p99 {percentile(brute, 99) * 1e6:7.1f} us")
+    print(f"LSH recall at similarity {MIN_SIMILARITY}: {found / max(near_duplicates, 1):.1%} of {near_duplicates} lookups with a near duplicate")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: session I/O on the event loop (blocking) vs. on the session I/O thread pool.
+
+Runs CONCURRENT_SESSIONS chat turns at once against a temporary chat_history
+directory. Each turn loads a session with a long history, appends the user
+and assistant messages and two path updates, and flushes it. The LLM calls
+are replaced by a short sleep. While the turns run, a probe coroutine pings
+the event loop every millisecond to measure how long other requests on the
+same worker would be stalled.
+
+    python tests/bench_session_io.py [concurrent_sessions] [history_length]
+"""
+import sys
+import time
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from utils.chat_utils import SessionStore
+from utils.session_backends import JsonSessionBackend, message_event, path_event
+
+CONCURRENT_SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+HISTORY_LENGTH = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+LLM_LATENCY = 0.05  # stands in for the classifier calls
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def seed_sessions(directory: str):
+    backend = JsonSessionBackend(directory=directory)
+    for i in range(CONCURRENT_SESSIONS):
+        session_data = {
+            "session_id": f"session-{i}",
+            "history": [{"role": "user", "content": "PM Kisan installment not received " * 10}] * HISTORY_LENGTH,
+            "current_path": [],
+            "path_final": "False",
+            "last_updated": ""
+        }
+        backend.write(f"session-{i}", session_data, [])
+
+
+async def blocking_turn(store: SessionStore, session_id: str):
+    store.append_event(session_id, message_event("user", "installment not received"))
+    await asyncio.sleep(LLM_LATENCY)
+    store.append_event(session_id, path_event(["AGRICULTURE DEPARTMENT"]))
+    store.append_event(session_id, path_event(["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE"]))
+    store.append_event(session_id, message_event("assistant", "Which installment was not received?"))
+    store.flush(session_id)
+
+
+async def async_turn(store: SessionStore, session_id: str):
+    await store.append_event_async(session_id, message_event("user", "installment not received"))
+    await asyncio.sleep(LLM_LATENCY)
+    await store.append_event_async(session_id, path_event(["AGRICULTURE DEPARTMENT"]))
+    await store.append_event_async(session_id, path_event(["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE"]))
+    await store.append_event_async(session_id, message_event("assistant", "Which installment was not received?"))
+    await store.flush_async(session_id)
+
+
+async def run(turn, executor=None):
+    with tempfile.TemporaryDirectory() as directory:
+        seed_sessions(directory)
+        store = SessionStore(backend=JsonSessionBackend(directory=directory), executor=executor)
+        turn_latencies = []
+        probe_latencies = []
+        done = False
+
+        async def timed_turn(session_id):
+            start = time.perf_counter()
+            await turn(store, session_id)
+            turn_latencies.append(time.perf_counter() - start)
+
+        async def probe():
+            while not done:
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                probe_latencies.append(time.perf_counter() - start - 0.001)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(timed_turn(f"session-{i}") for i in range(CONCURRENT_SESSIONS)))
+        wall = time.perf_counter() - start
+        done = True
+        await probe_task
+        return turn_latencies, probe_latencies, wall
+
+
+def report(name, turn_latencies, probe_latencies, wall):
+    print(
+        f"{name:<22} turn p50 {percentile(turn_latencies, 50) * 1000:8.1f} ms   "
+        f"turn p99 {percentile(turn_latencies, 99) * 1000:8.1f} ms   "
+        f"loop stall p99 {percentile(probe_latencies, 99) * 1000:7.1f} ms   "
+        f"wall {wall:.2f} s"
+    )
+
+
+async def main():
+    print(f"{CONCURRENT_SESSIONS} concurrent sessions, {HISTORY_LENGTH} messages of history each\n")
+    report("blocking (before)", *(await run(blocking_turn)))
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="session-io") as executor:
+        report("thread pool (after)", *(await run(async_turn, executor)))
+
+if __name__ == "__main__":
+    asyncio.run(main())
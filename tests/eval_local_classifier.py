@@ -0,0 +1,124 @@
+"""
+Evaluation: the local classifier warm start, tuned on data/PM_Kisan/train.csv.
+
+Trains the TF-IDF + softmax classifier on data/PM_Kisan/train.csv and reports:
+- training, save and load time, and the per-query prediction latency
+- per probability threshold, over FOLDS-fold cross-validation on train.csv:
+  the share of grievances that get a warm start, the levels it skips, and
+  how often the prefix is right (a wrong prefix sends the descent into the
+  wrong subtree), and the warm-start rate on out-of-domain grievances (built
+  from the RDPR tree's leaf names), which should stay at 0
+- the threshold to use: the one skipping the most levels with a
+  cross-validated prefix accuracy of at least TARGET_ACCURACY
+- a held-out check on data/PM_Kisan/test.csv, which plays no part in the
+  choice: the top-1 full-path accuracy (for reference; full paths are never
+  used without the model) and the warm starts at the chosen threshold
+
+    python tests/eval_local_classifier.py [--save data/PM_Kisan/local_classifier.npz]
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+from utils.department_tree import DepartmentTree
+from utils.local_classifier import LocalClassifier, load_labeled_csv
+
+TRAIN_CSV = "data/PM_Kisan/train.csv"
+TEST_CSV = "data/PM_Kisan/test.csv"
+OUT_OF_DOMAIN_TREE = "data/RDPR_tree.json"
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.97, 0.98, 0.99)
+TARGET_ACCURACY = 0.95
+FOLDS = 5
+MIN_SIMILARITY = float(os.getenv("LOCAL_CLASSIFIER_MIN_SIMILARITY", "0.1"))
+
+
+def out_of_domain_queries():
+    with open(OUT_OF_DOMAIN_TREE, "r") as file:
+        tree = DepartmentTree.of(json.load(file))
+    return [f"I have a complaint about {path[-1].lower()} under {path[-2].lower()}" for path in tree.leaf_paths() if len(path) > 1]
+
+
+def warm_starts(classifier, texts, paths, negatives, threshold):
+    """(prefix, expected) of the grievances that get a warm start, and the out-of-domain ones that do."""
+    taken = []
+    for text, expected in zip(texts, paths):
+        prefix, _, similarity = classifier.predict_prefix(text, threshold)
+        if prefix and similarity >= MIN_SIMILARITY:
+            taken.append((prefix, expected))
+    false_hits = 0
+    for text in negatives:
+        prefix, _, similarity = classifier.predict_prefix(text, threshold)
+        false_hits += bool(prefix) and similarity >= MIN_SIMILARITY
+    return taken, false_hits
+
+
+def prefix_accuracy(taken):
+    return sum(prefix == expected[:len(prefix)] for prefix, expected in taken) / len(taken) if taken else 0.0
+
+
+def main():
+    save_path = sys.argv[sys.argv.index("--save") + 1] if "--save" in sys.argv else None
+    texts, paths = load_labeled_csv(TRAIN_CSV)
+    start = time.perf_counter()
+    classifier = LocalClassifier.train(texts, paths)
+    train_time = time.perf_counter() - start
+
+    model_path = save_path or os.path.join(tempfile.mkdtemp(prefix="local_classifier_"), "model.npz")
+    start = time.perf_counter()
+    classifier.save(model_path)
+    save_time = time.perf_counter() - start
+    start = time.perf_counter()
+    classifier = LocalClassifier.load(model_path)
+    load_time = time.perf_counter() - start
+
+    print(f"Trained on {len(texts)} grievances, {len(classifier.classes)} classes")
+    print(f"Train: {train_time * 1000:.1f} ms, save: {save_time * 1000:.1f} ms, load: {load_time * 1000:.1f} ms "
+          f"({os.path.getsize(model_path) / 1024:.0f} KiB)")
+
+    negatives = out_of_domain_queries()
+    order = list(range(len(texts)))
+    random.Random(0).shuffle(order)
+    folds = [order[fold::FOLDS] for fold in range(FOLDS)]
+    models = []
+    for held_out in folds:
+        held = set(held_out)
+        train = [i for i in order if i not in held]
+        models.append((LocalClassifier.train([texts[i] for i in train], [paths[i] for i in train]), held_out))
+
+    print(f"\nWarm starts, {FOLDS}-fold cross-validation on {TRAIN_CSV} (centroid similarity >= {MIN_SIMILARITY}):\n")
+    print(f"{'threshold':>9}  {'coverage':>8}  {'levels':>6}  {'prefix accuracy':>15}  {'out of domain':>13}")
+    chosen = None
+    for threshold in THRESHOLDS:
+        taken, false_hits = [], 0
+        for model, held_out in models:
+            fold_taken, fold_false_hits = warm_starts(model, [texts[i] for i in held_out], [paths[i] for i in held_out], negatives, threshold)
+            taken += fold_taken
+            false_hits += fold_false_hits
+        levels = sum(len(prefix) for prefix, _ in taken) / len(texts)
+        accuracy = prefix_accuracy(taken)
+        print(f"{threshold:>9.2f}  {len(taken) / len(texts):>8.1%}  {levels:>6.2f}  {accuracy:>15.1%}  "
+              f"{false_hits / (len(negatives) * FOLDS):>13.1%}")
+        if taken and accuracy >= TARGET_ACCURACY and not false_hits and (chosen is None or levels > chosen[1]):
+            chosen = (threshold, levels)
+    if chosen is None:
+        print(f"\nNo threshold reaches {TARGET_ACCURACY:.0%} prefix accuracy; keep LOCAL_CLASSIFIER_ENABLED=false")
+        return
+    print(f"\nLOCAL_CLASSIFIER_THRESHOLD={chosen[0]}: {chosen[1]:.2f} levels skipped per grievance "
+          f"at >= {TARGET_ACCURACY:.0%} cross-validated prefix accuracy")
+
+    test_texts, test_paths = load_labeled_csv(TEST_CSV)
+    start = time.perf_counter()
+    predictions = [classifier.predict(text) for text in test_texts]
+    print(f"\nHeld-out check on {len(test_texts)} grievances of {TEST_CSV} (model trained on all of {TRAIN_CSV}):")
+    print(f"Predict: {(time.perf_counter() - start) / len(test_texts) * 1000:.2f} ms per query")
+    correct = sum(path == expected for (path, _, _), expected in zip(predictions, test_paths))
+    print(f"Top-1 full-path accuracy: {correct / len(test_texts):.1%}")
+    taken, false_hits = warm_starts(classifier, test_texts, test_paths, negatives, chosen[0])
+    print(f"At threshold {chosen[0]}: coverage {len(taken) / len(test_texts):.1%}, "
+          f"{sum(len(prefix) for prefix, _ in taken) / len(test_texts):.2f} levels skipped, "
+          f"prefix accuracy {prefix_accuracy(taken):.1%}, out of domain {false_hits / len(negatives):.1%}")
+
+if __name__ == "__main__":
+    main()
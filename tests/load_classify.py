@@ -0,0 +1,82 @@
+"""
+Load test: classification throughput of one worker against the offline model.
+
+Runs with LLM_OFFLINE=true: every model call goes to the deterministic
+OfflineBackend, which waits LLM_LATENCY seconds and picks the option sharing
+the most words with the query, so every grievance descends the Agriculture
+tree to a leaf (one model call per level). No cloud project or credentials
+are needed. Grievances run through session_turn and query_classifier exactly
+as in the API handler, against a temporary chat_history directory.
+
+For each concurrency level the same number of grievances is started at once
+and the throughput is reported. The "flat" row uses the single-shot flat
+classification mode. The "blocking" row is the old behaviour: the model call
+blocks the event loop, so concurrency does not help.
+
+    python tests/load_classify.py [grievances] [llm_latency_seconds]
+"""
+import os
+import sys
+import time
+import atexit
+import shutil
+import asyncio
+import tempfile
+
+GRIEVANCES = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+LLM_LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+
+os.environ["LLM_OFFLINE"] = "true"
+os.environ["LLM_OFFLINE_LATENCY"] = str(LLM_LATENCY)
+os.environ["CHAT_HISTORY_DIR"] = tempfile.mkdtemp(prefix="load_classify_")
+atexit.register(shutil.rmtree, os.environ["CHAT_HISTORY_DIR"], True)
+# Every grievance has the same text; measure model calls, not cache hits
+os.environ["CLASSIFICATION_CACHE_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+from utils import chat_utils
+from utils.chat_utils import add_to_chat_history, llm_concurrency, query_classifier, session_turn
+from utils.llm_backends import OfflineBackend, full_prompt
+
+
+class BlockingOfflineBackend(OfflineBackend):
+    """The OfflineBackend with a model call that blocks the event loop, as the sync SDK call did."""
+    async def generate_json(self, prompt, history=None, temperature=0.5, prefix=None):
+        self.calls += 1
+        async with llm_concurrency:
+            time.sleep(self.latency)
+        return self.respond(full_prompt(prompt, prefix))
+
+
+async def grievance(session_id: str, mode: str):
+    async with session_turn(session_id):
+        await add_to_chat_history(session_id, "user", "PM Kisan installment not received")
+        result, path = await query_classifier(query="PM Kisan installment not received", chat_session_id=session_id, mode=mode)
+        await add_to_chat_history(session_id, "assistant", result)
+    assert chat_utils.tree_registry.is_leaf(path), path
+
+
+async def run(name: str, concurrency: int, mode: str = "hierarchical"):
+    llm_concurrency.limit = concurrency
+    llm_concurrency.peak = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(grievance(f"{name}-{concurrency}-{i}", mode) for i in range(GRIEVANCES)))
+    wall = time.perf_counter() - start
+    print(
+        f"{name:<9} limit {concurrency:4d}   {GRIEVANCES / wall:7.1f} grievances/s   "
+        f"wall {wall:6.2f} s   peak LLM calls in flight {llm_concurrency.peak}"
+    )
+
+
+def main():
+    print(f"{GRIEVANCES} grievances, {LLM_LATENCY * 1000:.0f} ms per offline model call\n")
+    # A fresh event loop per run: the limiter creates its semaphore per loop
+    for concurrency in (1, 4, 16, 64):
+        asyncio.run(run("async", concurrency))
+    # One call per grievance instead of one per level
+    asyncio.run(run("flat", 64, mode="flat"))
+    chat_utils.llm_router.backends["offline"] = BlockingOfflineBackend(latency=LLM_LATENCY)
+    asyncio.run(run("blocking", 64))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Clarification turns in the three CLARIFY_MODEs, against a stub backend.
+
+Runs with LLM_OFFLINE=true, with the offline backend replaced by a
+StubBackend. The classifier call answers "not found" after LLM_LATENCY
+seconds (with a clarifying question when the prompt asks for one); the
+question call answers after LLM_LATENCY as well. Each mode must return a
+question, and the combined and concurrent modes must take one model latency
+instead of two.
+"""
+import os
+import json
+import time
+import atexit
+import shutil
+import asyncio
+import tempfile
+
+os.environ["LLM_OFFLINE"] = "true"
+os.environ["CHAT_HISTORY_DIR"] = tempfile.mkdtemp(prefix="test_clarify_modes_")
+atexit.register(shutil.rmtree, os.environ["CHAT_HISTORY_DIR"], True)
+os.environ["CLASSIFICATION_CACHE_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+from utils import chat_utils
+from utils.chat_utils import add_to_chat_history, attempt_classification, session_turn
+from utils.llm_backends import StubBackend
+
+LLM_LATENCY = 0.2
+OPTIONS = ["AGRICULTURAL UNIVERSITIES", "DEPARTMENT OF AGRICULTURE"]
+calls = []
+
+
+def answer(prompt: str) -> dict:
+    # The prompt here includes the stage's prefix (the static instructions)
+    if '"classified_department"' not in prompt:
+        calls.append("question")
+        return {"clarifying_question": "Which scheme is your grievance about?"}
+    calls.append("classify")
+    response = {"status": "not found", "classified_department": None}
+    if '"clarifying_question"' in prompt:
+        response["clarifying_question"] = "Is this about a university or the department's schemes?"
+    return response
+
+
+chat_utils.llm_router.backends["offline"] = StubBackend(latency=LLM_LATENCY, answer=answer)
+
+
+async def clarification_turn(mode: str):
+    chat_utils.CLARIFY_MODE = mode
+    calls.clear()
+    session_id = f"clarify-{mode}"
+    async with session_turn(session_id):
+        await add_to_chat_history(session_id, "user", "I have a problem with agriculture")
+        start = time.perf_counter()
+        nature, question = await attempt_classification(
+            query="I have a problem with agriculture",
+            dept_path=["AGRICULTURE DEPARTMENT"],
+            next_children=OPTIONS,
+            session_id=session_id
+        )
+        return nature, question, time.perf_counter() - start
+
+
+async def test_combined():
+    """One round trip returns the question."""
+    print("Testing CLARIFY_MODE=combined:")
+    # One output format, with the question, and examples that show it
+    prompt = chat_utils.CLASSIFY_OR_CLARIFY_PROMPT
+    assert prompt.count("**Output Format") == 1 and prompt.count('"clarifying_question": null') == 1
+    nature, question, wall = await clarification_turn("combined")
+    assert nature == "question" and question.startswith("Is this about"), question
+    assert calls == ["classify"] and wall < 1.5 * LLM_LATENCY, (calls, wall)
+    print("✓ Test passed\n")
+
+
+async def test_concurrent():
+    """Both calls run at once, so the turn takes one model latency."""
+    print("Testing CLARIFY_MODE=concurrent:")
+    nature, question, wall = await clarification_turn("concurrent")
+    assert nature == "question" and question.startswith("Which scheme"), question
+    assert sorted(calls) == ["classify", "question"] and wall < 1.5 * LLM_LATENCY, (calls, wall)
+    print("✓ Test passed\n")
+
+
+async def test_sequential():
+    """The old behaviour: the question call waits for the classifier."""
+    print("Testing CLARIFY_MODE=sequential:")
+    nature, question, wall = await clarification_turn("sequential")
+    assert nature == "question" and question.startswith("Which scheme"), question
+    assert calls == ["classify", "question"] and wall >= 2 * LLM_LATENCY, (calls, wall)
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    await test_combined()
+    await test_concurrent()
+    await test_sequential()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
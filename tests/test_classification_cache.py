@@ -0,0 +1,83 @@
+import os
+import time
+import asyncio
+import tempfile
+from vertexai.generative_models import Content, Part
+from utils.classification_cache import ClassificationCache, SqliteCacheStore, classification_cache_key
+
+FOUND = {"status": "found", "classified_department": "DEPARTMENT OF AGRICULTURE"}
+OPTIONS = ["AGRICULTURAL UNIVERSITIES", "DEPARTMENT OF AGRICULTURE"]
+
+
+def history(*texts):
+    return [Content(role="user", parts=[Part.from_text(text)]) for text in texts]
+
+
+def test_cache_key():
+    """Near-verbatim queries share a key; path, options, history and tree version do not."""
+    print("Testing classification_cache_key:")
+    key = classification_cache_key("PM Kisan installment not received", ["AGRICULTURE DEPARTMENT"], OPTIONS, history("PM Kisan installment not received"), "v1")
+    assert key == classification_cache_key("pm kisan  installment NOT received!", ["AGRICULTURE DEPARTMENT"], OPTIONS, history("PM-Kisan installment not received."), "v1")
+    assert key != classification_cache_key("PM Kisan installment not received", [], OPTIONS, history("PM Kisan installment not received"), "v1")
+    assert key != classification_cache_key("PM Kisan installment not received", ["AGRICULTURE DEPARTMENT"], OPTIONS[:1], history("PM Kisan installment not received"), "v1")
+    assert key != classification_cache_key("PM Kisan installment not received", ["AGRICULTURE DEPARTMENT"], OPTIONS, history("Seeds not supplied"), "v1")
+    assert key != classification_cache_key("PM Kisan installment not received", ["AGRICULTURE DEPARTMENT"], OPTIONS, history("PM Kisan installment not received"), "v2")
+    print("✓ Test passed\n")
+
+
+def test_lru_ttl_and_tree_version():
+    """Entries expire, the LRU is bounded and a new tree version clears the cache."""
+    print("Testing ClassificationCache LRU, TTL and invalidation:")
+    cache = ClassificationCache(max_entries=2, ttl=0.2)
+    cache.check_tree_version("v1")
+    cache.put("a", FOUND)
+    cache.put("b", FOUND)
+    assert cache.get("a") == FOUND
+    cache.put("c", FOUND)
+    assert cache.get("b") is None, "Least recently used entry should be evicted"
+    time.sleep(0.25)
+    assert cache.get("a") is None, "Entry should expire after the TTL"
+
+    cache.put("d", FOUND)
+    cache.check_tree_version("v1")
+    assert cache.get("d") == FOUND
+    cache.check_tree_version("v2")
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2, cache.stats()
+    print("✓ Test passed\n")
+
+
+async def test_disk_persistence():
+    """Results written through to SQLite are served by a fresh cache (a restarted worker)."""
+    print("Testing ClassificationCache disk persistence:")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "classification_cache.db")
+        cache = ClassificationCache(store=SqliteCacheStore(path))
+        await cache.put_async("key", FOUND)
+        assert await cache.get_async("key") == FOUND
+
+        restarted = ClassificationCache(store=SqliteCacheStore(path))
+        assert await restarted.get_async("key") == FOUND
+        assert await restarted.get_async("missing") is None
+        stats = restarted.stats()
+        assert stats["disk_hits"] == 1 and stats["hits"] == 1 and stats["misses"] == 1, stats
+
+        expired = ClassificationCache(ttl=-1, store=SqliteCacheStore(path))
+        await expired.put_async("old", FOUND)
+        assert await ClassificationCache(store=SqliteCacheStore(path)).get_async("old") is None
+        assert SqliteCacheStore(path).prune() == 1
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_cache_key()
+    test_lru_ttl_and_tree_version()
+    await test_disk_persistence()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Streaming classification turns (/continue_chat_classify/stream) with LLM_OFFLINE=true.
+
+The offline backend answers after LLM_LATENCY seconds per call, so the first
+level event must arrive after about one call, well before the whole descent
+finishes, and a clarifying question must arrive as several question events.
+"""
+import os
+import json
+import time
+import atexit
+import shutil
+import asyncio
+import tempfile
+
+os.environ["LLM_OFFLINE"] = "true"
+os.environ["LLM_OFFLINE_LATENCY"] = "0.05"
+os.environ["CHAT_HISTORY_DIR"] = tempfile.mkdtemp(prefix="test_classification_stream_")
+atexit.register(shutil.rmtree, os.environ["CHAT_HISTORY_DIR"], True)
+os.environ["CLASSIFICATION_CACHE_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+from api_app import ChatRequest, classify_grievance_stream
+from utils import chat_utils
+from utils.classification_stream import JsonStringField, QuestionRelay, classification_events
+
+LLM_LATENCY = 0.05
+
+
+def test_json_string_field():
+    """The field's value comes out piece by piece, whatever the chunk boundaries."""
+    print("Testing JsonStringField:")
+    text = json.dumps({"classified_department": None, "status": "not found",
+                       "clarifying_question": 'Is it the "PM Kisan" scheme – or a loan?\nPlease say.'})
+    for size in (1, 3, 7, len(text)):
+        field = JsonStringField("clarifying_question")
+        pieces = [field.feed(text[start:start + size]) for start in range(0, len(text), size)]
+        assert "".join(pieces) == json.loads(text)["clarifying_question"] and field.done, size
+    field = JsonStringField("clarifying_question")
+    assert field.feed('{"status": "found", "clarifying_question": null}') == "" and not field.done
+    print("✓ Test passed\n")
+
+
+def test_question_relay():
+    """A held relay sends nothing until released; finish() sends what was not streamed."""
+    print("Testing QuestionRelay:")
+    events = []
+    with classification_events(lambda event, data: events.append(data["delta"])):
+        relay = QuestionRelay(live=False)
+        relay("Which ")
+        assert events == []
+        relay.release()
+        relay("scheme?")
+        relay.finish("Which scheme?")
+        QuestionRelay().finish("A cached question?")
+    assert events == ["Which ", "scheme?", "A cached question?"], events
+    print("✓ Test passed\n")
+
+
+async def stream_turn(session_id: str, query: str):
+    """(seconds, event, data) for each event of one streamed turn."""
+    response = await classify_grievance_stream(ChatRequest(query=query, session_id=session_id))
+    assert response.media_type == "text/event-stream"
+    start = time.perf_counter()
+    events = []
+    async for message in response.body_iterator:
+        if message.startswith(":"):
+            continue
+        event, data = message.strip().split("\n")
+        events.append((time.perf_counter() - start, event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+async def test_levels_stream_before_the_descent_ends():
+    print("Testing level events:")
+    events = await stream_turn("stream-1", "Seeds supplied by the Karnataka State Seeds Corporation did not germinate")
+    names = [event for _, event, _ in events]
+    assert names[-1] == "summary" and names.count("level") >= 3, names
+    levels = [(elapsed, data) for elapsed, event, data in events if event == "level"]
+    summary = events[-1][2]
+    assert levels[-1][1]["path"] == summary["path"], "The last level is the final path"
+    assert levels[1][0] < 2.5 * LLM_LATENCY < events[-1][0], "The first classified level arrives after about one call"
+    assert all(len(b["path"]) == len(a["path"]) + 1 for (_, a), (_, b) in zip(levels, levels[1:]))
+    print("✓ Test passed\n")
+
+
+async def test_question_streams_in_pieces():
+    print("Testing streamed clarifying questions:")
+    # Ask instead of guessing when no option matches the query
+    chat_utils.llm_router.backends["offline"].decisive = False
+    for mode in ("combined", "concurrent", "sequential"):
+        chat_utils.CLARIFY_MODE = mode
+        events = await stream_turn(f"stream-question-{mode}", "I have a problem with my application")
+        deltas = [data["delta"] for _, event, data in events if event == "question"]
+        summary = events[-1][2]
+        assert events[-1][1] == "summary" and len(deltas) > 1, (mode, events)
+        assert "".join(deltas) == summary["result"] and summary["result"].startswith("Is your grievance about"), mode
+    chat_utils.CLARIFY_MODE = "combined"
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_json_string_field()
+    test_question_relay()
+    await test_levels_stream_before_the_descent_ends()
+    await test_question_streams_in_pieces()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
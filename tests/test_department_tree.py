@@ -0,0 +1,147 @@
+import os
+import json
+import shutil
+import tempfile
+from utils.department_tree import DepartmentTree, TreeRegistry
+from utils.tree_snapshot import TreeSnapshot, write_snapshot
+from utils.name_resolver import NameResolver
+
+with open("utils/Agriculture_tree.json", "r") as file:
+    agriculture_tree = json.load(file)
+
+
+def test_is_leaf():
+    """Same cases as test_check_if_final_department in test3.py, against the index."""
+    print("Testing DepartmentTree.is_leaf:")
+    tree = DepartmentTree(agriculture_tree)
+    test_cases = [
+        ([], False),
+        (["AGRICULTURE DEPARTMENT"], False),
+        (["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE"], False),
+        (["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE", "EMPLOYEE BENEFIT", "FACING ISSUES RELATED TO EMPLOYEE BENEFITS", "ISSUE RELATED TO ESI"], True),
+        (["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE", "KARNATAKA CROP SURVEY- TO CAPTURE THE DETAILS OF CROPS GROWN BY THE FARMING COMMUNITY", "ISSUES RELATED TO APPLICATION", "APPLICATION HAS BEEN SUBMITTED BUT NOT PROCESSED"], True),
+        (["AGRICULTURE DEPARTMENT", "KARNATAKA STATE SEEDS CORPORATION LIMITED", "PRODUCTION AND DISTRIBUTION OF GOOD SEEDS TO THE  STATE OF FARMERS", "ISSUES RELATED TO PRODUCTION AND DISTRIBUTION OF GOOD SEEDS TO THE STATE FARMERS", "GENERAL"], True),
+        (["AGRICULTURE DEPARTMENT", "AGRICULTURAL UNIVERSITIES", "EMPLOYEE BENEFIT", "FACING ISSUES RELATED TO EMPLOYEE BENEFITS", "ISSUE RELATED TO PF"], True),
+        (["AGRICULTURE DEPARTMENT", "NOT A REAL DEPARTMENT"], False),
+    ]
+    for path, expected in test_cases:
+        result = tree.is_leaf(path)
+        assert result == expected, f"Failed: Expected {expected}, got {result} for {path}"
+    print("✓ Test passed\n")
+
+
+def test_children_and_node_records():
+    """Children are listed in tree order and nodes carry categ_id and level."""
+    print("Testing DepartmentTree.children:")
+    tree = DepartmentTree(agriculture_tree)
+    assert tree.children([]) == [node["name"] for node in agriculture_tree]
+    assert tree.children(["AGRICULTURE DEPARTMENT"]) == [node["name"] for node in agriculture_tree[0]["children"]]
+    assert tree.children(["AGRICULTURE DEPARTMENT", "NOT A REAL DEPARTMENT"]) == []
+
+    node = tree.get(["AGRICULTURE DEPARTMENT"])
+    assert node.categ_id == "705" and node.level == 0 and not node.is_leaf
+    assert all(tree.is_leaf(path) for path in tree.leaf_paths())
+    assert DepartmentTree.of(agriculture_tree) is DepartmentTree.of(agriculture_tree)
+    print("✓ Test passed\n")
+
+
+def test_tree_registry():
+    """Trees are discovered up front, compiled on first use and routed by query."""
+    print("Testing TreeRegistry:")
+    registry = TreeRegistry(["utils", "data"])
+    assert registry.keys() == ["Agriculture", "RDPR"], registry.keys()
+    assert registry.loaded_keys() == []
+
+    assert registry.children([]) == ["AGRICULTURE DEPARTMENT", "RURAL DEVELOPMENT AND PANCHAYATH RAJ DEPARTMENT"]
+    assert registry.loaded_keys() == [], "Routing profiles should not keep compiled trees"
+    assert registry.children(["AGRICULTURE DEPARTMENT"]) == [node["name"] for node in agriculture_tree[0]["children"]]
+    assert registry.loaded_keys() == ["Agriculture"]
+
+    assert registry.route("PM Kisan installment not received") == "AGRICULTURE DEPARTMENT"
+    assert registry.route("drinking water supply stopped in my village") == "RURAL DEVELOPMENT AND PANCHAYATH RAJ DEPARTMENT"
+    assert registry.route("I have a problem") is None
+    # Generic words and a one-word lead are not enough to pick a tree
+    for query in ("Kisan samman nidhi money not credited to my account, no payment",
+                  "crop insurance claim form not processed", "fertilizer shortage in my village"):
+        assert registry.route(query) is None, query
+    roots = registry.children([])
+    assert registry.order_roots("drinking water supply stopped in my village", roots) == roots[::-1]
+    assert registry.order_roots("I have a problem", roots) == roots
+    print("✓ Test passed\n")
+
+
+def test_tree_snapshot_and_reload():
+    """A compiled snapshot answers like the JSON index and is swapped in when rebuilt."""
+    print("Testing TreeSnapshot and TreeRegistry reload:")
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "Agriculture_tree.json")
+        shutil.copy("utils/Agriculture_tree.json", json_path)
+        snapshot = TreeSnapshot.load(write_snapshot(json_path))
+        tree = DepartmentTree(agriculture_tree)
+        assert len(snapshot) == len(tree)
+        for path, node in tree.iter_paths():
+            assert snapshot.children(path) == node.children, path
+            assert snapshot.get(path).categ_id == node.categ_id
+        assert list(snapshot.leaf_paths()) == list(tree.leaf_paths())
+        assert snapshot.tree == agriculture_tree
+        assert not snapshot.contains(["AGRICULTURE DEPARTMENT", "NOT A REAL DEPARTMENT"])
+
+        registry = TreeRegistry([directory], reload_interval=0)
+        assert registry.files["Agriculture"].endswith(".snap")
+        old_tree = registry.get("Agriculture")
+        assert isinstance(old_tree, TreeSnapshot)
+        children = old_tree.children(["AGRICULTURE DEPARTMENT"])
+
+        # Rebuild with one department renamed; the registry picks it up without a restart
+        edited = json.loads(json.dumps(agriculture_tree))
+        edited[0]["children"][0]["name"] = "RENAMED DEPARTMENT"
+        with open(json_path, "w") as file:
+            json.dump(edited, file)
+        write_snapshot(json_path)
+        generation = registry.generation
+        assert registry.children(["AGRICULTURE DEPARTMENT"])[0] == "RENAMED DEPARTMENT"
+        assert registry.generation == generation + 1
+        # The old tree keeps working for requests that still hold it
+        assert old_tree.children(["AGRICULTURE DEPARTMENT"]) == children
+    print("✓ Test passed\n")
+
+
+def test_name_resolver():
+    """Near-miss department names from the model snap to the exact sibling or are rejected."""
+    print("Testing NameResolver:")
+    tree = DepartmentTree(agriculture_tree)
+    resolver = NameResolver()
+    seeds_path = ["AGRICULTURE DEPARTMENT", "KARNATAKA STATE SEEDS CORPORATION LIMITED"]
+    seeds = "PRODUCTION AND DISTRIBUTION OF GOOD SEEDS TO THE  STATE OF FARMERS"
+    pm_kisan_path = ["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE"]
+    pm_kisan = "PM-KISAN- DISBURSEMENT OF FINANCIALL ASSISTANCE TO THE FARMERS FOR PURCHASE OF AGRI-INPUTS."
+    test_cases = [
+        (seeds_path, seeds, seeds, "exact"),
+        (seeds_path, "Production and distribution of good seeds to the state of farmers", seeds, "normalized"),
+        (pm_kisan_path, "PM-KISAN- DISBURSEMENT OF FINANCIAL ASSISTANCE TO THE FARMERS FOR PURCHASE OF AGRI-INPUTS", pm_kisan, "edit_distance"),
+        (["AGRICULTURE DEPARTMENT"], "KARNATAKA STATE SEEDS CORPORATION", "KARNATAKA STATE SEEDS CORPORATION LIMITED", "token_overlap"),
+        (["AGRICULTURE DEPARTMENT"], "HORTICULTURE DEPARTMENT", None, "rejected"),
+        (["AGRICULTURE DEPARTMENT"], None, None, "rejected"),
+    ]
+    for path, candidate, expected, quality in test_cases:
+        result = resolver.resolve(candidate, tree.children(path))
+        assert result == (expected, quality), f"Failed: Expected {(expected, quality)}, got {result} for {candidate!r}"
+    stats = resolver.stats()
+    assert stats["snapped"] == 3 and stats["rejected"] == 2 and stats["exact"] == 1, stats
+    print("✓ Test passed\n")
+
+
+def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_is_leaf()
+    test_children_and_node_records()
+    test_tree_registry()
+    test_tree_snapshot_and_reload()
+    test_name_resolver()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    main()
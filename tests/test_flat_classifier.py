@@ -0,0 +1,93 @@
+import os
+import json
+import shutil
+import tempfile
+from utils.department_tree import TreeRegistry
+from utils.flat_classifier import FlatClassifier, LeafPathIndex, format_shortlist, load_leaf_paths
+
+PM_KISAN = ("AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE", "PM-KISAN- DISBURSEMENT OF FINANCIALL ASSISTANCE TO THE FARMERS FOR PURCHASE OF AGRI-INPUTS.")
+AMOUNT_NOT_RECEIVED = PM_KISAN + ("ISSUES RELATED TO SUBSIDY AMOUNT", "AMOUNT NOT RECEIVED")
+APPLY_ONLINE = PM_KISAN + ("ISSUES RELATED TO APPLICATION", "UNABLE TO APPLY FOR THE SCHEME", "UNABLE TO APPLY ONLINE")
+
+
+def test_load_leaf_paths():
+    """Repeated lines are dropped and so are the trailing NAN levels."""
+    print("Testing load_leaf_paths:")
+    paths = load_leaf_paths("data/department_strings.txt")
+    assert len(paths) == len(set(paths)) == 7, paths
+    assert AMOUNT_NOT_RECEIVED in paths and APPLY_ONLINE in paths
+    assert all("NAN" not in path for path in paths)
+    print("✓ Test passed\n")
+
+
+def test_shortlist():
+    """The best-matching leaf comes first; a prefix keeps only the paths below it."""
+    print("Testing LeafPathIndex.shortlist:")
+    index = LeafPathIndex(load_leaf_paths("data/department_strings.txt"))
+    shortlist = index.shortlist("The PM Kisan amount was not received in my account this year", k=3)
+    assert shortlist[0][0] == AMOUNT_NOT_RECEIVED, shortlist
+    assert len(shortlist) == 3 and shortlist[0][1] >= shortlist[1][1] >= shortlist[2][1]
+    assert index.shortlist("I am unable to apply online for the scheme")[0][0] == APPLY_ONLINE
+
+    application = PM_KISAN + ("ISSUES RELATED TO APPLICATION",)
+    assert all(path[:4] == application for path, _ in index.shortlist("amount not received", prefix=application))
+    assert index.shortlist("amount not received", prefix=["RURAL DEVELOPMENT AND PANCHAYATH RAJ DEPARTMENT"]) == []
+    assert format_shortlist(shortlist[:1]) == "1. " + " > ".join(AMOUNT_NOT_RECEIVED)
+    print("✓ Test passed\n")
+
+
+def test_choose_confidence_gate():
+    """Only a confident answer that names a shortlisted path is used."""
+    print("Testing FlatClassifier.choose:")
+    flat_classifier = FlatClassifier(TreeRegistry(["utils", "data"]), "data/department_strings.txt", min_confidence=0.7)
+    shortlist = flat_classifier.shortlist("PM Kisan installment amount not received")
+    assert shortlist
+
+    assert flat_classifier.choose({"status": "found", "path_number": 1, "confidence": 0.9}, shortlist) == list(shortlist[0][0])
+    assert flat_classifier.choose({"status": "found", "path_number": 1, "confidence": 0.5}, shortlist) is None
+    assert flat_classifier.choose({"status": "found", "path_number": len(shortlist) + 1, "confidence": 0.9}, shortlist) is None
+    assert flat_classifier.choose({"status": "not found", "path_number": None, "confidence": 0.0}, shortlist) is None
+    assert flat_classifier.shortlist("Drinking water supply stopped in our village") == []
+
+    stats = flat_classifier.stats()
+    assert stats["leaf_paths"] == 7 and stats["attempts"] == 2, stats
+    assert stats["resolved"] == 1 and stats["low_confidence"] == 3 and stats["no_shortlist"] == 1, stats
+    print("✓ Test passed\n")
+
+
+def test_tree_leaves_and_reload():
+    """Without a file every leaf of the trees is a candidate, and a changed tree is re-indexed."""
+    print("Testing FlatClassifier over tree leaves:")
+    directory = tempfile.mkdtemp()
+    try:
+        tree = [{"name": "WATER", "children": [{"name": "NO SUPPLY"}, {"name": "DIRTY WATER"}]}]
+        with open(os.path.join(directory, "Water_tree.json"), "w") as file:
+            json.dump(tree, file)
+        registry = TreeRegistry([directory], reload_interval=0)
+        flat_classifier = FlatClassifier(registry, min_score=0.0)
+        assert flat_classifier.shortlist("the water is dirty")[0][0] == ("WATER", "DIRTY WATER")
+
+        tree[0]["children"].append({"name": "BROKEN PIPE"})
+        with open(os.path.join(directory, "Water_tree.json"), "w") as file:
+            json.dump(tree, file)
+        os.utime(os.path.join(directory, "Water_tree.json"), ns=(1, 1))
+        assert flat_classifier.shortlist("broken pipe on our street")[0][0] == ("WATER", "BROKEN PIPE")
+        assert flat_classifier.stats()["leaf_paths"] == 3
+    finally:
+        shutil.rmtree(directory)
+    print("✓ Test passed\n")
+
+
+def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_load_leaf_paths()
+    test_shortlist()
+    test_choose_confidence_gate()
+    test_tree_leaves_and_reload()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    main()
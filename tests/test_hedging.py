@@ -0,0 +1,100 @@
+import asyncio
+from utils.llm_backends import BackendRouter, Hedger, StubBackend
+
+PROMPT = "Candidate Paths:\n1. AGRICULTURE DEPARTMENT > AGRICULTURAL UNIVERSITIES"
+
+
+class SlowOnceBackend(StubBackend):
+    """Answers after `latency`, except every `every`-th call, which stalls for `stall` seconds."""
+    def __init__(self, every: int, stall: float, **kwargs):
+        super().__init__(**kwargs)
+        self.every = every
+        self.stall = stall
+        self.cancelled = 0
+
+    async def generate_json(self, prompt, history=None, temperature=0.5, prefix=None):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.stall if self.calls % self.every == 0 else self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.respond(prompt)
+
+
+async def warm_up(router: BackendRouter, calls: int):
+    for _ in range(calls):
+        await router.generate("flat", PROMPT)
+
+
+def test_deadline_percentile():
+    print("Testing Hedger.deadline:")
+    hedger = Hedger(percentile=0.9, min_samples=10)
+    for latency in range(1, 10):
+        hedger.observe("classify", "gemini", latency / 100)
+    assert hedger.deadline("classify", "gemini") is None, "Too few samples for a deadline"
+    hedger.observe("classify", "gemini", 1.0)
+    assert hedger.deadline("classify", "gemini") == 1.0
+    assert hedger.deadline("classify", "other") is None
+    print("✓ Test passed\n")
+
+
+async def test_hedge_to_secondary():
+    """A stalled primary call is hedged to the secondary backend, which wins; the primary is cancelled."""
+    print("Testing a hedge to the secondary backend:")
+    primary = SlowOnceBackend(every=30, stall=1.0, latency=0.01, name="primary")
+    secondary = StubBackend(latency=0.03, name="secondary")
+    hedger = Hedger(percentile=0.95, max_rate=0.1, min_samples=20)
+    router = BackendRouter({"primary": primary, "secondary": secondary}, {"flat": ["primary", "secondary"]},
+                           explore=0.0, hedger=hedger)
+    # The router tries each backend once, then keeps to the faster primary
+    await warm_up(router, 30)
+    assert hedger.hedges == 0 and primary.calls == 29 and secondary.calls == 1
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    assert (await router.generate("flat", PROMPT))["path_number"] == 1
+    assert loop.time() - start < 0.2, "The hedge answers long before the stalled call"
+    await asyncio.sleep(0)
+    assert hedger.hedges == 1 and hedger.hedge_wins == 1 and secondary.calls == 2
+    assert primary.cancelled == 1, "The losing call is cancelled"
+    print("✓ Test passed\n")
+
+
+async def test_hedge_to_same_backend():
+    print("Testing a hedge to the same backend:")
+    backend = SlowOnceBackend(every=25, stall=1.0, latency=0.01, name="gemini")
+    hedger = Hedger(percentile=0.95, max_rate=0.1, min_samples=20, to_secondary=False)
+    router = BackendRouter({"gemini": backend}, {"flat": ["gemini"]}, explore=0.0, hedger=hedger)
+    await warm_up(router, 24)
+    assert (await router.generate("flat", PROMPT))["path_number"] == 1
+    await asyncio.sleep(0)
+    assert backend.calls == 26 and backend.cancelled == 1 and hedger.hedge_wins == 1
+    print("✓ Test passed\n")
+
+
+async def test_hedge_budget():
+    """With half the calls slow, no more than max_rate of the calls are hedged."""
+    print("Testing the hedge budget:")
+    backend = SlowOnceBackend(every=2, stall=0.05, latency=0.005, name="gemini")
+    hedger = Hedger(percentile=0.5, max_rate=0.1, min_samples=5, to_secondary=False)
+    router = BackendRouter({"gemini": backend}, {"flat": ["gemini"]}, explore=0.0, hedger=hedger)
+    await warm_up(router, 60)
+    stats = hedger.stats()
+    assert 0 < stats["hedges"] <= 0.1 * stats["calls"], stats
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_deadline_percentile()
+    await test_hedge_to_secondary()
+    await test_hedge_to_same_backend()
+    await test_hedge_budget()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
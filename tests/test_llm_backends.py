@@ -0,0 +1,227 @@
+import json
+import random
+import asyncio
+from types import SimpleNamespace
+from utils.llm_backends import (BackendRouter, OpenAIChatBackend, StubBackend, history_messages, load_router,
+                                parse_json_object)
+from utils.token_usage import approx_tokens, report_usage
+
+OPTIONS = ["AGRICULTURAL UNIVERSITIES", "KARNATAKA STATE SEEDS CORPORATION LIMITED"]
+CLASSIFY_PROMPT = "\n".join((
+    'Output: {"classified_department": "...", "status": "found"}',
+    "User Query: Seeds supplied by the corporation did not germinate",
+    f"Current Level Department Options (topic and summary): {json.dumps(OPTIONS, indent=2)}",
+    "Write a clarifying question in JSON format only."
+))
+
+
+class ReportingBackend(StubBackend):
+    """Reports provider token counts, like the Vertex and OpenAI backends."""
+    async def generate_json(self, prompt, history=None, temperature=0.5, prefix=None):
+        report_usage(input_tokens=1200, output_tokens=30, cached_tokens=1024)
+        return await super().generate_json(prompt, history=history, temperature=temperature, prefix=prefix)
+
+
+class FailingBackend(StubBackend):
+    async def generate_json(self, prompt, history=None, temperature=0.5, prefix=None):
+        self.calls += 1
+        raise ConnectionError("backend down")
+
+
+class FlakyBackend(StubBackend):
+    """Fails while `down` is set."""
+    down = False
+
+    async def generate_json(self, prompt, history=None, temperature=0.5, prefix=None):
+        if self.down:
+            self.calls += 1
+            raise ConnectionError("backend down")
+        return await super().generate_json(prompt, history=history, temperature=temperature, prefix=prefix)
+
+
+def test_stub_backend():
+    """The stub answers each stage in the shape the pipeline expects."""
+    print("Testing StubBackend:")
+    stub = StubBackend()
+    assert stub.respond(CLASSIFY_PROMPT)["classified_department"] == "KARNATAKA STATE SEEDS CORPORATION LIMITED"
+    vague = CLASSIFY_PROMPT.replace("Seeds supplied by the corporation did not germinate", "I have a problem")
+    assert stub.respond(vague)["classified_department"] == OPTIONS[0]
+    assert StubBackend(decisive=False).respond(vague)["status"] == "not found"
+    assert stub.respond("Candidate Paths:\n1. A > B")["path_number"] == 1
+    assert "clarifying_question" in stub.respond("Write a clarifying question in JSON format only.")
+    print("✓ Test passed\n")
+
+
+def test_history_and_parsing():
+    print("Testing history_messages and parse_json_object:")
+    gemini = [SimpleNamespace(role="user", parts=[SimpleNamespace(text="PM Kisan")]),
+              SimpleNamespace(role="model", parts=[SimpleNamespace(text="Which installment?")])]
+    assert history_messages(gemini) == [("user", "PM Kisan"), ("assistant", "Which installment?")]
+    assert history_messages([SimpleNamespace(role="user", content="hi")]) == [("user", "hi")]
+    assert parse_json_object('```json\n{"status": "found"}\n```') == {"status": "found"}
+    print("✓ Test passed\n")
+
+
+async def test_openai_backend_messages():
+    """History and prompt become chat messages, and the JSON reply is parsed."""
+    print("Testing OpenAIChatBackend:")
+    sent = {}
+
+    async def create(**kwargs):
+        sent.update(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"status": "not found"}'))])
+
+    backend = OpenAIChatBackend("ft:gpt-4o-mini-2024-07-18:newron-ai:grievance-classifier-v2:BXstPr1J")
+    backend._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    history = [SimpleNamespace(role="model", parts=[SimpleNamespace(text="Which scheme?")])]
+    assert await backend.generate_json("classify this", history=history, temperature=0.1) == {"status": "not found"}
+    assert sent["messages"] == [{"role": "assistant", "content": "Which scheme?"}, {"role": "user", "content": "classify this"}]
+    assert sent["temperature"] == 0.1 and sent["response_format"] == {"type": "json_object"}
+    print("✓ Test passed\n")
+
+
+async def test_router_prefers_the_faster_backend():
+    """After each backend has been tried, calls go to the one with the lower rolling latency."""
+    print("Testing BackendRouter latency routing:")
+    slow, fast = StubBackend(latency=0.03, name="slow"), StubBackend(latency=0.005, name="fast")
+    router = BackendRouter({"slow": slow, "fast": fast}, {"classify": ["slow", "fast"]}, explore=0.0)
+    for _ in range(10):
+        await router.generate("classify", CLASSIFY_PROMPT)
+    assert slow.calls == 1 and fast.calls == 9, (slow.calls, fast.calls)
+
+    # The fast backend gets slow: traffic moves back once its average passes the other's
+    fast.latency = 0.1
+    for _ in range(10):
+        await router.generate("classify", CLASSIFY_PROMPT)
+    assert slow.calls > 1
+    assert router.stats()["classify/fast"]["calls"] >= 10
+    print("✓ Test passed\n")
+
+
+async def test_router_failover_and_error_rate():
+    """A failing backend falls through to the next one and then stops being chosen."""
+    print("Testing BackendRouter failover:")
+    broken, stub = FailingBackend(name="broken"), StubBackend(name="stub")
+    router = BackendRouter({"broken": broken, "stub": stub}, {"classify": ["broken", "stub"]}, explore=0.0)
+    for _ in range(5):
+        assert (await router.generate("classify", CLASSIFY_PROMPT))["status"] == "found"
+    assert broken.calls == 1 and stub.calls == 5
+    assert router.stats()["classify/broken"]["error_rate"] == 1.0
+
+    router = BackendRouter({"broken": broken}, {"classify": ["broken"]})
+    try:
+        await router.generate("classify", CLASSIFY_PROMPT)
+        assert False, "Expected ConnectionError"
+    except ConnectionError:
+        pass
+    print("✓ Test passed\n")
+
+
+async def test_router_recovers_after_an_error_burst():
+    """A backend shut out by a burst of errors gets traffic back once it recovers."""
+    print("Testing BackendRouter recovery:")
+    # Old statistics expire, even with no exploration and no further calls to the backend
+    flaky, stub = FlakyBackend(latency=0.001, name="flaky"), StubBackend(latency=0.005, name="stub")
+    router = BackendRouter({"flaky": flaky, "stub": stub}, {"classify": ["flaky", "stub"]}, explore=0.0, stats_max_age=0.1)
+    flaky.down = True
+    for _ in range(5):
+        await router.generate("classify", CLASSIFY_PROMPT)
+    assert router.order("classify")[0] == "stub" and router.stats()["classify/flaky"]["error_rate"] == 1.0
+    flaky.down = False
+    await asyncio.sleep(0.15)
+    calls = flaky.calls
+    for _ in range(5):
+        await router.generate("classify", CLASSIFY_PROMPT)
+    # The stub's statistics expired as well, so it is tried once more before flaky wins again
+    assert flaky.calls == calls + 4, "The recovered backend is the faster one again"
+
+    # Exploration probes the unhealthy backend, and its successes bring it back
+    flaky, stub = FlakyBackend(latency=0.001, name="flaky"), StubBackend(latency=0.005, name="stub")
+    router = BackendRouter({"flaky": flaky, "stub": stub}, {"classify": ["flaky", "stub"]}, explore=0.3,
+                           rng=random.Random(3), stats_max_age=None)
+    flaky.down = True
+    for _ in range(5):
+        await router.generate("classify", CLASSIFY_PROMPT)
+    flaky.down = False
+    for _ in range(60):
+        await router.generate("classify", CLASSIFY_PROMPT)
+    assert router.stats()["classify/flaky"]["error_rate"] <= router.max_error_rate
+    calls = flaky.calls
+    router.explore = 0.0
+    for _ in range(5):
+        await router.generate("classify", CLASSIFY_PROMPT)
+    assert flaky.calls == calls + 5
+    print("✓ Test passed\n")
+
+
+async def test_prefix_and_token_usage():
+    """The prefix reaches the backend apart from the prompt; tokens are counted per stage."""
+    print("Testing prompt prefix and token accounting:")
+    assert approx_tokens("") == 0 and approx_tokens("Seeds did not germinate.") == 6
+    prefix, prompt = CLASSIFY_PROMPT.split("\n", 1)
+    router = BackendRouter({"stub": StubBackend(), "provider": ReportingBackend(name="provider")},
+                           {"classify": ["stub"], "clarify": ["provider"]})
+    history = [SimpleNamespace(role="user", content="The seeds I bought did not germinate")]
+    assert (await router.generate("classify", prompt, history=history, prefix=prefix))["status"] == "found"
+    await router.generate("clarify", "Write a clarifying question in JSON format only.")
+
+    usage = router.usage.stats()
+    classify = usage["classify"]
+    assert classify["estimated_calls"] == 1 and classify["prefix_tokens"] == approx_tokens(prefix)
+    assert classify["input_tokens"] == approx_tokens(prefix) + approx_tokens(prompt) + approx_tokens(history[0].content)
+    assert usage["clarify"]["input_tokens"] == 1200 and usage["clarify"]["cached_tokens"] == 1024
+    assert usage["clarify"]["estimated_calls"] == 0 and usage["clarify"]["output_tokens"] == 30
+
+    sent = {}
+
+    async def create(**kwargs):
+        sent.update(kwargs)
+        details = SimpleNamespace(cached_tokens=1024)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"status": "found"}'))],
+                               usage=SimpleNamespace(prompt_tokens=1300, completion_tokens=12, prompt_tokens_details=details))
+
+    backend = OpenAIChatBackend("gpt-4o-mini", name="gpt")
+    backend._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    router = BackendRouter({"gpt": backend}, {"classify": ["gpt"]})
+    await router.generate("classify", prompt, history=history, prefix=prefix)
+    assert sent["messages"][0] == {"role": "system", "content": prefix} and sent["messages"][-1]["content"] == prompt
+    assert router.usage.stats()["classify"]["cached_tokens"] == 1024
+    print("✓ Test passed\n")
+
+
+def test_load_router():
+    """Stages the config does not route keep their default backend."""
+    print("Testing load_router:")
+    default = StubBackend(name="default-gemini")
+    router = load_router(
+        {"backends": {"stub": {"type": "stub", "latency": 0.01}}, "stages": {"clarify": ["stub"]}, "routing": {"explore": 0.0}},
+        {"classify": default, "clarify": default}
+    )
+    assert router.stages == {"clarify": ["stub"], "classify": ["default-gemini"]}
+    assert router.backends["stub"].latency == 0.01 and router.explore == 0.0
+    try:
+        load_router({"backends": {}, "stages": {"classify": ["missing"]}}, {})
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    random.seed(0)
+    test_stub_backend()
+    test_history_and_parsing()
+    await test_openai_backend_messages()
+    await test_router_prefers_the_faster_backend()
+    await test_router_failover_and_error_rate()
+    await test_router_recovers_after_an_error_burst()
+    await test_prefix_and_token_usage()
+    test_load_router()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
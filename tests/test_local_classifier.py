@@ -0,0 +1,86 @@
+import os
+import time
+import tempfile
+import numpy as np
+from utils.department_tree import TreeRegistry
+from utils.local_classifier import LocalClassifier, LocalWarmStart, load_labeled_csv
+from utils.name_resolver import name_resolver
+
+PM_KISAN = ["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE", "PM-KISAN- DISBURSEMENT OF FINANCIALL ASSISTANCE TO THE FARMERS FOR PURCHASE OF AGRI-INPUTS."]
+NOT_RECEIVED = PM_KISAN + ["ISSUES RELATED TO SUBSIDY AMOUNT", "AMOUNT NOT RECEIVED"]
+
+TEXTS = [
+    "The PM Kisan amount has not been credited to my bank account for the last installments",
+    "I did not receive the Kisan Samman Nidhi money in my account this year",
+    "My application for PM Kisan was submitted at the CSC center but is still pending approval",
+    "Application submitted for the Kisan scheme has not been processed by the state government",
+]
+PATHS = [
+    ("Agriculture Department", "Department of Agriculture",
+     "PM-KISAN- Disbursement of financiall assistance to the farmers for purchase of agri-inputs.",
+     "Issues related to subsidy amount", "Amount not received"),
+] * 2 + [
+    ("Agriculture Department", "Department of Agriculture",
+     "PM-KISAN- Disbursement of financiall assistance to the farmers for purchase of agri-inputs.",
+     "Issues related to application", "Application has been submitted but not processed"),
+] * 2
+
+
+def test_train_predict():
+    """The classifier separates the classes it was trained on."""
+    print("Testing LocalClassifier.train / predict:")
+    classifier = LocalClassifier.train(TEXTS, PATHS, dimensions=1024)
+    path, probability, similarity = classifier.predict("The Kisan installment amount was not credited to my account")
+    assert path == PATHS[0] and probability > 0.5 and similarity > 0.1, (path, probability, similarity)
+    path, _, _ = classifier.predict("My PM Kisan application is pending at the CSC center")
+    assert path == PATHS[2], path
+    print("✓ Test passed\n")
+
+
+def test_save_load():
+    """A saved model loads in milliseconds and predicts exactly as before."""
+    print("Testing LocalClassifier.save / load:")
+    texts, paths = load_labeled_csv("data/PM_Kisan/train.csv")
+    classifier = LocalClassifier.train(texts, paths)
+    file_path = os.path.join(tempfile.mkdtemp(prefix="test_local_classifier_"), "model.npz")
+    classifier.save(file_path)
+    start = time.perf_counter()
+    loaded = LocalClassifier.load(file_path)
+    assert time.perf_counter() - start < 0.1
+    assert loaded.classes == classifier.classes
+    queries = texts[:10] + ["Drinking water supply stopped in our village"]
+    assert np.allclose(loaded.predict_proba(queries)[0], classifier.predict_proba(queries)[0])
+    print("✓ Test passed\n")
+
+
+def test_warm_start():
+    """Only a proper prefix of the likeliest path is used; unsure or out-of-domain grievances get none."""
+    print("Testing LocalWarmStart:")
+    classifier = LocalClassifier.train(TEXTS, PATHS, dimensions=1024)
+    query = "The Kisan installment amount was not credited to my account"
+    assert classifier.predict_prefix(query, 0.0)[0] == PATHS[0][:-1], "Never the leaf itself"
+
+    warm_start = LocalWarmStart(classifier, TreeRegistry(["utils", "data"]), name_resolver, threshold=0.5, min_similarity=0.1)
+    assert warm_start.warm_start(query) == NOT_RECEIVED[:-1]
+    assert warm_start.warm_start("Drinking water supply stopped in our village for two weeks") == []
+    # Every class shares the first three levels, so a stricter threshold stops there
+    warm_start.threshold = 0.999
+    assert warm_start.warm_start(query) == PM_KISAN
+    warm_start.threshold = 1.01
+    assert warm_start.warm_start(query) == []
+    assert warm_start.stats()["hits"] == 2 and warm_start.stats()["misses"] == 2, warm_start.stats()
+    print("✓ Test passed\n")
+
+
+def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_train_predict()
+    test_save_load()
+    test_warm_start()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    main()
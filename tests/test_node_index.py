@@ -0,0 +1,97 @@
+"""
+Node index ranking and top-k pruning of the per-level classifier prompt.
+
+Runs with LLM_OFFLINE=true; the router's generate is replaced by a script
+of answers so the OTHER escape hatch can be followed call by call.
+"""
+import os
+import json
+import atexit
+import shutil
+import asyncio
+import tempfile
+
+os.environ["LLM_OFFLINE"] = "true"
+os.environ["CHAT_HISTORY_DIR"] = tempfile.mkdtemp(prefix="test_node_index_")
+atexit.register(shutil.rmtree, os.environ["CHAT_HISTORY_DIR"], True)
+os.environ["CLASSIFICATION_CACHE_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+from utils import chat_utils
+from utils.chat_utils import classify_level
+from utils.node_index import OTHER_OPTION, CandidatePruner, NodeIndex
+
+AGRICULTURE = ["AGRICULTURE DEPARTMENT"]
+SEEDS = "KARNATAKA STATE SEEDS CORPORATION LIMITED"
+QUERY = "Seeds supplied by the Karnataka State Seeds Corporation did not germinate"
+
+
+def test_rank_children():
+    """Every child is ranked once; a query naming a deep node ranks its ancestor first."""
+    print("Testing NodeIndex.rank:")
+    registry = chat_utils.tree_registry
+    index = NodeIndex.build(registry)
+    for path in ([], AGRICULTURE):
+        assert sorted(child for child, _ in index.rank(QUERY, path)) == sorted(registry.children(path))
+    assert index.rank(QUERY, AGRICULTURE)[0][0] == SEEDS
+    assert index.rank("PM Kisan installment amount not received", AGRICULTURE)[0][0] == "DEPARTMENT OF AGRICULTURE"
+    assert index.rank(QUERY, ["NO SUCH DEPARTMENT"]) == []
+
+    file_path = os.path.join(os.environ["CHAT_HISTORY_DIR"], "node_index.npz")
+    index.save(file_path)
+    loaded = NodeIndex.load(file_path)
+    assert loaded.digest == index.digest and loaded.rank(QUERY, AGRICULTURE) == index.rank(QUERY, AGRICULTURE)
+    print("✓ Test passed\n")
+
+
+def test_prune():
+    """Only levels wider than k + 1 are cut, and only for a query that matches something."""
+    print("Testing CandidatePruner.prune:")
+    children = chat_utils.tree_registry.children(AGRICULTURE)
+    pruner = CandidatePruner(chat_utils.tree_registry, top_k=[0, 2])
+    assert pruner.prune(QUERY, [], chat_utils.tree_registry.children([])) == (chat_utils.tree_registry.children([]), [])
+    shown, rest = pruner.prune(QUERY, AGRICULTURE, children)
+    assert shown[0] == SEEDS and len(shown) == 2 and sorted(shown + rest) == sorted(children)
+    assert pruner.prune("My neighbour is noisy at night", AGRICULTURE, children) == (children, [])
+    assert CandidatePruner(chat_utils.tree_registry, top_k=[len(children) - 1]).prune(QUERY, AGRICULTURE, children)[1] == []
+    print("✓ Test passed\n")
+
+
+async def test_other_escape_hatch():
+    """The prompt offers the top k and OTHER; OTHER asks again with the children left out."""
+    print("Testing OTHER_OPTION:")
+    children = chat_utils.tree_registry.children(AGRICULTURE)
+    prompts = []
+
+    async def scripted(stage, prompt, **kwargs):
+        options = json.loads(prompt.split("(topic and summary): ", 1)[1].rsplit("\n", 1)[0])
+        prompts.append(options)
+        chosen = OTHER_OPTION if OTHER_OPTION in options else options[-1]
+        return {"status": "found", "classified_department": chosen, "clarifying_question": None}
+
+    chat_utils.candidate_pruner.top_k = [0, 2]
+    generate, chat_utils.llm_router.generate = chat_utils.llm_router.generate, scripted
+    try:
+        response = await classify_level(QUERY, AGRICULTURE, children)
+    finally:
+        chat_utils.llm_router.generate = generate
+        chat_utils.candidate_pruner.top_k = []
+    assert prompts[0][0] == SEEDS and prompts[0][-1] == OTHER_OPTION and len(prompts[0]) == 3, prompts
+    assert sorted(prompts[1]) == sorted(set(children) - set(prompts[0])), prompts
+    assert response["classified_department"] == prompts[1][-1]
+    assert chat_utils.candidate_pruner.stats()["other_chosen"] == 1
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_rank_children()
+    test_prune()
+    await test_other_escape_hatch()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
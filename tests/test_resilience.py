@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import tempfile
+from utils.resilience import CircuitBreaker, ModelUnavailableError, Resilience, TokenBucket, is_retryable, retry_after_header
+
+
+class QuotaExceeded(Exception):
+    # Like google.api_core.exceptions.ResourceExhausted
+    code = 429
+
+
+class BadRequest(Exception):
+    code = 400
+
+
+class FakeClient:
+    """A model API that fails its first `failures` calls with `error` and answers after `latency` seconds."""
+    def __init__(self, failures: int = 0, error=QuotaExceeded, latency: float = 0.01):
+        self.failures = failures
+        self.error = error
+        self.latency = latency
+        self.calls = 0
+
+    async def generate(self, prompt: str) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.calls <= self.failures:
+            raise self.error(f"injected error {self.calls}")
+        return {"status": "found", "prompt": prompt}
+
+
+def test_is_retryable():
+    print("Testing is_retryable:")
+    assert is_retryable(QuotaExceeded()) and is_retryable(asyncio.TimeoutError()) and is_retryable(ConnectionResetError())
+    assert not is_retryable(BadRequest()) and not is_retryable(ValueError())
+    print("✓ Test passed\n")
+
+
+async def test_retry_with_backoff():
+    """Injected 429s are retried with growing jittered delays until the call succeeds."""
+    print("Testing Resilience retries:")
+    client = FakeClient(failures=2)
+    resilience = Resilience(max_retries=3, base_delay=0.02, max_delay=0.1)
+    assert await resilience.call(client.generate, "hello") == {"status": "found", "prompt": "hello"}
+    assert client.calls == 3 and resilience.retries == 2 and resilience.breaker.failures == 0
+
+    client = FakeClient(failures=10)
+    try:
+        await resilience.call(client.generate, "hello")
+        assert False, "Expected ModelUnavailableError"
+    except ModelUnavailableError as e:
+        assert client.calls == 4 and e.retry_after >= 1 and retry_after_header(e) == "1", e.retry_after
+        assert isinstance(e.__cause__, QuotaExceeded)
+
+    client = FakeClient(failures=1, error=BadRequest)
+    try:
+        await resilience.call(client.generate, "hello")
+        assert False, "Expected BadRequest"
+    except BadRequest:
+        assert client.calls == 1, "Non-retryable errors are not retried"
+
+    delays = [resilience.backoff(attempt) for attempt in range(6) for _ in range(50)]
+    assert 0 <= min(delays) and max(delays) <= 0.1
+    print("✓ Test passed\n")
+
+
+async def test_circuit_breaker():
+    """Repeated failures open the breaker; calls fail fast until reset_timeout, then one success closes it."""
+    print("Testing CircuitBreaker:")
+    resilience = Resilience(breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.2), max_retries=5, base_delay=0.001)
+    client = FakeClient(failures=100)
+    try:
+        await resilience.call(client.generate, "hello")
+        assert False, "Expected ModelUnavailableError"
+    except ModelUnavailableError as e:
+        assert client.calls == 3, "The breaker stops the retries once it opens"
+        assert 0 < e.retry_after <= 0.2
+
+    start = time.perf_counter()
+    try:
+        await resilience.call(client.generate, "hello")
+        assert False, "Expected ModelUnavailableError"
+    except ModelUnavailableError:
+        assert client.calls == 3 and time.perf_counter() - start < 0.01, "An open breaker fails fast"
+    assert resilience.stats()["breaker_open"] and resilience.stats()["breaker_rejected"] == 2
+
+    await asyncio.sleep(0.2)
+    client.failures = 0
+    assert (await resilience.call(client.generate, "hello"))["status"] == "found"
+    assert not resilience.stats()["breaker_open"]
+    print("✓ Test passed\n")
+
+
+async def test_shared_token_bucket():
+    """Two buckets on the same file (two workers) draw from one quota."""
+    print("Testing TokenBucket shared through a file:")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bucket")
+        worker_a = TokenBucket(rate=20, capacity=2, path=path)
+        worker_b = TokenBucket(rate=20, capacity=2, path=path)
+        assert worker_a.try_acquire() == 0 and worker_a.try_acquire() == 0
+        wait = worker_b.try_acquire()
+        assert 0 < wait <= 0.05, wait
+
+        client = FakeClient(latency=0)
+        resilience = Resilience(bucket=worker_b)
+        start = time.perf_counter()
+        await asyncio.gather(*(resilience.call(client.generate, str(i)) for i in range(5)))
+        assert time.perf_counter() - start >= 4 / 20 * 0.9, "Five calls at 20 per second"
+        assert worker_b.waited > 0
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_is_retryable()
+    await test_retry_with_backoff()
+    await test_circuit_breaker()
+    await test_shared_token_bucket()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+from utils.semantic_cache import HashedTfidfVectorizer, SemanticCache, common_prefix, strip_identifiers
+
+PM_KISAN = ["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE", "PM-KISAN- DISBURSEMENT OF FINANCIALL ASSISTANCE TO THE FARMERS FOR PURCHASE OF AGRI-INPUTS."]
+NOT_APPROVED = PM_KISAN + ["ISSUES RELATED TO APPLICATION", "APPLICATION HAS BEEN SUBMITTED BUT NOT PROCESSED"]
+SEEDS = ["AGRICULTURE DEPARTMENT", "KARNATAKA STATE SEEDS CORPORATION LIMITED"]
+
+GRIEVANCE = ("I submitted my application for the Kisan Samman Nidhi Scheme through the CSC Center, but it hasn't been "
+             "approved by the Karnataka state government yet. Can you please verify and confirm our details? "
+             "NAME: KARIYAMMA, ADHAAR: 556215633099, DOB: 01/01/1950, FID: CSCKA9939311")
+SAME_GRIEVANCE = ("I submitted my application for the Kisan Samman Nidhi Scheme through the CSC Center, but it hasn't been "
+                  "approved by the Karnataka state government yet. Could you please verify and confirm my details? "
+                  "NAME: RAMAPPA, ADHAAR: 301245698712, DOB: 12/06/1962, FID: FID1606000012345")
+
+
+def test_strip_identifiers():
+    """IDs, numbers, dates and labelled names are dropped; the complaint stays."""
+    print("Testing strip_identifiers:")
+    stripped = strip_identifiers(GRIEVANCE + " Survey number 29 4/* belongs to Bullappa S/o Amarappa.")
+    for identifier in ("KARIYAMMA", "556215633099", "01/01/1950", "CSCKA9939311", "29", "Amarappa"):
+        assert identifier not in stripped, identifier
+    assert "Kisan Samman Nidhi Scheme" in stripped
+    print("✓ Test passed\n")
+
+
+def test_lookup_ignores_identifiers():
+    """A grievance refiled with other IDs and names finds the earlier one; an unrelated one doesn't."""
+    print("Testing SemanticCache.lookup:")
+    cache = SemanticCache(HashedTfidfVectorizer.from_csv("data/PM_Kisan/train.csv"), min_similarity=0.8)
+    assert cache.lookup(GRIEVANCE) is None
+    assert cache.add(GRIEVANCE, NOT_APPROVED)
+    assert not cache.add(GRIEVANCE.replace("556215633099", "123412341234"), NOT_APPROVED), "Verbatim repeats are not stored twice"
+    cache.add("Good quality seeds were not supplied to farmers by the seeds corporation this season", SEEDS)
+
+    match = cache.lookup(SAME_GRIEVANCE)
+    assert match is not None and match.path == NOT_APPROVED and match.similarity > 0.85, match
+    assert cache.lookup("Drinking water supply stopped in our village for two weeks") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2, cache.stats()
+    print("✓ Test passed\n")
+
+
+def test_eviction_and_tree_version():
+    """The oldest entries go past max_entries, and everything goes when the tree changes."""
+    print("Testing SemanticCache eviction and invalidation:")
+    cache = SemanticCache(max_entries=2, min_similarity=0.9)
+    cache.check_tree_version("v1")
+    cache.add("seeds not supplied by the corporation", SEEDS)
+    cache.add("pm kisan installment not received", PM_KISAN)
+    cache.add("application submitted but not approved", NOT_APPROVED)
+    assert len(cache) == 2
+    assert cache.lookup("seeds not supplied by the corporation") is None
+    assert cache.lookup("application submitted but not approved").path == NOT_APPROVED
+
+    cache.check_tree_version("v2")
+    assert len(cache) == 0 and cache.lookup("pm kisan installment not received") is None
+    print("✓ Test passed\n")
+
+
+def test_common_prefix():
+    print("Testing common_prefix:")
+    assert common_prefix([NOT_APPROVED, PM_KISAN + ["ISSUES RELATED TO PAYMENT"]]) == PM_KISAN
+    assert common_prefix([NOT_APPROVED, SEEDS]) == ["AGRICULTURE DEPARTMENT"]
+    assert common_prefix([NOT_APPROVED]) == NOT_APPROVED
+    print("✓ Test passed\n")
+
+
+def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_strip_identifiers()
+    test_lookup_ignores_identifiers()
+    test_eviction_and_tree_version()
+    test_common_prefix()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import os
+import json
+import asyncio
+import tempfile
+import threading
+from datetime import datetime
+from utils.chat_utils import SessionStore
+from utils.session_locks import SessionLockRegistry
+from utils.session_archive import SessionArchive, archive_expired_sessions
+from utils.session_backends import JsonSessionBackend, JournalSessionBackend, SqliteSessionBackend, atomic_write_text, message_event, path_event, final_event
+
+
+async def test_write_back_and_flush():
+    """A session is written once on flush, not on every update."""
+    print("Testing SessionStore write-back:")
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(backend=JsonSessionBackend(directory=directory), max_sessions=8)
+        session_id = "69ca6c42-0f2e-4e05-8447-825902428c64"
+        file_path = os.path.join(directory, session_id[:2], f"{session_id}.json")
+
+        store.append_event(session_id, message_event("user", "PM Kisan installment not received"))
+        store.append_event(session_id, path_event(["AGRICULTURE DEPARTMENT"]))
+        assert not os.path.exists(file_path), "Session was written before flush"
+
+        store.flush(session_id)
+        with open(file_path, "r") as file:
+            saved = json.load(file)
+        assert saved["current_path"] == ["AGRICULTURE DEPARTMENT"], f"Path mismatch: {saved['current_path']}"
+        assert len(saved["history"]) == 1
+        print("✓ Test passed\n")
+
+
+async def test_eviction_flushes_dirty_sessions():
+    """Sessions evicted from the LRU are written back first."""
+    print("Testing SessionStore eviction:")
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(backend=JsonSessionBackend(directory=directory), max_sessions=2)
+        for i in range(3):
+            store.load(f"session-{i}", create=True)
+        assert os.path.exists(os.path.join(directory, "se", "session-0.json")), "Evicted session was not flushed"
+        assert store.load("session-0") is not None
+        assert store.load("missing-session") is None
+        print("✓ Test passed\n")
+
+
+async def test_journal_replay_and_compaction():
+    """Journal sessions replay to the same state, survive a torn append and compact."""
+    print("Testing JournalSessionBackend:")
+    with tempfile.TemporaryDirectory() as directory:
+        backend = JournalSessionBackend(directory=directory, compact_after=5)
+        store = SessionStore(backend=backend)
+        session_id = "journal-session"
+
+        store.append_event(session_id, message_event("user", "installment not received"))
+        store.append_event(session_id, path_event(["AGRICULTURE DEPARTMENT"]))
+        store.flush(session_id)
+        store.append_event(session_id, final_event("True"))
+        store.flush(session_id)
+
+        # Simulate a crash in the middle of an append
+        with open(backend.session_file_path(session_id), "a") as file:
+            file.write('{"type": "message", "role": "us')
+
+        replayed = JournalSessionBackend(directory=directory).read(session_id)
+        assert replayed["history"] == [{"role": "user", "content": "installment not received"}]
+        assert replayed["current_path"] == ["AGRICULTURE DEPARTMENT"]
+        assert replayed["path_final"] == "True"
+
+        store.append_event(session_id, path_event(["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE"]))
+        store.flush(session_id)
+        replayed = JournalSessionBackend(directory=directory).read(session_id)
+        assert replayed["current_path"] == ["AGRICULTURE DEPARTMENT", "DEPARTMENT OF AGRICULTURE"]
+
+        for i in range(4):
+            store.append_event(session_id, message_event("assistant", f"question {i}"))
+        store.flush(session_id)
+        with open(backend.session_file_path(session_id), "r") as file:
+            lines = file.readlines()
+        assert len(lines) == 2, f"Expected header + snapshot after compaction, got {len(lines)} lines"
+        assert len(JournalSessionBackend(directory=directory).read(session_id)["history"]) == 5
+        print("✓ Test passed\n")
+
+
+async def test_sqlite_backend_and_admin_queries():
+    """SQLite sessions round-trip and show up in the indexed admin queries."""
+    print("Testing SqliteSessionBackend:")
+    leaf_path = ["AGRICULTURE DEPARTMENT", "AGRICULTURAL UNIVERSITIES", "EMPLOYEE BENEFIT", "FACING ISSUES RELATED TO EMPLOYEE BENEFITS", "ISSUE RELATED TO PF"]
+    with tempfile.TemporaryDirectory() as directory:
+        backend = SqliteSessionBackend(directory=directory)
+        store = SessionStore(backend=backend)
+
+        store.append_event("open-session", message_event("user", "crop survey problem"))
+        store.append_event("final-session", message_event("user", "PF not credited"))
+        store.append_event("final-session", path_event(leaf_path))
+        store.append_event("final-session", final_event("True"))
+        store.flush_all()
+
+        replayed = SqliteSessionBackend(directory=directory).read("final-session")
+        assert replayed["current_path"] == leaf_path, f"Path mismatch: {replayed['current_path']}"
+        assert replayed["history"] == [{"role": "user", "content": "PF not credited"}]
+        assert backend.count_open_sessions() == 1
+        assert backend.sessions_finalized_at("ISSUE RELATED TO PF") == ["final-session"]
+        assert backend.idle_sessions(idle_minutes=30) == []
+        print("✓ Test passed\n")
+
+
+async def test_session_locks():
+    """Turns on one session serialize, across registries too; other sessions run in parallel."""
+    print("Testing SessionLockRegistry:")
+    with tempfile.TemporaryDirectory() as directory:
+        # Two registries on one lock directory stand in for two uvicorn workers
+        workers = [SessionLockRegistry(lock_directory=directory), SessionLockRegistry(lock_directory=directory)]
+        active = {}
+        overlaps = []
+
+        async def turn(registry, session_id):
+            async with registry.lock(session_id):
+                active[session_id] = active.get(session_id, 0) + 1
+                overlaps.append((session_id, active[session_id]))
+                await asyncio.sleep(0.05)
+                active[session_id] -= 1
+
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(
+            turn(workers[0], "session-a"), turn(workers[1], "session-a"), turn(workers[0], "session-a"),
+            turn(workers[0], "session-b"), turn(workers[1], "session-c"),
+        )
+        elapsed = asyncio.get_running_loop().time() - start
+        assert max(count for _, count in overlaps) == 1, f"Concurrent turns on one session: {overlaps}"
+        assert elapsed < 0.3, f"Different sessions did not run in parallel ({elapsed:.2f}s)"
+        assert os.path.exists(os.path.join(directory, "se", "session-a.lock")), "Lock files are sharded"
+
+        # A turn waiting on a lock file that its holder removes locks the new file instead
+        order = []
+
+        async def removing_turn():
+            async with workers[0].lock("session-d"):
+                await asyncio.sleep(0.05)
+                workers[0].remove_lock_file("session-d")
+                order.append("removed")
+
+        async def later_turn(registry, name, delay):
+            await asyncio.sleep(delay)
+            async with registry.lock("session-d"):
+                active["session-d"] = active.get("session-d", 0) + 1
+                overlaps.append(("session-d", active["session-d"]))
+                order.append(name)
+                await asyncio.sleep(0.05)
+                active["session-d"] -= 1
+
+        await asyncio.gather(removing_turn(), later_turn(workers[1], "waiting", 0.01), later_turn(workers[0], "new", 0.06))
+        assert order[0] == "removed" and sorted(order[1:]) == ["new", "waiting"], order
+        assert max(count for _, count in overlaps) == 1, f"Concurrent turns on one session: {overlaps}"
+        print("✓ Test passed\n")
+
+
+async def test_archive_expired_sessions():
+    """Expired sessions move into the archive and can still be loaded from it."""
+    print("Testing session archiving:")
+    with tempfile.TemporaryDirectory() as directory:
+        archive = SessionArchive(directory=os.path.join(directory, "archive"))
+        store = SessionStore(backend=JsonSessionBackend(directory=directory), archive=archive)
+        locks = SessionLockRegistry(lock_directory=os.path.join(directory, ".locks"))
+
+        # A session in the old flat layout is still found
+        with open(os.path.join(directory, "old-session.json"), "w") as file:
+            json.dump({"session_id": "old-session", "history": [], "current_path": ["AGRICULTURE DEPARTMENT"],
+                       "path_final": "True", "last_updated": "2025-06-01T10:00:00"}, file)
+        last_modified = datetime(2025, 6, 1, 10).timestamp()
+        os.utime(os.path.join(directory, "old-session.json"), (last_modified, last_modified))
+        store.append_event("new-session", message_event("user", "crop survey problem"))
+        store.flush("new-session")
+        # An old file whose session was updated since is a candidate but is not archived
+        with open(os.path.join(directory, "recent-session.json"), "w") as file:
+            json.dump({"session_id": "recent-session", "history": [], "current_path": [],
+                       "path_final": "False", "last_updated": datetime.now().isoformat()}, file)
+        os.utime(os.path.join(directory, "recent-session.json"), (last_modified, last_modified))
+        assert store.load("old-session")["current_path"] == ["AGRICULTURE DEPARTMENT"]
+
+        archived = await archive_expired_sessions(store, locks, archive, final_ttl=3600, idle_ttl=3600)
+        assert archived == 1, f"Expected 1 archived session, got {archived}"
+        assert not os.path.exists(os.path.join(directory, "old-session.json"))
+        assert os.path.exists(os.path.join(directory, "archive", "2025-06-01.jsonl.gz"))
+        assert not os.path.exists(locks.lock_file_path("old-session")), "The lock file goes with the session"
+        assert not os.path.exists(locks.lock_file_path("recent-session")), "No lock just to inspect a candidate"
+
+        restored = SessionStore(backend=JsonSessionBackend(directory=directory), archive=archive).load("old-session")
+        assert restored["current_path"] == ["AGRICULTURE DEPARTMENT"], "Archived session was not restored"
+        assert store.load("new-session") is not None
+        print("✓ Test passed\n")
+
+
+async def test_atomic_write_from_threads():
+    """Threads of one process writing the same file never share a temp file."""
+    print("Testing concurrent atomic writes:")
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "session.json")
+        texts = [json.dumps({"writer": writer, "padding": "x" * 4096}) for writer in range(8)]
+        errors = []
+
+        def writer(text):
+            try:
+                for _ in range(50):
+                    atomic_write_text(file_path, text)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=writer, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, f"Concurrent writes failed: {errors[:3]}"
+        with open(file_path) as file:
+            assert file.read() in texts, "The file holds a mix of two writes"
+        assert os.listdir(directory) == ["session.json"], f"Temp files left behind: {os.listdir(directory)}"
+        print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    await test_write_back_and_flush()
+    await test_eviction_flushes_dirty_sessions()
+    await test_journal_replay_and_compaction()
+    await test_sqlite_backend_and_admin_queries()
+    await test_session_locks()
+    await test_archive_expired_sessions()
+    await test_atomic_write_from_threads()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
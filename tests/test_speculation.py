@@ -0,0 +1,72 @@
+import asyncio
+from utils.department_tree import TreeRegistry
+from utils.speculation import Speculator
+
+AGRICULTURE = ["AGRICULTURE DEPARTMENT"]
+QUERY = "PM Kisan installment amount not received in my account"
+
+
+async def fake_level(name: str, latency: float = 0.05):
+    await asyncio.sleep(latency)
+    return {"status": "found", "classified_department": name}
+
+
+def test_candidates():
+    """The likeliest non-leaf children are predicted, up to width."""
+    print("Testing Speculator.candidates:")
+    registry = TreeRegistry(["utils", "data"])
+    children = registry.children(AGRICULTURE)
+    speculator = Speculator(registry, width=2)
+    candidates = speculator.candidates(QUERY, AGRICULTURE, children)
+    assert candidates[0] == "DEPARTMENT OF AGRICULTURE" and len(candidates) == 2, candidates
+    assert all(child in children and not registry.is_leaf(AGRICULTURE + [child]) for child in candidates)
+    assert Speculator(registry, width=0).candidates(QUERY, AGRICULTURE, children) == []
+    print("✓ Test passed\n")
+
+
+async def test_settle_keeps_the_chosen_call():
+    """The chosen child's call is handed on, the others are cancelled, and the metrics add up."""
+    print("Testing Speculator.settle:")
+    speculator = Speculator(TreeRegistry(["utils", "data"]), width=2, spend_cap=10)
+    speculator.record_primary()
+    calls = {name: speculator.start(name, fake_level(name)) for name in ("A", "B")}
+    await asyncio.sleep(0.02)
+    kept = speculator.settle(calls, "A")
+    assert (await kept)["classified_department"] == "A"
+    await asyncio.sleep(0)
+    assert calls["B"].task.cancelled()
+
+    calls = {"C": speculator.start("C", fake_level("C"))}
+    assert speculator.settle(calls, "D") is None
+    stats = speculator.stats()
+    assert stats["hits"] == 1 and stats["wasted_calls"] == 2 and stats["hit_rate"] == 0.5, stats
+    assert 0.015 < stats["latency_saved"] < 0.05, stats
+    print("✓ Test passed\n")
+
+
+async def test_spend_cap():
+    """Speculation pauses while unused calls exceed the cap per regular call."""
+    print("Testing Speculator spend cap:")
+    speculator = Speculator(TreeRegistry(["utils", "data"]), width=1, spend_cap=0.5)
+    speculator.record_primary()
+    assert speculator.budget() == 1
+    speculator.settle({"A": speculator.start("A", fake_level("A"))}, None)
+    assert speculator.budget() == 0
+    speculator.record_primary()
+    speculator.record_primary()
+    assert speculator.budget() == 1
+    print("✓ Test passed\n")
+
+
+async def main():
+    """Run all tests."""
+    print("Starting tests...\n")
+
+    test_candidates()
+    await test_settle_keeps_the_chosen_call()
+    await test_spend_cap()
+
+    print("\nAll tests completed successfully!")
+
+if __name__ == "__main__":
+    asyncio.run(main())
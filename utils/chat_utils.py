@@ -1,14 +1,42 @@
-import vertexai 
-from vertexai.generative_models import GenerativeModel, ChatSession, Part, Content
+import re
 import json
 import os
+import time
+import atexit
+import tempfile
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 from datetime import datetime
 
-from utils.constants import department_tree, QUERY_CLASSIFIER_PROMPT, GENERATE_RELEVANT_QUESTIONS_PROMPT, TRANSLATE_QUERY_PROMPT
-from utils.models import Gemini_Model_VertexAI_With_History, g1f
+from utils.constants import department_tree, QUERY_CLASSIFIER_PROMPT, CLASSIFY_OR_CLARIFY_PROMPT, FLAT_CLASSIFIER_PROMPT, GENERATE_RELEVANT_QUESTIONS_PROMPT, TRANSLATE_QUERY_PROMPT
+from utils.resilience import CircuitBreaker, TokenBucket, llm_concurrency, llm_resilience
+from utils.llm_backends import Hedger, OfflineBackend, VertexGeminiBackend, load_router
+from utils.department_tree import DepartmentTree, TreeRegistry
+from utils.name_resolver import name_resolver
+from utils.classification_cache import ClassificationCache, SqliteCacheStore, classification_cache_key
+from utils.semantic_cache import HashedTfidfVectorizer, SemanticCache, common_prefix
+from utils.flat_classifier import FlatClassifier, format_shortlist
+from utils.local_classifier import LocalClassifier, LocalWarmStart
+from utils.node_index import OTHER_OPTION, CandidatePruner
+from utils.speculation import Speculator
+from utils.classification_stream import JsonStringField, QuestionRelay, emit, streaming
+from utils.session_locks import SessionLockRegistry
+from utils.session_archive import SessionArchive
+from utils.session_backends import (JsonSessionBackend,
+                                    get_session_backend,
+                                    new_session_data,
+                                    apply_event,
+                                    message_event,
+                                    path_event,
+                                    final_event)
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import Content
 
 #Setup Logger
 import logging
@@ -18,22 +46,480 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-generate_content = g1f.generate_content
+CLASSIFIER_MODEL_NAME = "gemini-2.5-flash-preview-05-20"
+
+# LLM_OFFLINE=true answers every model call with the deterministic OfflineBackend: no
+# Google import, no credentials, no network. For load and regression runs; the latency
+# is lognormal around LLM_OFFLINE_LATENCY seconds and LLM_OFFLINE_ERROR_RATE of calls fail.
+LLM_OFFLINE = os.getenv("LLM_OFFLINE", "false").lower() == "true"
+LLM_OFFLINE_LATENCY = float(os.getenv("LLM_OFFLINE_LATENCY", "0"))
+LLM_OFFLINE_LATENCY_SIGMA = float(os.getenv("LLM_OFFLINE_LATENCY_SIGMA", "0"))
+LLM_OFFLINE_ERROR_RATE = float(os.getenv("LLM_OFFLINE_ERROR_RATE", "0"))
+LLM_OFFLINE_SEED = int(os.getenv("LLM_OFFLINE_SEED", "0"))
+
+# LLM calls one worker keeps in flight at once; the rest wait for a slot
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+llm_concurrency.limit = LLM_MAX_CONCURRENCY
+
+# Model calls per second across all workers on this host (0 = no limit), through a shared bucket file
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "0"))
+LLM_RATE_LIMIT_BURST = float(os.getenv("LLM_RATE_LIMIT_BURST", str(max(1.0, LLM_RATE_LIMIT))))
+LLM_RATE_LIMIT_FILE = os.getenv("LLM_RATE_LIMIT_FILE", os.path.join(tempfile.gettempdir(), "grievance_llm_rate_limit"))
+if LLM_RATE_LIMIT > 0:
+    llm_resilience.bucket = TokenBucket(LLM_RATE_LIMIT, LLM_RATE_LIMIT_BURST, LLM_RATE_LIMIT_FILE)
+# Quota and transient errors are retried with jittered exponential backoff
+llm_resilience.max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+llm_resilience.base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+llm_resilience.max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# After this many failures in a row, fail fast (503 with Retry-After) for LLM_BREAKER_RESET seconds
+llm_resilience.breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30"))
+)
+
+# Model backend per pipeline stage ("classify", "flat", "clarify"). Without a config
+# every stage uses its built-in Gemini model; LLM_BACKENDS_CONFIG names a JSON file
+# that adds backends (OpenAI, tuned endpoints, stub) and routes stages to them.
+LLM_BACKENDS_CONFIG = os.getenv("LLM_BACKENDS_CONFIG", "")
+# The static prompt instructions are sent as the model's system instruction, where Gemini caches
+# them implicitly; LLM_CONTEXT_CACHE_TTL > 0 also stores them as Vertex context cache for that many seconds
+LLM_CONTEXT_CACHE_TTL = float(os.getenv("LLM_CONTEXT_CACHE_TTL", "0"))
+llm_backends_config = {}
+if LLM_BACKENDS_CONFIG:
+    with open(LLM_BACKENDS_CONFIG, "r") as f:
+        llm_backends_config = json.load(f)
+if LLM_OFFLINE:
+    offline_backend = OfflineBackend(
+        latency=LLM_OFFLINE_LATENCY,
+        latency_sigma=LLM_OFFLINE_LATENCY_SIGMA,
+        error_rate=LLM_OFFLINE_ERROR_RATE,
+        seed=LLM_OFFLINE_SEED
+    )
+    llm_router = load_router(llm_backends_config, {"classify": offline_backend, "flat": offline_backend, "clarify": offline_backend})
+else:
+    classifier_backend = VertexGeminiBackend(CLASSIFIER_MODEL_NAME, context_cache_ttl=LLM_CONTEXT_CACHE_TTL)
+    llm_router = load_router(llm_backends_config, {
+        "classify": classifier_backend,
+        "flat": classifier_backend,
+        "clarify": VertexGeminiBackend("gemini-2.0-flash-001", context_cache_ttl=LLM_CONTEXT_CACHE_TTL),
+    })
+
+# Hedged requests: a call still running at this latency percentile of its backend (e.g. 0.95)
+# is duplicated and the first answer wins (0 = off). LLM_HEDGE_TO is "secondary" (the stage's
+# next backend, when it has one) or "same"; at most LLM_HEDGE_MAX_RATE of calls are hedged.
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0"))
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.05"))
+LLM_HEDGE_TO = os.getenv("LLM_HEDGE_TO", "secondary")
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+if LLM_HEDGE_TO not in ("secondary", "same"):
+    raise ValueError(f"LLM_HEDGE_TO must be 'secondary' or 'same', not {LLM_HEDGE_TO!r}")
+if LLM_HEDGE_PERCENTILE > 0:
+    llm_router.hedger = Hedger(
+        percentile=LLM_HEDGE_PERCENTILE,
+        max_rate=LLM_HEDGE_MAX_RATE,
+        min_samples=LLM_HEDGE_MIN_SAMPLES,
+        to_secondary=LLM_HEDGE_TO == "secondary"
+    )
+
+
+# Department trees (<Name>_tree.json) are discovered here and loaded on first use
+tree_registry = TreeRegistry(directories=os.getenv("DEPARTMENT_TREE_DIRS", "utils,data").split(","))
+
 
-file_path = "utils/Agriculture_tree.json"
-with open(file_path, "r") as file:
-    agriculture_tree = json.load(file)
+def __getattr__(name):
+    # agriculture_tree used to be loaded eagerly at import; keep it importable, lazily
+    if name == "agriculture_tree":
+        return tree_registry.get("Agriculture").tree
+    if name == "agriculture_department_tree":
+        return tree_registry.get("Agriculture")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
 GOOGLE_CLOUD_LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
 
-vertexai.init(project=GOOGLE_CLOUD_PROJECT, location=GOOGLE_CLOUD_LOCATION)
+if not LLM_OFFLINE:
+    import vertexai
+    vertexai.init(project=GOOGLE_CLOUD_PROJECT, location=GOOGLE_CLOUD_LOCATION)
 
 class History:
     def __init__(self, role: str, content: str):
         self.role = role
         self.content = content
 
+
+class SessionStore:
+    """
+    Write-back cache in front of the session persistence backend.
+
+    A chat turn used to re-read and re-write the session file from every helper
+    it touched. The store loads a session once, keeps it in an in-process LRU,
+    queues the events applied to each session and hands them to the backend
+    once, when the turn ends (flush) or when the process shuts down (flush_all).
+    The backend decides how to persist them: JsonSessionBackend rewrites the
+    snapshot, JournalSessionBackend appends the events.
+
+    Sessions missing from the backend are looked up in the archive (if one is
+    given). A restored session is written back as a full snapshot on its next
+    flush, since the backend has no record of it anymore.
+
+    The *_async methods run backend reads and writes (including JSON parsing
+    and serialization) on a bounded thread pool, so a slow disk doesn't stall
+    the event loop. The chat helpers use those; the sync methods are kept for
+    scripts and shutdown.
+
+    Example:
+        await session_store.append_event_async(session_id, path_event(["AGRICULTURE DEPARTMENT"]))
+        await session_store.flush_async(session_id)
+    """
+    def __init__(self, backend=None, max_sessions: int = 1024, executor: Optional[ThreadPoolExecutor] = None, archive=None):
+        self.backend = backend or JsonSessionBackend()
+        self.max_sessions = max_sessions
+        self.executor = executor
+        self.archive = archive
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._pending: Dict[str, List[dict]] = {}
+        self._stamps: Dict[str, object] = {}
+        self._dirty = set()
+        self._restored = set()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _read(self, session_id: str):
+        session_data = self.backend.read(session_id)
+        if session_data is None and self.archive is not None:
+            session_data = self.archive.get(session_id)
+            return session_data, None, session_data is not None
+        return session_data, self.backend.stamp(session_id), False
+
+    def _write(self, session_id: str, session_data: dict, events: List[dict]):
+        self.backend.write(session_id, session_data, events)
+        return self.backend.stamp(session_id)
+
+    def _cached(self, session_id: str) -> Optional[dict]:
+        if session_id in self._sessions:
+            self._sessions.move_to_end(session_id)
+            return self._sessions[session_id]
+        return None
+
+    def _insert(self, session_id: str, session_data: Optional[dict], stamp, restored: bool, create: bool) -> Optional[dict]:
+        # Another coroutine may have loaded (and modified) the session meanwhile; keep its copy
+        if session_id in self._sessions:
+            return self._cached(session_id)
+        if session_data is None:
+            if not create:
+                return None
+            session_data = new_session_data(session_id)
+            self._dirty.add(session_id)
+        if restored:
+            self._restored.add(session_id)
+        self._stamps[session_id] = stamp
+        self._sessions[session_id] = session_data
+        return session_data
+
+    def _take_dirty(self, session_id: str):
+        """Pops the pending write of a session, if it has one."""
+        if session_id not in self._dirty:
+            return None
+        self._dirty.discard(session_id)
+        events = self._pending.pop(session_id, [])
+        if session_id in self._restored:
+            # Restored from the archive: the backend needs the whole snapshot
+            self._restored.discard(session_id)
+            events = []
+        session_data = self._sessions.get(session_id)
+        if session_data is None:
+            return None
+        return session_id, session_data, events
+
+    def _take_evicted(self) -> List[tuple]:
+        # Least recently used sessions are written back before they are dropped
+        writes = []
+        while len(self._sessions) > self.max_sessions:
+            session_id = next(iter(self._sessions))
+            write = self._take_dirty(session_id)
+            if write is not None:
+                writes.append(write)
+            self._drop(session_id)
+        return writes
+
+    def _apply(self, session_id: str, session_data: Optional[dict], event: dict) -> Optional[dict]:
+        if session_data is None:
+            return None
+        apply_event(session_data, event)
+        self._pending.setdefault(session_id, []).append(event)
+        self._dirty.add(session_id)
+        return session_data
+
+    def _is_stale(self, session_id: str) -> bool:
+        return session_id in self._sessions and session_id not in self._dirty
+
+    def _drop(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._stamps.pop(session_id, None)
+        self._restored.discard(session_id)
+
+    def is_dirty(self, session_id: str) -> bool:
+        return session_id in self._dirty
+
+    def discard(self, session_id: str):
+        """Drops a clean session from the cache (e.g. after it was archived)."""
+        if session_id not in self._dirty:
+            self._drop(session_id)
+
+    def load(self, session_id: str, create: bool = False) -> Optional[dict]:
+        """
+        Returns the cached session data, reading it from the backend on a cache miss.
+
+        Args:
+            session_id: The unique session identifier
+            create: Start a new (dirty) session if none exists yet
+
+        Returns:
+            The session dict, or None if the session does not exist and create is False
+        """
+        session_data = self._cached(session_id)
+        if session_data is not None:
+            return session_data
+        session_data = self._insert(session_id, *self._read(session_id), create=create)
+        for write in self._take_evicted():
+            self._write(*write)
+        return session_data
+
+    async def load_async(self, session_id: str, create: bool = False) -> Optional[dict]:
+        """Same as load, with the backend read done off the event loop."""
+        session_data = self._cached(session_id)
+        if session_data is not None:
+            return session_data
+        session_data = self._insert(session_id, *(await self._run(self._read, session_id)), create=create)
+        for write in self._take_evicted():
+            await self._run(self._write, *write)
+        return session_data
+
+    def append_event(self, session_id: str, event: dict, create: bool = True) -> Optional[dict]:
+        """
+        Applies an event to the cached session and queues it for the next flush.
+
+        Returns:
+            The updated session dict, or None if the session does not exist and create is False
+        """
+        return self._apply(session_id, self.load(session_id, create=create), event)
+
+    async def append_event_async(self, session_id: str, event: dict, create: bool = True) -> Optional[dict]:
+        return self._apply(session_id, await self.load_async(session_id, create=create), event)
+
+    def revalidate(self, session_id: str):
+        """
+        Drops a clean cached session if another worker has written it since it was loaded.
+
+        Called after taking the session lock, so the turn starts from what is on disk.
+        """
+        if not self._is_stale(session_id):
+            return
+        stamp = self._stamps.get(session_id)
+        if stamp is None or stamp != self.backend.stamp(session_id):
+            self._drop(session_id)
+
+    async def revalidate_async(self, session_id: str):
+        if not self._is_stale(session_id):
+            return
+        stamp = self._stamps.get(session_id)
+        if stamp is None or stamp != await self._run(self.backend.stamp, session_id):
+            self._drop(session_id)
+
+    def mark_dirty(self, session_id: str):
+        """Records that the cached session was modified outside append_event."""
+        if session_id in self._sessions:
+            self._dirty.add(session_id)
+
+    def flush(self, session_id: str):
+        """Writes the session back if it was modified since the last flush."""
+        write = self._take_dirty(session_id)
+        if write is not None:
+            self._stamps[session_id] = self._write(*write)
+
+    async def flush_async(self, session_id: str):
+        """Same as flush, with serialization and the backend write done off the event loop."""
+        write = self._take_dirty(session_id)
+        if write is not None:
+            self._stamps[session_id] = await self._run(self._write, *write)
+
+    def flush_all(self):
+        """Writes back every dirty session. Called on shutdown."""
+        if hasattr(self.backend, "write_many"):
+            # Backends that support it get every dirty session in one batch
+            writes = [write for write in map(self._take_dirty, list(self._dirty)) if write is not None]
+            try:
+                self.backend.write_many(writes)
+                for session_id, _, _ in writes:
+                    self._stamps[session_id] = self.backend.stamp(session_id)
+            except Exception as e:
+                logger.error(f"Error flushing {len(writes)} sessions: {str(e)}")
+            return
+
+        for session_id in list(self._dirty):
+            try:
+                self.flush(session_id)
+            except Exception as e:
+                logger.error(f"Error flushing session {session_id}: {str(e)}")
+
+
+# Bounded pool for session file / database I/O
+session_io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SESSION_IO_THREADS", "8")),
+    thread_name_prefix="session-io"
+)
+
+CHAT_HISTORY_DIR = os.getenv("CHAT_HISTORY_DIR", "chat_history")
+# Sessions past these TTLs (seconds since last update) are moved to the archive
+SESSION_FINAL_TTL = float(os.getenv("SESSION_FINAL_TTL", str(24 * 3600)))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", str(7 * 24 * 3600)))
+SESSION_ARCHIVE_INTERVAL = float(os.getenv("SESSION_ARCHIVE_INTERVAL", "600"))
+
+session_archive = SessionArchive(directory=os.path.join(CHAT_HISTORY_DIR, "archive"))
+
+session_store = SessionStore(
+    backend=get_session_backend(
+        name=os.getenv("SESSION_BACKEND", "json"),
+        directory=CHAT_HISTORY_DIR,
+        sharded=os.getenv("CHAT_HISTORY_SHARDED", "true").lower() == "true"
+    ),
+    max_sessions=int(os.getenv("SESSION_CACHE_SIZE", "1024")),
+    executor=session_io_executor,
+    archive=session_archive
+)
+atexit.register(session_store.flush_all)
+
+session_locks = SessionLockRegistry(
+    lock_directory=os.path.join(CHAT_HISTORY_DIR, ".locks")
+)
+
+# Per-level classifier results. Set CLASSIFICATION_CACHE_PATH (e.g.
+# chat_history/classification_cache.db) to keep them across restarts
+CLASSIFICATION_CACHE_ENABLED = os.getenv("CLASSIFICATION_CACHE_ENABLED", "true").lower() == "true"
+CLASSIFICATION_CACHE_PATH = os.getenv("CLASSIFICATION_CACHE_PATH", "")
+
+classification_cache = ClassificationCache(
+    max_entries=int(os.getenv("CLASSIFICATION_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("CLASSIFICATION_CACHE_TTL", str(24 * 3600))),
+    store=SqliteCacheStore(CLASSIFICATION_CACHE_PATH) if CLASSIFICATION_CACHE_PATH else None,
+    executor=session_io_executor
+)
+
+# Near-duplicate grievances warm-start the descent from paths resolved before
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_IDF_CORPUS = os.getenv("SEMANTIC_CACHE_IDF_CORPUS", "data/PM_Kisan/train.csv")
+# At or above this similarity, with every neighbour agreeing, the whole path is reused
+SEMANTIC_CACHE_FULL_SIMILARITY = float(os.getenv("SEMANTIC_CACHE_FULL_SIMILARITY", "0.97"))
+
+semantic_cache = SemanticCache(
+    vectorizer=HashedTfidfVectorizer.from_csv(SEMANTIC_CACHE_IDF_CORPUS) if os.path.exists(SEMANTIC_CACHE_IDF_CORPUS) else None,
+    max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "100000")),
+    min_similarity=float(os.getenv("SEMANTIC_CACHE_MIN_SIMILARITY", "0.8"))
+)
+
+# A CPU-only TF-IDF classifier warm-starts the descent of a new grievance at the deepest
+# level it is sure of; the model still decides the rest. LOCAL_CLASSIFIER_MODEL is loaded
+# when it exists, otherwise the classifier is trained from LOCAL_CLASSIFIER_TRAIN_CSV at
+# startup. tests/eval_local_classifier.py --save writes the model file and picks the
+# threshold by cross-validation on the training set (0.97: ~95% of warm starts are a prefix
+# of the right path; test.csv is only a held-out check)
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "false").lower() == "true"
+LOCAL_CLASSIFIER_MODEL = os.getenv("LOCAL_CLASSIFIER_MODEL", "data/PM_Kisan/local_classifier.npz")
+LOCAL_CLASSIFIER_TRAIN_CSV = os.getenv("LOCAL_CLASSIFIER_TRAIN_CSV", "data/PM_Kisan/train.csv")
+
+
+def load_local_warm_start() -> Optional[LocalWarmStart]:
+    if os.path.exists(LOCAL_CLASSIFIER_MODEL):
+        classifier = LocalClassifier.load(LOCAL_CLASSIFIER_MODEL)
+    elif os.path.exists(LOCAL_CLASSIFIER_TRAIN_CSV):
+        classifier = LocalClassifier.from_csv(LOCAL_CLASSIFIER_TRAIN_CSV)
+    else:
+        logger.warning(f"Local classifier disabled: neither {LOCAL_CLASSIFIER_MODEL} nor {LOCAL_CLASSIFIER_TRAIN_CSV} exists")
+        return None
+    return LocalWarmStart(
+        classifier,
+        tree_registry,
+        name_resolver,
+        threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.97")),
+        min_similarity=float(os.getenv("LOCAL_CLASSIFIER_MIN_SIMILARITY", "0.1"))
+    )
+
+
+local_warm_start = load_local_warm_start() if LOCAL_CLASSIFIER_ENABLED else None
+
+# "hierarchical": one classifier call per tree level. "flat": one call choosing among
+# shortlisted full leaf paths, falling back to the per-level descent when unsure.
+# Requests can override this with classification_mode.
+CLASSIFICATION_MODES = ("hierarchical", "flat")
+CLASSIFICATION_MODE = os.getenv("CLASSIFICATION_MODE", "hierarchical")
+# "tree" (the default): every leaf of the loaded trees. Or a file of "/"-separated leaf
+# paths to restrict the shortlist to (data/department_strings.txt has only 7 PM-KISAN leaves)
+FLAT_LEAF_PATHS = os.getenv("FLAT_LEAF_PATHS", "tree")
+
+flat_classifier = FlatClassifier(
+    tree_registry,
+    leaf_paths_file=None if FLAT_LEAF_PATHS == "tree" else FLAT_LEAF_PATHS,
+    shortlist_size=int(os.getenv("FLAT_SHORTLIST_SIZE", "20")),
+    min_score=float(os.getenv("FLAT_MIN_SHORTLIST_SCORE", "0.05")),
+    min_confidence=float(os.getenv("FLAT_MIN_CONFIDENCE", "0.7"))
+)
+
+# Wide levels offer the classifier only the top-k children ranked against the query, plus
+# OTHER_OPTION. CANDIDATE_TOP_K is k per level ("0,0,8": none at the two top levels, 8 below),
+# 0 = off. CANDIDATE_INDEX_PATH is built with python -m utils.node_index
+candidate_pruner = CandidatePruner(
+    tree_registry,
+    top_k=[int(k) for k in os.getenv("CANDIDATE_TOP_K", "0").split(",") if k.strip()],
+    min_score=float(os.getenv("CANDIDATE_MIN_SCORE", "0.05")),
+    index_path=os.getenv("CANDIDATE_INDEX_PATH", "data/node_index.npz")
+)
+
+# How a clarifying question is produced when a level is not found:
+# "combined": the classifier call returns it too (one round trip).
+# "concurrent": the question call runs alongside every classifier call and is
+#   cancelled when the level is found.
+# "sequential": the question call starts after the classifier says "not found".
+CLARIFY_MODES = ("combined", "concurrent", "sequential")
+CLARIFY_MODE = os.getenv("CLARIFY_MODE", "combined")
+if CLARIFY_MODE not in CLARIFY_MODES:
+    raise ValueError(f"Unknown CLARIFY_MODE: {CLARIFY_MODE}")
+
+# Next-level calls started for the SPECULATION_WIDTH likeliest children while the
+# current level is classified (0 = off). Paused while unused speculative calls
+# exceed SPECULATION_SPEND_CAP per regular classifier call.
+speculator = Speculator(
+    tree_registry,
+    width=int(os.getenv("SPECULATION_WIDTH", "0")),
+    spend_cap=float(os.getenv("SPECULATION_SPEND_CAP", "0.5"))
+)
+
+
+async def flush_session(session_id: str):
+    """Writes the session back to disk once, at the end of a chat turn."""
+    await session_store.flush_async(session_id)
+
+
+@asynccontextmanager
+async def session_turn(session_id: str):
+    """
+    Runs one chat turn for a session under its lock, starting from the latest
+    persisted state and flushing the session once when the turn ends.
+
+    Example:
+        async with session_turn(session_id):
+            await add_to_chat_history(session_id, "user", query)
+            ...
+    """
+    async with session_locks.lock(session_id):
+        await session_store.revalidate_async(session_id)
+        try:
+            yield
+        finally:
+            await flush_session(session_id)
+
+
 async def check_if_final_department_id(session_id: str) -> bool:
     """
     Check if the given session ID has reached a final department classification.
@@ -45,18 +531,13 @@ async def check_if_final_department_id(session_id: str) -> bool:
         bool: True if the path is final for this session, False otherwise
     """
     try:
-        # Construct the path to the session file
-        file_path = Path(f"chat_history/{session_id.lower()}.json")
+        session_data = await session_store.load_async(session_id.lower())
         
-        # Check if the file exists
-        if not file_path.exists():
+        # Check if the session exists
+        if session_data is None:
             logger.warning(f"Session file not found for ID: {session_id}")
             return False
         
-        # Read and parse the JSON file
-        with open(file_path, 'r') as f:
-            session_data = json.load(f)
-        
         # Check if path_final exists and is set to true
         if "path_final" in session_data:
             # Handle both string "True" and boolean true
@@ -79,6 +560,11 @@ async def check_if_final_department_id(session_id: str) -> bool:
     
 
 async def convert_history_to_gemini_format(history: Optional[List[History]]):
+    if LLM_OFFLINE:
+        # The offline backend reads History items as they are
+        return list(history or [])
+    from vertexai.generative_models import Content, Part
+
     gemini_history = []
     if history:
         for item in history:
@@ -87,81 +573,42 @@ async def convert_history_to_gemini_format(history: Optional[List[History]]):
 
 async def add_to_chat_history(session_id: str, role: str, content: str):
     """
-    Adds a new message to the chat history in the session file.
+    Adds a new message to the chat history of the session.
     
     Args:
         session_id: The unique session identifier
         role: The role of the message sender ("user" or "assistant")
         content: The message content
     """
-    # Create chat_history directory if it doesn't exist
-    os.makedirs("chat_history", exist_ok=True)
-    
-    # Path to session file
-    session_file_path = f"chat_history/{session_id}.json"
-    
-    # Load existing session data if it exists
-    if os.path.exists(session_file_path):
-        with open(session_file_path, "r") as file:
-            session_data = json.load(file)
-    else:
-        # Create new session data if file doesn't exist
-        session_data = {
-            "session_id": session_id,
-            "history": [],
-            "current_path": [],
-            "path_final": "False",
-            "last_updated": ""
-        }
-    
-    # Add the new message to chat_history
-    session_data["history"].append({
-        "role": role,
-        "content": content
-    })
-    
-    # Update last_updated timestamp
-    session_data["last_updated"] = datetime.now().isoformat()
-    
-    # Save the updated session data
-    with open(session_file_path, "w") as file:
-        json.dump(session_data, file, indent=2)
+    # Append the message (and bump last_updated), starting a new session if needed
+    await session_store.append_event_async(session_id, message_event(role, content))
 
 
 async def get_history_from_sesh_id(chat_session_id: str):
-    session_file_path = f"chat_history/{chat_session_id}.json"
-    if not os.path.exists(session_file_path):
+    # Also serves GET /get_chat_history outside a turn, so another worker may have written the session
+    await session_store.revalidate_async(chat_session_id)
+    session_data = await session_store.load_async(chat_session_id)
+    if session_data is None:
         raise FileNotFoundError(f"Chat session file not found for ID: {chat_session_id}")
     
-    with open(session_file_path, "r") as file:
-        session_data = json.load(file)
-    
     history = []
     for entry in session_data.get("history", []):
         history.append(History(role=entry["role"], content=entry["content"]))
     
-    return history, session_data.get("current_path", [])
+    return history, list(session_data.get("current_path", []))
 
 
 async def get_next_children(tree, dept_path):
-    # Find the current node
-    current_node = tree
-    for dept in dept_path:
-        found = False
-        for node in current_node:
-            if node.get("name") == dept:
-                current_node = node.get("children", [])
-                found = True
-                break
-        if not found:
-            return []  # Path not found
-
-    # Extract just the names from the children nodes
-    return [child.get("name") for child in current_node]
-
-async def generate_relevant_questions(query: str, current_level_options: list, history: list):
+    # Names of the children of the current node; [] if the path is not in the tree.
+    # tree is a TreeRegistry / DepartmentTree, or a raw tree list (compiled once and cached)
+    if isinstance(tree, list):
+        tree = DepartmentTree.of(tree)
+    return tree.children(dept_path)
+
+async def generate_relevant_questions(query: str, current_level_options: list, history: list,
+                                      relay: Optional[QuestionRelay] = None):
+    # The static instructions go separately as the cacheable prefix
     template_parts=[
-        GENERATE_RELEVANT_QUESTIONS_PROMPT,
         f"User Query: {query}",
         f"Current Level Department Options (topic and summary): {json.dumps(current_level_options, indent=2)}",
         f"Chat History: {history}",
@@ -169,88 +616,51 @@ async def generate_relevant_questions(query: str, current_level_options: list, h
     ]
 
     template = "\n\n".join(template_parts)
-    response=generate_content(
-        [Content(role="user", parts=[Part.from_text(template)])],
-        generation_config={
-            "temperature": 0.125,
-            "response_mime_type": "application/json",
-        },
-    )
-    result = json.loads(response.text).get("clarifying_question", "")
+    if relay is None:
+        response = await llm_router.generate("clarify", template, temperature=0.125, prefix=GENERATE_RELEVANT_QUESTIONS_PROMPT)
+    else:
+        # Streamed: the question reaches the client token by token
+        question_field = JsonStringField("clarifying_question")
+        response = await llm_router.generate_streaming(
+            "clarify", template, lambda chunk: relay(question_field.feed(chunk)),
+            temperature=0.125, prefix=GENERATE_RELEVANT_QUESTIONS_PROMPT
+        )
+    result = response.get("clarifying_question", "")
     return result
 
 
+def discard_result(task: asyncio.Task):
+    # Done callback for calls whose result may go unused: retrieves the
+    # exception so asyncio doesn't log it as never retrieved
+    if not task.cancelled():
+        task.exception()
+
 async def update_reached_final(session_id: str, value: str):
     """
-    Updates the path_final parameter in the session JSON file.
+    Updates the path_final parameter of the session.
     
     Args:
         session_id: The unique session identifier
         value: The value to set for path_final ("True" or "False")
     """
-    # Create chat_history directory if it doesn't exist
-    os.makedirs("chat_history", exist_ok=True)
-    
-    # Path to session file
-    session_file_path = f"chat_history/{session_id}.json"
-    
-    # Check if the file exists
-    if not os.path.exists(session_file_path):
-        print(f"Session file not found: {session_file_path}")
-        return False
-    
-    try:
-        # Load existing session data
-        with open(session_file_path, "r") as file:
-            session_data = json.load(file)
-        
-        # Update path_final
-        session_data["path_final"] = value
-        
-        # Save the updated session data
-        with open(session_file_path, "w") as file:
-            json.dump(session_data, file, indent=2)
-        
-        return True
-    except Exception as e:
-        print(f"Error updating path_final in session file: {e}")
+    # Update path_final, if the session exists
+    session_data = await session_store.append_event_async(session_id, final_event(value), create=False)
+    if session_data is None:
+        print(f"Session file not found: {session_id}")
         return False
+    return True
     
 async def update_dept_path(session_id: str, new_dept_path: List[str]):
     """
-    Updates the department path in the session JSON file.
+    Updates the department path of the session.
     
     Args:
         session_id: The unique session identifier
         new_dept_path: The updated department path list
     """
-    # Create chat_history directory if it doesn't exist
-    os.makedirs("chat_history", exist_ok=True)
-    
-    # Path to session file
-    session_file_path = f"chat_history/{session_id}.json"
-    
-    # Load existing session data if it exists
-    if os.path.exists(session_file_path):
-        with open(session_file_path, "r") as file:
-            session_data = json.load(file)
-    else:
-        # Create new session data if file doesn't exist
-        session_data = {
-            "session_id": session_id,
-            "chat_history": [],
-            "current_path": [],
-            "path_final": "False",
-            "last_updated": ""
-        }
-    
-    # Update the department path and last_updated timestamp
-    session_data["current_path"] = new_dept_path
-    session_data["last_updated"] = datetime.now().isoformat()
-    
-    # Save the updated session data
-    with open(session_file_path, "w") as file:
-        json.dump(session_data, file, indent=2)
+    # Update the department path and last_updated timestamp, starting a new session if needed
+    await session_store.append_event_async(session_id, path_event(new_dept_path))
+    emit("level", {"department": new_dept_path[-1] if new_dept_path else None, "path": list(new_dept_path)})
 
 
 async def check_if_final_department(dept_path: List[str]) -> bool:
@@ -263,66 +673,131 @@ async def check_if_final_department(dept_path: List[str]) -> bool:
     Returns:
         True if this is a final department (no children), False otherwise
     """
-    if not dept_path or len(dept_path) == 0:
-        return False
-    
-    # Navigate to the current node
-    current_node = agriculture_tree
-    for dept in dept_path:
-        found = False
-        for node in current_node:
-            if node.get("name") == dept:
-                current_node = node.get("children", [])
-                found = True
-                break
-        if not found:
-            # Path not found in the tree
-            return False
-    
-    # If current_node is empty or doesn't exist, we're at a leaf node
-    if not current_node or len(current_node) == 0:
-        return True
-    
-    # Check if the "children" key exists but is empty in the last node
-    if dept_path:
-        for node in agriculture_tree:
-            current = node
-            for dept in dept_path:
-                found = False
-                if isinstance(current, dict) and current.get("name") == dept:
-                    found = True
-                    if "children" not in current or not current["children"]:
-                        return True
-                    current = current["children"]
-                    break
-                elif isinstance(current, list):
-                    for child in current:
-                        if child.get("name") == dept:
-                            found = True
-                            current = child.get("children", [])
-                            if not current:
-                                return True
-                            break
-                if not found:
-                    break
-            if found:  # If we found the full path
-                return False
-    
-    return False
+    return tree_registry.is_leaf(dept_path)
 
-async def query_classifier(query: str, chat_session_id: str):
+def semantic_warm_start(query: str) -> List[str]:
+    """
+    Starting path for a new grievance, from near duplicates resolved before.
+
+    Near-identical grievances are often filed under different leaves, so only
+    the levels every close neighbour agrees on are reused. The full path is
+    reused only for a near-verbatim repeat.
+    """
+    semantic_cache.check_tree_version(tree_registry.version)
+    match = semantic_cache.lookup(query)
+    if match is None:
+        return []
+    paths = [path for path, _ in match.neighbours]
+    if match.similarity >= SEMANTIC_CACHE_FULL_SIMILARITY and all(path == match.path for path in paths):
+        warm_path = match.path
+    else:
+        warm_path = common_prefix(paths)
+        if tree_registry.is_leaf(warm_path):
+            warm_path = warm_path[:-1]
+    if warm_path and tree_registry.get_node(warm_path) is None:
+        return []
+    return warm_path
+
+async def flat_classification(
+    query: str,
+    dept_path: List[str],
+    session_id: str,
+    history: Optional[List["Content"]] = None,
+    use_cache: bool = True
+) -> Optional[List[str]]:
+    """
+    Classifies straight to a leaf below dept_path with one model call.
+
+    Returns the full path (already saved to the session), or None when the
+    shortlist is empty or the model is not confident; the caller then runs the
+    per-level descent.
+    """
+    shortlist = flat_classifier.shortlist(query, dept_path)
+    if not shortlist:
+        return None
+
+    template_parts = (
+        f"User Query: {query}",
+        f"Candidate Paths:\n{format_shortlist(shortlist)}",
+        f"Answer in JSON format only."
+    )
+    template = "\n".join(template_parts)
+    options = ["/".join(path) for path, _ in shortlist]
+    response = None
+    cache_key = None
+    if use_cache and CLASSIFICATION_CACHE_ENABLED:
+        tree_version = tree_registry.version
+        classification_cache.check_tree_version(tree_version)
+        cache_key = classification_cache_key(query, dept_path, options, history, tree_version)
+        response = await classification_cache.get_async(cache_key)
+    elif not use_cache:
+        classification_cache.bypassed += 1
+
+    if response is None:
+        response = await llm_router.generate("flat", template, history=history or [], prefix=FLAT_CLASSIFIER_PROMPT)
+        if cache_key is not None:
+            await classification_cache.put_async(cache_key, response)
+
+    new_dept_path = flat_classifier.choose(response, shortlist)
+    if new_dept_path is None:
+        logger.info(f"Flat classification not confident for session {session_id}: {response}")
+        return None
+    await update_dept_path(session_id, new_dept_path)
+    return new_dept_path
+
+async def query_classifier(query: str, chat_session_id: str, use_cache: bool = True, mode: Optional[str] = None):
+
+    mode = mode or CLASSIFICATION_MODE
+    if mode not in CLASSIFICATION_MODES:
+        raise ValueError(f"Unknown classification mode: {mode}")
+    started = time.perf_counter()
 
     history, dept_path = await get_history_from_sesh_id(chat_session_id)
     formatted_history = await convert_history_to_gemini_format(history)
-    next_children = await get_next_children(agriculture_tree, dept_path)
-
-    nature, result = await attempt_classification(
-        query=query,
-        dept_path=dept_path,
-        next_children=next_children,
-        history=formatted_history,
-        session_id=chat_session_id
-    )
+
+    if not dept_path and use_cache and SEMANTIC_CACHE_ENABLED:
+        warm_path = semantic_warm_start(query)
+        if warm_path:
+            logger.info(f"Warm start for session {chat_session_id} at level {len(warm_path)} from the semantic cache")
+            dept_path = warm_path
+            await update_dept_path(chat_session_id, dept_path)
+            if tree_registry.is_leaf(dept_path):
+                await update_reached_final(chat_session_id, "True")
+                return dept_path, dept_path
+
+    if not dept_path and use_cache and local_warm_start is not None:
+        dept_path = local_warm_start.warm_start(query)
+        if dept_path:
+            logger.info(f"Warm start for session {chat_session_id} at level {len(dept_path)} from the local classifier")
+            await update_dept_path(chat_session_id, dept_path)
+
+    nature = None
+    if mode == "flat" and not tree_registry.is_leaf(dept_path):
+        flat_path = await flat_classification(
+            query=query,
+            dept_path=dept_path,
+            session_id=chat_session_id,
+            history=formatted_history,
+            use_cache=use_cache
+        )
+        if flat_path is not None:
+            nature, result = "final_path", flat_path
+
+    if nature is None:
+        next_children = await get_next_children(tree_registry, dept_path)
+        if not dept_path:
+            # Lexical routing only puts the likeliest tree first; the model still picks the root
+            next_children = tree_registry.order_roots(query, next_children)
+
+        nature, result = await attempt_classification(
+            query=query,
+            dept_path=dept_path,
+            next_children=next_children,
+            history=formatted_history,
+            session_id=chat_session_id,
+            use_cache=use_cache
+        )
+    logger.info(f"Classification turn for session {chat_session_id}: {nature} in {time.perf_counter() - started:.2f}s ({mode} mode)")
 
     if nature == "question":
         new_history, new_dept_path = await get_history_from_sesh_id(chat_session_id)
@@ -331,6 +806,10 @@ async def query_classifier(query: str, chat_session_id: str):
         new_history, new_dept_path = await get_history_from_sesh_id(chat_session_id)
         print("\n\n======FINAL PATH REACHED=========\n\n")
         await update_reached_final(chat_session_id, "True")
+        if SEMANTIC_CACHE_ENABLED:
+            # Remember the grievance (the session's first message) with the path it resolved to
+            grievance = next((item.content for item in new_history if item.role == "user"), query)
+            semantic_cache.add(grievance, new_dept_path)
         return result, new_dept_path
     elif nature == "final_path_done":
         new_history, new_dept_path = await get_history_from_sesh_id(chat_session_id)
@@ -339,34 +818,137 @@ async def query_classifier(query: str, chat_session_id: str):
         print("something broke")
         return None, dept_path
 
+# A streamed classifier answer that has settled on "not found"
+NOT_FOUND_STATUS = re.compile(r'"status"\s*:\s*"not found"')
+
+
+async def classify_level(
+    query: str,
+    dept_path: List[str],
+    next_children: List[str],
+    history: Optional[List["Content"]] = None,
+    use_cache: bool = True,
+    relay: Optional[QuestionRelay] = None,
+    prune: bool = True
+) -> dict:
+    """
+    One per-level classifier call (or cache hit) choosing among next_children.
+
+    In the "combined" CLARIFY_MODE the response also carries the clarifying
+    question when the level is not found. With a (held) relay the call is
+    streamed, and the question goes to the relay as it arrives; the relay is
+    released once the answer says "not found".
+
+    A wide level is pruned to the children the candidate_pruner ranks best,
+    plus OTHER_OPTION; when the model picks that, the level is asked again
+    with the children left out.
+    """
+    prefix = CLASSIFY_OR_CLARIFY_PROMPT if CLARIFY_MODE == "combined" else QUERY_CLASSIFIER_PROMPT
+    options, rest = candidate_pruner.prune(query, dept_path, next_children) if prune else (next_children, [])
+    if rest:
+        options = options + [OTHER_OPTION]
+    template_parts = (
+        f"User Query: {query}",
+        f"Current Level Department Options (topic and summary): {json.dumps(options, indent=2)}",
+        f"Write a clarifying question in JSON format only."
+    )
+    template = "\n".join(template_parts)
+    response = None
+    cache_key = None
+    if use_cache and CLASSIFICATION_CACHE_ENABLED:
+        tree_version = tree_registry.version
+        classification_cache.check_tree_version(tree_version)
+        cache_key = classification_cache_key(query, dept_path, options, history, tree_version)
+        response = await classification_cache.get_async(cache_key)
+    elif not use_cache:
+        classification_cache.bypassed += 1
+
+    if response is None:
+        if relay is None or CLARIFY_MODE != "combined":
+            response = await llm_router.generate("classify", template, history=history or [], prefix=prefix)
+        else:
+            question_field = JsonStringField("clarifying_question")
+            streamed = []
+
+            def on_text(chunk: str):
+                streamed.append(chunk)
+                if not relay.live and NOT_FOUND_STATUS.search("".join(streamed)):
+                    relay.release()
+                relay(question_field.feed(chunk))
+
+            response = await llm_router.generate_streaming("classify", template, on_text, history=history or [], prefix=prefix)
+        if cache_key is not None:
+            await classification_cache.put_async(cache_key, response)
+    logger.debug(f"Classification at level {len(dept_path)}: {response}")
+    if rest and response.get("status") == "found":
+        chosen, _ = name_resolver.resolve(response.get("classified_department"), options)
+        if chosen == OTHER_OPTION:
+            candidate_pruner.record_other()
+            logger.info(f"Classifier chose {OTHER_OPTION!r} at level {len(dept_path)}; asking again with {len(rest)} other children")
+            return await classify_level(query, dept_path, rest, history, use_cache, relay=relay, prune=False)
+    return response
+
 async def attempt_classification(
     query: str,
     dept_path: List[str],
     next_children: List[str],
     session_id: str ,
-    history: Optional[List[Content]] = None
+    history: Optional[List["Content"]] = None,
+    use_cache: bool = True,
+    prefetched: Optional[asyncio.Task] = None
 ):
     is_final = await check_if_final_department(dept_path=dept_path)
     if is_final:
         print("Final department reached, no further classification needed.")
         return "final_path_done", dept_path
 
-    template_parts = (
-        QUERY_CLASSIFIER_PROMPT,
-        f"User Query: {query}",
-        f"Current Level Department Options (topic and summary): {json.dumps(next_children, indent=2)}",
-        f"Write a clarifying question in JSON format only."
-    )
-    template = "\n".join(template_parts)
-    model = Gemini_Model_VertexAI_With_History(model_name="gemini-2.5-flash-preview-05-20", chat_history=history)
-    response = model.generate(template)
-    print (response)
+    # While a client streams the turn, the question of this level's call is relayed as it arrives
+    combined_relay = None
+    if prefetched is None:
+        speculator.record_primary()
+        if streaming() and CLARIFY_MODE == "combined":
+            combined_relay = QuestionRelay(live=False)
+        level_call = classify_level(query, dept_path, next_children, history, use_cache, relay=combined_relay)
+    else:
+        # Started speculatively while the previous level was being classified
+        level_call = prefetched
+
+    # Start the next level for the likeliest children while this one is classified
+    speculative = {
+        child: speculator.start(child, classify_level(
+            query, dept_path + [child], await get_next_children(tree_registry, dept_path + [child]), history, use_cache
+        ))
+        for child in speculator.candidates(query, dept_path, next_children)
+    }
+    question_call = None
+    question_relay = None
+    if CLARIFY_MODE == "concurrent":
+        # Held back until the level turns out not found, as the call may yet be cancelled
+        question_relay = QuestionRelay(live=False) if streaming() else None
+        question_call = asyncio.ensure_future(
+            generate_relevant_questions(query=query, current_level_options=next_children, history=history, relay=question_relay)
+        )
+        question_call.add_done_callback(discard_result)
+    try:
+        response = await level_call
+    except BaseException:
+        speculator.settle(speculative, None)
+        if question_call is not None:
+            question_call.cancel()
+        raise
 
     result = response
 
-    # Check if department is found
+    classified_dept = None
     if result.get("status") == "found":
-        classified_dept = result.get("classified_department")
+        # Snap the model's answer to the exact sibling name; None if it matches none of them
+        classified_dept, _ = name_resolver.resolve(result.get("classified_department"), next_children)
+    next_level = speculator.settle(speculative, classified_dept)
+
+    # Check if department is found
+    if classified_dept is not None:
+        if question_call is not None:
+            question_call.cancel()
         new_dept_path= dept_path + [classified_dept]
         await update_dept_path(session_id, new_dept_path)
         is_final = await check_if_final_department(new_dept_path)
@@ -374,20 +956,32 @@ async def attempt_classification(
         if is_final==True:
             return "final_path", new_dept_path
         else:
-            new_children = await get_next_children(agriculture_tree, new_dept_path)
+            new_children = await get_next_children(tree_registry, new_dept_path)
             return await attempt_classification(
                 query=query,
                 dept_path=new_dept_path,
                 next_children=new_children,
                 history=history,
-                session_id=session_id
+                session_id=session_id,
+                use_cache=use_cache,
+                prefetched=next_level
             )
         
-    else: #result.get("status") == "not found"
-        question = await generate_relevant_questions(query=query, current_level_options=next_children, history=history)
+    else: #result.get("status") == "not found", or a department name that is not in the tree
+        if question_call is not None:
+            if question_relay is not None:
+                question_relay.release()
+            question = await question_call
+        else:
+            question = result.get("clarifying_question") if CLARIFY_MODE == "combined" else None
+            question_relay = combined_relay
+            if not question:
+                # Sequential mode, or the combined answer came without a question
+                question_relay = QuestionRelay() if streaming() else None
+                question = await generate_relevant_questions(
+                    query=query, current_level_options=next_children, history=history, relay=question_relay
+                )
+        if streaming():
+            # Whatever was not streamed, e.g. a cached or prefetched answer
+            (question_relay or QuestionRelay()).finish(question)
         return "question", question
-    
-
-
-
-
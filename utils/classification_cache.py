@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """Lower case, punctuation dropped, whitespace collapsed."""
+    return " ".join(re.findall(r"\w+", str(text).lower()))
+
+
+def history_digest(history: Optional[list], max_messages: int = 6) -> str:
+    """
+    Digest of the last max_messages messages of a Gemini-format history.
+
+    Only the tail is hashed, so a long conversation costs the same as a short
+    one, and the text is normalized like the query.
+    """
+    messages = []
+    for content in (history or [])[-max_messages:]:
+        text = " ".join(getattr(part, "text", "") or "" for part in getattr(content, "parts", []))
+        messages.append((getattr(content, "role", ""), normalize_query(text)))
+    return hashlib.sha256(json.dumps(messages).encode("utf-8")).hexdigest()
+
+
+def classification_cache_key(query: str, dept_path: Sequence[str], options: Sequence[str], history: Optional[list], tree_version: str) -> str:
+    """Key of one per-level classifier call: query, position in the tree, options and recent history."""
+    payload = json.dumps([normalize_query(query), list(dept_path), list(options), history_digest(history), tree_version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SqliteCacheStore:
+    """
+    Disk persistence for ClassificationCache, so cached results survive restarts.
+
+    One row per key with its expiry time; expired rows are ignored on read and
+    removed by prune(). WAL mode lets every worker share the file.
+    """
+    def __init__(self, path: str = "chat_history/classification_cache.db"):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS classification_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[dict, float]]:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM classification_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: str, value: dict, expires_at: float):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO classification_cache VALUES (?, ?, ?)", (key, json.dumps(value), expires_at)
+            )
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM classification_cache")
+
+    def prune(self) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute("DELETE FROM classification_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class ClassificationCache:
+    """
+    Result cache in front of the per-level classifier call.
+
+    The same grievance text (e.g. PM-KISAN "installment not received") comes in
+    over and over, and each one used to pay for a model call per level.
+    Results are kept in an in-memory LRU with a TTL and, if a store is given,
+    written through to disk so a restarted worker starts warm.
+
+    Keys come from classification_cache_key(), which includes the department
+    tree version. When the tree changes, the memory cache is cleared and old
+    disk entries can no longer match. Disk reads and writes run on the
+    executor, like the session store's.
+
+    Example:
+        result = await classification_cache.get_async(key)
+        if result is None:
+            result = await llm_router.generate("classify", template, history=history, prefix=prefix)
+            await classification_cache.put_async(key, result)
+    """
+    def __init__(self, max_entries: int = 10000, ttl: float = 24 * 3600, store: Optional[SqliteCacheStore] = None,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self.executor = executor
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Lookups a request skipped with use_cache=False; a disabled cache counts none
+        self.bypassed = 0
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._tree_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def check_tree_version(self, tree_version: str):
+        """Drops every cached result when the department tree has changed."""
+        if tree_version != self._tree_version:
+            with self._lock:
+                if self._tree_version is not None:
+                    logger.info(f"Department tree changed; clearing {len(self._entries)} cached classifications")
+                self._entries.clear()
+                self._tree_version = tree_version
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _put_memory(self, key: str, value: dict, expires_at: float):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self._get_memory(key)
+        if value is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                value = entry[0]
+                self._put_memory(key, value, entry[1])
+                self.disk_hits += 1
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, value, expires_at)
+        if self.store is not None:
+            self.store.put(key, value, expires_at)
+
+    async def get_async(self, key: str) -> Optional[dict]:
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.store is None:
+            self.misses += 1
+            return None
+        return await self._run(self.get, key)
+
+    async def put_async(self, key: str, value: dict):
+        if self.store is None:
+            self.put(key, value)
+        else:
+            await self._run(self.put, key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
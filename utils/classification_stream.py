@@ -0,0 +1,127 @@
+import re
+import json
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+# Receives (event, data) for the classification turn running in this context; None when nobody streams
+_sink: contextvars.ContextVar[Optional[Callable[[str, dict], None]]] = contextvars.ContextVar(
+    "classification_event_sink", default=None
+)
+
+
+@contextmanager
+def classification_events(sink: Callable[[str, dict], None]):
+    """
+    Sends the progress events of the classification turn run inside the block to sink.
+
+    Events: "level" with {"department", "path"} each time the session path
+    changes, and "question" with {"delta"} for each piece of the clarifying
+    question. Tasks started inside the block inherit the sink.
+
+    Example:
+        queue = asyncio.Queue()
+        with classification_events(lambda event, data: queue.put_nowait((event, data))):
+            result, path = await query_classifier(query, session_id)
+    """
+    token = _sink.set(sink)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+
+def streaming() -> bool:
+    return _sink.get() is not None
+
+
+def emit(event: str, data: dict):
+    sink = _sink.get()
+    if sink is not None:
+        sink(event, data)
+
+
+def format_sse(event: str, data: dict) -> str:
+    """One server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class QuestionRelay:
+    """
+    Passes clarifying-question text to the stream as "question" events.
+
+    A held relay keeps the text until release(), for a question whose call
+    may still be cancelled (the level might be found after all). `text` is
+    everything received so far.
+    """
+    def __init__(self, live: bool = True):
+        self.live = live
+        self.text = ""
+        self._held: List[str] = []
+
+    def __call__(self, delta: str):
+        if not delta:
+            return
+        self.text += delta
+        if self.live:
+            emit("question", {"delta": delta})
+        else:
+            self._held.append(delta)
+
+    def release(self):
+        self.live = True
+        held, self._held = "".join(self._held), []
+        if held:
+            emit("question", {"delta": held})
+
+    def finish(self, question: Optional[str]):
+        """Sends whatever part of the final question was not streamed (all of it for a cached answer)."""
+        self.release()
+        if question and question.startswith(self.text):
+            self(question[len(self.text):])
+        elif question and not self.text:
+            self(question)
+
+
+class JsonStringField:
+    """
+    Decodes one string field of a JSON object while the object is still arriving.
+
+    feed() takes the next chunk of model output and returns the new part of
+    the field's value (escape sequences decoded), or "" when there is none
+    yet. A field whose value is not a string (e.g. null) yields nothing.
+    """
+    def __init__(self, field: str):
+        self._start = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos: Optional[int] = None
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._start.search(self._buffer)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        buffer, i, out = self._buffer, self._pos, []
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char == "\\":
+                # An escape split across chunks waits for the rest
+                end = i + (6 if buffer[i + 1:i + 2] == "u" else 2)
+                if end > len(buffer):
+                    break
+                out.append(json.loads(f'"{buffer[i:end]}"'))
+                i = end
+                continue
+            out.append(char)
+            i += 1
+        self._pos = i
+        return "".join(out)
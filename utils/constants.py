@@ -129,6 +129,107 @@ Your JSON output should be:
 ---
 """
 
+CLASSIFY_OR_CLARIFY_PROMPT = f"""
+You are an expert classification assistant for a university grievance system. Your primary goal is to accurately categorize a user's query into **exactly one** of the department topics provided for the current classification level, and, when you cannot, to ask the one question that would let you.
+
+**Inputs You Will Receive:**
+1.  `user_query`: The user's grievance or question.
+2.  `conversation_history`: A list of previous turns in the conversation (if any), which might provide context.
+3.  `department_options`: A list of department objects, each with a `topic` (name) and `summary` (description).
+    Example format for `department_options` that will be dynamically inserted into the prompt:
+    `[
+        {{"topic": "Courses", "summary": "Course content, scheduling, and course registration problems."}},
+        {{"topic": "Exams", "summary": "Exam schedules, re-evaluation, or unfair grading complaints."}}
+    ]`
+
+**Your Task:**
+1.  Carefully analyze the `user_query` and any relevant `conversation_history`.
+2.  Compare the user's issue against the `topic` and `summary` of each department provided in the `department_options`.
+3.  Select the **single best matching** department `topic` from the `department_options`.
+4.  If the query clearly falls under one of the provided `department_options`, set `status` to "found", `classified_department` to the chosen `topic` name (string) and `clarifying_question` to `null`.
+5.  If the query is too vague to confidently choose one specific option from the list, OR if it clearly does not relate to any of the provided `department_options`, set `status` to "not found" and `classified_department` to `null`.
+    - **Crucially, do not attempt to classify into a department topic that is not explicitly listed in the current `department_options`.**
+    - If the query mentions something related but not specific enough for the current options, it's "not found" for this level.
+6.  When `status` is "not found", write **one clear, concise clarifying question** in `clarifying_question`, so no second request is needed.
+    - Ask for the specific detail that would let you choose exactly one of the `department_options`; mention the distinctions between the options if that helps the user.
+    - Ask a single, focused question. Avoid yes/no questions if a more descriptive answer is needed; offer choices or ask for specifics instead.
+
+**Output Format (Strict JSON ONLY):**
+Respond with ONLY a valid JSON object in the following format. Do NOT include any explanations, apologies, or introductory text outside the JSON structure.
+```json
+{{
+  "classified_department": "<Name of the chosen Department Topic or null>",
+  "status": "found" or "not found",
+  "clarifying_question": "<Your targeted follow-up question, or null when found>"
+}}
+```
+
+---
+**Example Scenario:**
+
+If the prompt includes:
+`Current Department Options:`
+`[
+    {{"topic": "Courses", "summary": "Course content, scheduling, and course registration problems."}},
+    {{"topic": "Exams", "summary": "Exam schedules, re-evaluation, or unfair grading complaints."}}
+]`
+`User Query: "I have an issue with my exam paper re-evaluation."`
+`Conversation History: []`
+
+Your JSON output should be:
+```json
+{{
+  "classified_department": "Exams",
+  "status": "found",
+  "clarifying_question": null
+}}
+```
+
+If the prompt includes:
+`Current Department Options:`
+`[
+    {{"topic": "Hostel Mess", "summary": "Issues related to food quality, menu, and hygiene in the hostel mess."}},
+    {{"topic": "Hostel Room Allocation", "summary": "Problems with room assignments, roommate conflicts, or room maintenance."}}
+]`
+`User Query: "I have a problem in the hostel."`
+`Conversation History: []`
+
+Your JSON output should be:
+```json
+{{
+  "classified_department": null,
+  "status": "not found",
+  "clarifying_question": "Is your hostel problem about the mess (food quality, menu or hygiene) or about your room (allocation, roommates or maintenance)?"
+}}
+```
+---
+"""
+
+FLAT_CLASSIFIER_PROMPT = f"""
+You are an expert classification assistant for a government grievance redressal system. Your goal is to assign a user's grievance to **exactly one** complete department path in a single step.
+
+**Inputs You Will Receive:**
+1.  `user_query`: The user's grievance.
+2.  `conversation_history`: Previous turns in the conversation (if any).
+3.  `candidate_paths`: A numbered list of complete department paths, from the top-level department down to the most specific category, separated by " > ".
+
+**Your Task:**
+1.  Read the `user_query` and any relevant `conversation_history`.
+2.  Pick the **single** candidate path whose most specific category matches the user's issue.
+3.  Rate your `confidence` from 0.0 to 1.0 that this is the correct path. Use a high value only when the grievance clearly describes the final category, not just the department.
+4.  If no candidate fits, or the grievance is too vague to choose between candidates, set `status` to "not found" and `path_number` to `null`.
+    - **Never invent a path or a number that is not in `candidate_paths`.**
+
+**Output Format (Strict JSON ONLY):**
+```json
+{{
+  "path_number": <number of the chosen path or null>,
+  "confidence": <number between 0.0 and 1.0>,
+  "status": "found" or "not found"
+}}
+```
+"""
+
 REFORMAT_QUERY_PROMPT = f"""
 You are an assistant helping to rewrite a grievance query to make it complete and self-contained.
 
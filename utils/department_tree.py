@@ -0,0 +1,370 @@
+import os
+import json
+import hashlib
+import re
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DepartmentNode:
+    """One node of a department tree, addressed by its full name path."""
+    __slots__ = ("path", "name", "categ_id", "level", "children", "is_leaf")
+
+    def __init__(self, path: Tuple[str, ...], name: str, categ_id: Optional[str], level: int, children: List[str]):
+        self.path = path
+        self.name = name
+        self.categ_id = categ_id
+        self.level = level
+        self.children = children
+        self.is_leaf = len(children) == 0
+
+    def __repr__(self):
+        return f"DepartmentNode(path={self.path!r}, categ_id={self.categ_id!r}, children={len(self.children)})"
+
+
+class DepartmentTree:
+    """
+    Precompiled index over a department tree JSON (name / categ_id / level / children).
+
+    The nested list is walked once at load time and every node is stored under
+    its path tuple, so listing children, checking for a leaf and validating a
+    path are single dict lookups instead of level-by-level name scans. The
+    root is the empty path (). If two siblings share a name, the first one
+    wins, as it did with the linear scan.
+
+    Example:
+        tree = DepartmentTree(agriculture_tree)
+        tree.children(["AGRICULTURE DEPARTMENT"])
+        tree.is_leaf(dept_path)
+    """
+    def __init__(self, tree: List[dict]):
+        self.tree = tree
+        self.nodes: Dict[Tuple[str, ...], DepartmentNode] = {}
+        self.nodes[()] = DepartmentNode((), "", None, -1, self._index_children((), tree, 0))
+
+    def _index_children(self, parent_path: Tuple[str, ...], children: List[dict], level: int) -> List[str]:
+        names = []
+        for child in children or []:
+            name = child.get("name")
+            path = parent_path + (name,)
+            if path in self.nodes:
+                continue
+            names.append(name)
+            grandchildren = self._index_children(path, child.get("children", []), level + 1)
+            self.nodes[path] = DepartmentNode(
+                path=path,
+                name=name,
+                categ_id=child.get("categ_id"),
+                level=int(child.get("level", level)),
+                children=grandchildren,
+            )
+        return names
+
+    def get(self, dept_path: Sequence[str]) -> Optional[DepartmentNode]:
+        return self.nodes.get(tuple(dept_path))
+
+    def contains(self, dept_path: Sequence[str]) -> bool:
+        return tuple(dept_path) in self.nodes
+
+    def children(self, dept_path: Sequence[str]) -> List[str]:
+        """Names of the children of dept_path; [] for a leaf or an unknown path."""
+        node = self.nodes.get(tuple(dept_path))
+        return list(node.children) if node is not None else []
+
+    def is_leaf(self, dept_path: Sequence[str]) -> bool:
+        """True if dept_path is a known, non-empty path ending in a node without children."""
+        if not dept_path:
+            return False
+        node = self.nodes.get(tuple(dept_path))
+        return node is not None and node.is_leaf
+
+    def iter_paths(self, max_depth: Optional[int] = None) -> Iterator[Tuple[Tuple[str, ...], DepartmentNode]]:
+        """Yields (path, node) for every node down to max_depth levels."""
+        for path, node in self.nodes.items():
+            if path and (max_depth is None or len(path) <= max_depth):
+                yield path, node
+
+    def leaf_paths(self) -> Iterator[Tuple[str, ...]]:
+        for path, node in self.nodes.items():
+            if node.is_leaf and path:
+                yield path
+
+    def __len__(self):
+        # Number of departments, not counting the root
+        return len(self.nodes) - 1
+
+    _compiled: Dict[int, Tuple[list, "DepartmentTree"]] = {}
+
+    @classmethod
+    def of(cls, tree: List[dict]) -> "DepartmentTree":
+        """Returns the compiled index for a tree list, compiling it on first use."""
+        entry = cls._compiled.get(id(tree))
+        if entry is None or entry[0] is not tree:
+            entry = (tree, cls(tree))
+            cls._compiled[id(tree)] = entry
+        return entry[1]
+
+
+ROUTING_STOPWORDS = {
+    "and", "the", "of", "to", "for", "in", "on", "by", "with", "related", "issue", "issues",
+    "department", "general", "other", "others", "not", "is", "has", "been", "are", "be",
+    "no", "up", "still", "through", "taking", "belonging", "connecting",
+}
+
+# Words of department names that any grievance may use ("no payment", "the form", "my
+# village"); they would send a query to whichever tree happens to name them
+ROUTING_GENERIC_WORDS = {
+    "new", "form", "payment", "village", "death", "birth", "unit", "demand", "supply", "details",
+    "information", "good", "state", "system", "works", "sector", "limited", "national", "records",
+    "register", "copies", "internal", "director", "establishment", "provision", "manual", "cross",
+    "light", "building", "family", "peoples", "bank", "community", "food", "security", "processing",
+    "produce", "purchase", "distribution", "incentive", "reward", "mission", "assistance",
+}
+
+
+def routing_tokens(text: str) -> set:
+    return {
+        token for token in re.findall(r"[a-z0-9]+", text.lower())
+        if len(token) > 1 and not token.isdigit() and token not in ROUTING_STOPWORDS and token not in ROUTING_GENERIC_WORDS
+    }
+
+
+class TreeRegistry:
+    """
+    Discovers department tree files and loads each one lazily on first use.
+
+    Tree files (<Name>_tree.json, or a compiled <Name>_tree.snap, which is
+    preferred) are found in the given directories; the first directory with a
+    given name wins, so utils/ can override data/. Discovery only lists file
+    names. The first call that needs the root departments (routing, or the
+    children of the empty path) builds a small routing profile per tree (root
+    names and the tokens of the department names down to routing_depth); JSON
+    trees are parsed for that and dropped again. A tree is compiled (or its
+    snapshot mapped) only when a path inside it is looked up, and is then
+    shared by every request in the process.
+
+    At most every reload_interval seconds the files are checked again. A tree
+    whose file changed is loaded into a new object and swapped in with a
+    single assignment, so requests already holding the old tree finish on it
+    and nothing has to restart. generation increases with every swap.
+
+    Example:
+        registry = TreeRegistry(["utils", "data"])
+        registry.route("PM Kisan installment not received")  # -> "AGRICULTURE DEPARTMENT"
+        registry.order_roots(query, registry.children([]))  # the routed root first
+        registry.children(["AGRICULTURE DEPARTMENT"])
+    """
+    PATTERNS = ("*_tree.snap", "*_tree.json")
+
+    def __init__(self, directories: Sequence[str], routing_depth: int = 3, reload_interval: float = 2.0,
+                 route_min_score: int = 2, route_margin: int = 2):
+        self.directories = list(directories)
+        self.routing_depth = routing_depth
+        self.route_min_score = route_min_score
+        self.route_margin = route_margin
+        self.reload_interval = reload_interval
+        self.generation = 0
+        self.files: Dict[str, str] = self._discover()
+        self._stamps: Dict[str, Optional[Tuple[int, int]]] = {key: self._stamp(path) for key, path in self.files.items()}
+        self._trees: Dict[str, DepartmentTree] = {}
+        self._root_to_key: Optional[Dict[str, str]] = None
+        self._route_tokens: Dict[str, set] = {}
+        self._lock = threading.RLock()
+        self._last_check = time.monotonic()
+        self._version = self._compute_version()
+
+    def _discover(self) -> Dict[str, str]:
+        files = {}
+        for directory in self.directories:
+            for pattern in self.PATTERNS:
+                for tree_file_path in sorted(Path(directory).glob(pattern)):
+                    files.setdefault(tree_file_path.name[:-len(pattern) + 1], str(tree_file_path))
+        return files
+
+    @staticmethod
+    def _stamp(file_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def keys(self) -> List[str]:
+        return list(self.files)
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Swaps in trees whose files changed since they were loaded.
+
+        Rate limited to one check every reload_interval seconds unless force is
+        set. Returns True if anything changed.
+        """
+        if not force and time.monotonic() - self._last_check < self.reload_interval:
+            return False
+        with self._lock:
+            self._last_check = time.monotonic()
+            files = self._discover()
+            changed = False
+            for key, path in files.items():
+                stamp = self._stamp(path)
+                if path == self.files.get(key) and stamp == self._stamps.get(key):
+                    continue
+                changed = True
+                self.files[key] = path
+                self._stamps[key] = stamp
+                if key in self._trees:
+                    try:
+                        self._trees[key] = self._load(key)
+                        logger.info(f"Reloaded department tree {key} from {path}")
+                    except Exception as e:
+                        # Keep serving the previous tree; a half-written file is retried next check
+                        logger.error(f"Error reloading department tree {key} from {path}: {str(e)}")
+                        self._stamps[key] = None
+            for key in set(self.files) - set(files):
+                changed = True
+                self.files.pop(key)
+                self._stamps.pop(key, None)
+                self._trees.pop(key, None)
+            if changed:
+                self._root_to_key = None
+                self.generation += 1
+                self._version = self._compute_version()
+            return changed
+
+    def _compute_version(self) -> str:
+        stamps = sorted((key, path, self._stamps.get(key)) for key, path in self.files.items())
+        return hashlib.sha1(json.dumps(stamps).encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def version(self) -> str:
+        """
+        Digest of the tree files and their stamps.
+
+        Unlike generation it is the same in every worker and across restarts as
+        long as the files are unchanged, so it can key persisted results.
+        """
+        self.refresh()
+        return self._version
+
+    def get(self, key: str):
+        """Returns the compiled tree for a tree name (e.g. "Agriculture"), loading it on first use."""
+        self.refresh()
+        tree = self._trees.get(key)
+        if tree is None:
+            with self._lock:
+                tree = self._trees.get(key)
+                if tree is None:
+                    tree = self._load(key)
+                    self._trees[key] = tree
+        return tree
+
+    def loaded_keys(self) -> List[str]:
+        return list(self._trees)
+
+    def _load(self, key: str):
+        path = self.files[key]
+        if path.endswith(".snap"):
+            from utils.tree_snapshot import TreeSnapshot
+            return TreeSnapshot.load(path)
+        return DepartmentTree(self._read(key))
+
+    def _read(self, key: str) -> List[dict]:
+        with open(self.files[key], "r") as file:
+            return json.load(file)
+
+    def _profiles(self) -> Dict[str, str]:
+        self.refresh()
+        root_to_key = self._root_to_key
+        if root_to_key is None:
+            with self._lock:
+                if self._root_to_key is None:
+                    root_to_key = {}
+                    route_tokens = {}
+                    for key, path in self.files.items():
+                        if key in self._trees or path.endswith(".snap"):
+                            # Compiled trees and snapshots are cheap to walk directly
+                            names = [p for p, _ in self.get(key).iter_paths(self.routing_depth)]
+                            roots = [p[0] for p in names if len(p) == 1]
+                            tokens = set().union(*(routing_tokens(p[-1]) for p in names))
+                        else:
+                            tree = self._read(key)
+                            roots = [root.get("name") for root in tree]
+                            tokens = self._collect_tokens(tree, self.routing_depth)
+                        for root in roots:
+                            root_to_key.setdefault(root, key)
+                        route_tokens[key] = tokens
+                    # Only tokens that point at a single tree are useful for routing
+                    for key, tokens in route_tokens.items():
+                        others = [other for other_key, other in route_tokens.items() if other_key != key]
+                        self._route_tokens[key] = tokens - set().union(*others)
+                    self._root_to_key = root_to_key
+                root_to_key = self._root_to_key
+        return root_to_key
+
+    @classmethod
+    def _collect_tokens(cls, nodes: List[dict], depth: int) -> set:
+        tokens = set()
+        if depth <= 0:
+            return tokens
+        for node in nodes or []:
+            tokens |= routing_tokens(node.get("name", ""))
+            tokens |= cls._collect_tokens(node.get("children", []), depth - 1)
+        return tokens
+
+    def root_departments(self) -> List[str]:
+        return list(self._profiles())
+
+    def tree_for_path(self, dept_path: Sequence[str]) -> Optional[DepartmentTree]:
+        if not dept_path:
+            return None
+        key = self._profiles().get(dept_path[0])
+        return self.get(key) if key is not None else None
+
+    def get_node(self, dept_path: Sequence[str]) -> Optional[DepartmentNode]:
+        tree = self.tree_for_path(dept_path)
+        return tree.get(dept_path) if tree is not None else None
+
+    def children(self, dept_path: Sequence[str]) -> List[str]:
+        """Children of dept_path across all trees; the root departments for the empty path."""
+        if not dept_path:
+            return self.root_departments()
+        tree = self.tree_for_path(dept_path)
+        return tree.children(dept_path) if tree is not None else []
+
+    def is_leaf(self, dept_path: Sequence[str]) -> bool:
+        tree = self.tree_for_path(dept_path)
+        return tree is not None and tree.is_leaf(dept_path)
+
+    def route(self, query: str) -> Optional[str]:
+        """
+        Cheap lexical routing of a query to a root department, before any LLM call.
+
+        Scores each tree by the query tokens that appear in its department names
+        and not in any other tree's (stopwords and generic words left out).
+        Returns the root department of the winner when it scores at least
+        route_min_score and leads the runner-up by route_margin, None otherwise.
+        """
+        root_to_key = self._profiles()
+        if len(self.files) < 2:
+            return None
+        query_tokens = routing_tokens(query)
+        scores = {key: len(query_tokens & tokens) for key, tokens in self._route_tokens.items()}
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_key, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        if best_score < self.route_min_score or best_score - runner_up < self.route_margin:
+            return None
+        roots = [root for root, key in root_to_key.items() if key == best_key]
+        return roots[0] if len(roots) == 1 else None
+
+    def order_roots(self, query: str, roots: Sequence[str]) -> List[str]:
+        """The root departments with the one route() picks first; the classifier still chooses among all of them."""
+        routed = self.route(query)
+        if routed is None or routed not in roots:
+            return list(roots)
+        return [routed] + [root for root in roots if root != routed]
@@ -0,0 +1,164 @@
+import logging
+import threading
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.semantic_cache import HashedTfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+# Placeholder level in data/department_strings.txt for paths shorter than six levels
+EMPTY_LEVEL = "NAN"
+
+
+def load_leaf_paths(file_path: str) -> List[Tuple[str, ...]]:
+    """Unique "/"-separated department paths from a file, in order, without trailing NAN levels."""
+    paths = {}
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            names = [name.strip() for name in line.strip().split("/")]
+            while names and names[-1] in (EMPTY_LEVEL, ""):
+                names.pop()
+            if names:
+                paths.setdefault(tuple(names), None)
+    return list(paths)
+
+
+def path_text(path: Sequence[str]) -> str:
+    # The leaf name counts twice: it is what tells siblings apart
+    return " ".join(path) + " " + path[-1]
+
+
+def tree_leaf_paths(registry) -> List[Tuple[str, ...]]:
+    """Every leaf path of every tree in a TreeRegistry."""
+    return [
+        path
+        for root in registry.root_departments()
+        for path in registry.tree_for_path([root]).leaf_paths()
+    ]
+
+
+class LeafPathIndex:
+    """
+    Lexical shortlist of full leaf paths for a query.
+
+    Each path's department names are a hashed TF-IDF row of one NumPy matrix
+    (IDF fitted on the paths themselves, so names shared by a whole subtree
+    weigh little). A shortlist is one matrix-vector product.
+    """
+    def __init__(self, paths: Iterable[Sequence[str]], dimensions: int = 2048):
+        self.paths = [tuple(path) for path in paths]
+        texts = [path_text(path) for path in self.paths]
+        self.vectorizer = HashedTfidfVectorizer(dimensions).fit(texts)
+        self._matrix = np.zeros((len(self.paths), dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            self._matrix[row] = self.vectorizer.transform(text)
+
+    def shortlist(self, query: str, k: int = 10, prefix: Sequence[str] = ()) -> List[Tuple[Tuple[str, ...], float]]:
+        """Up to k (path, score) pairs under prefix, best first; scores are cosine similarities."""
+        if not self.paths:
+            return []
+        scores = self._matrix @ self.vectorizer.transform(query)
+        if prefix:
+            prefix = tuple(prefix)
+            inside = np.fromiter((path[:len(prefix)] == prefix for path in self.paths), dtype=bool, count=len(self.paths))
+            scores = np.where(inside, scores, -np.inf)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(self.paths[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+    def __len__(self):
+        return len(self.paths)
+
+
+class FlatClassifier:
+    """
+    Single-shot classification over full leaf paths.
+
+    The per-level descent makes one model call per tree level. Here the
+    candidate leaf paths are shortlisted locally and the model picks one of
+    them in a single call. The answer is used only if the model is confident
+    enough; otherwise (or when nothing scores above min_score) the caller
+    falls back to the per-level descent.
+
+    Paths come from leaf_paths_file (e.g. data/department_strings.txt), keeping
+    only those that are leaves in the registry, or from every leaf in the
+    registry when no file is given. The index is rebuilt when the tree version
+    changes.
+
+    Example:
+        shortlist = flat_classifier.shortlist(query, dept_path)
+        prompt = "\n".join((f"User Query: {query}", format_shortlist(shortlist)))
+        response = await llm_router.generate("flat", prompt, history=history, prefix=FLAT_CLASSIFIER_PROMPT)
+        path = flat_classifier.choose(response, shortlist)  # None: use the per-level descent
+    """
+    def __init__(self, registry, leaf_paths_file: Optional[str] = None, shortlist_size: int = 20,
+                 min_score: float = 0.05, min_confidence: float = 0.7):
+        self.registry = registry
+        self.leaf_paths_file = leaf_paths_file
+        self.shortlist_size = shortlist_size
+        self.min_score = min_score
+        self.min_confidence = min_confidence
+        self.attempts = 0
+        self.resolved = 0
+        self.no_shortlist = 0
+        self.low_confidence = 0
+        self._index: Optional[LeafPathIndex] = None
+        self._tree_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _leaf_paths(self) -> List[Tuple[str, ...]]:
+        if self.leaf_paths_file is None:
+            return tree_leaf_paths(self.registry)
+        paths = load_leaf_paths(self.leaf_paths_file)
+        leaves = [path for path in paths if self.registry.is_leaf(path)]
+        if len(leaves) < len(paths):
+            logger.warning(f"{len(paths) - len(leaves)} paths in {self.leaf_paths_file} are not leaves of the department tree")
+        return leaves
+
+    def index(self) -> LeafPathIndex:
+        tree_version = self.registry.version
+        if self._index is None or tree_version != self._tree_version:
+            with self._lock:
+                if self._index is None or tree_version != self._tree_version:
+                    self._index = LeafPathIndex(self._leaf_paths())
+                    self._tree_version = tree_version
+                    logger.info(f"Flat classifier indexed {len(self._index)} leaf paths")
+        return self._index
+
+    def shortlist(self, query: str, dept_path: Sequence[str] = ()) -> List[Tuple[Tuple[str, ...], float]]:
+        """Candidate leaf paths below dept_path; [] when none scores min_score."""
+        self.attempts += 1
+        shortlist = self.index().shortlist(query, self.shortlist_size, prefix=dept_path)
+        if not shortlist or shortlist[0][1] < self.min_score:
+            self.no_shortlist += 1
+            return []
+        return shortlist
+
+    def choose(self, response: dict, shortlist: Sequence[Tuple[Tuple[str, ...], float]]) -> Optional[List[str]]:
+        """The path the model picked, or None when it found none or is below min_confidence."""
+        number = response.get("path_number") if response.get("status") == "found" else None
+        try:
+            confidence = float(response.get("confidence") or 0.0)
+        except (TypeError, ValueError):
+            confidence = 0.0
+        if not isinstance(number, int) or isinstance(number, bool) or not 1 <= number <= len(shortlist) or confidence < self.min_confidence:
+            self.low_confidence += 1
+            return None
+        self.resolved += 1
+        return list(shortlist[number - 1][0])
+
+    def stats(self) -> dict:
+        return {
+            "leaf_paths": len(self._index) if self._index is not None else 0,
+            "attempts": self.attempts,
+            "resolved": self.resolved,
+            "no_shortlist": self.no_shortlist,
+            "low_confidence": self.low_confidence,
+            "resolved_rate": self.resolved / self.attempts if self.attempts else 0.0,
+        }
+
+
+def format_shortlist(shortlist: Sequence[Tuple[Tuple[str, ...], float]]) -> str:
+    """Numbered candidate paths for the prompt, "1. A > B > C" per line."""
+    return "\n".join(f"{number}. {' > '.join(path)}" for number, (path, _) in enumerate(shortlist, 1))
@@ -0,0 +1,765 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import datetime
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from utils.resilience import Resilience, llm_concurrency, llm_resilience
+from utils.token_usage import TokenUsage, UsageCapture, approx_tokens, report_usage
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages that call a model; each is routed separately
+STAGES = ("classify", "flat", "clarify")
+
+
+def history_messages(history: Optional[list]) -> List[Tuple[str, str]]:
+    """(role, text) pairs from a Gemini Content history or History items; "model" becomes "assistant"."""
+    messages = []
+    for item in history or []:
+        role = getattr(item, "role", "user")
+        if hasattr(item, "parts"):
+            text = " ".join(getattr(part, "text", "") or "" for part in item.parts)
+        else:
+            text = getattr(item, "content", "")
+        messages.append(("assistant" if role == "model" else role, text))
+    return messages
+
+
+def parse_json_object(text: str) -> dict:
+    """The JSON object in a model reply, allowing for a ```json fence around it."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    result = json.loads(text)
+    if not isinstance(result, dict):
+        raise ValueError(f"Expected a JSON object from the model, got: {text[:200]}")
+    return result
+
+
+def full_prompt(prompt: str, prefix: Optional[str] = None) -> str:
+    """The prefix and the variable part as one prompt, for backends that cannot send them apart."""
+    return f"{prefix}\n{prompt}" if prefix else prompt
+
+
+class LLMBackend:
+    """
+    One way of getting a JSON answer from a model.
+
+    generate_json() sends the prompt (after the history, if any) and returns
+    the parsed JSON object. Every stage of the pipeline asks for JSON.
+    `prefix` is the static instructions shared by every call of a stage; it is
+    sent ahead of the history, where the provider can cache it, and `prompt`
+    holds only the variable part (query, options). Backends report the
+    provider's token counts with report_usage().
+
+    stream_text() yields the raw JSON text as the model produces it; backends
+    without streaming yield the whole answer at once.
+    """
+    name = "backend"
+
+    async def generate_json(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                            prefix: Optional[str] = None) -> dict:
+        raise NotImplementedError
+
+    async def stream_text(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                          prefix: Optional[str] = None) -> AsyncIterator[str]:
+        yield json.dumps(await self.generate_json(prompt, history=history, temperature=temperature, prefix=prefix))
+
+
+class VertexGeminiBackend(LLMBackend):
+    """
+    Gemini on Vertex AI through the pooled GenerativeModel objects.
+
+    With a history the call goes through a per-call ChatSession; without one
+    it is a single generate_content call. Both go through the worker's
+    concurrency limit and the rate limit / retry / circuit breaker layer.
+
+    The prefix becomes the model's system instruction (one pooled model per
+    prefix), so every call of a stage starts with the same tokens and Gemini's
+    implicit prefix caching applies. With context_cache_ttl > 0 the prefix is
+    also stored as Vertex context cache (CachedContent), refreshed every ttl
+    seconds; a prefix the API refuses to cache (e.g. below its minimum size)
+    stays on the implicit path.
+    """
+    def __init__(self, model_name: str, name: Optional[str] = None, context_cache_ttl: float = 0):
+        self.model_name = model_name
+        self.name = name or model_name
+        self.context_cache_ttl = context_cache_ttl
+        # sha256 of the prefix -> (model, refresh time), or (None, None) when the API refused it
+        self._context_caches: Dict[str, Tuple[object, Optional[float]]] = {}
+        self._context_cache_lock = threading.Lock()
+
+    def _context_cached_model(self, key: str, prefix: str):
+        """The model reading the prefix from Vertex context cache, or None. Blocking: creates the cache when due."""
+        from vertexai.preview.caching import CachedContent
+        from vertexai.preview.generative_models import GenerativeModel
+
+        with self._context_cache_lock:
+            model, refresh_at = self._context_caches.get(key, (None, 0.0))
+            if refresh_at is None or (model is not None and refresh_at > time.time()):
+                return model
+            try:
+                cached = CachedContent.create(
+                    model_name=self.model_name,
+                    system_instruction=prefix,
+                    ttl=datetime.timedelta(seconds=self.context_cache_ttl),
+                )
+                model = GenerativeModel.from_cached_content(cached_content=cached)
+                # Refresh a little before the cache expires on the server
+                self._context_caches[key] = (model, time.time() + 0.9 * self.context_cache_ttl)
+                logger.info(f"Created Vertex context cache {cached.name} for a {approx_tokens(prefix)}-token prefix")
+            except Exception as exc:
+                logger.warning(f"Vertex context cache unavailable for {self.model_name}, using implicit caching: {exc}")
+                model = None
+                self._context_caches[key] = (None, None)
+            return model
+
+    async def _model(self, prefix: Optional[str]):
+        from utils.models import model_pool
+
+        if prefix and self.context_cache_ttl > 0:
+            key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+            model, refresh_at = self._context_caches.get(key, (None, 0.0))
+            if refresh_at is not None and refresh_at <= time.time():
+                model = await asyncio.to_thread(self._context_cached_model, key, prefix)
+            if model is not None:
+                return model
+        return model_pool.get(self.model_name, system_instruction=prefix or None)
+
+    async def generate_json(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                            prefix: Optional[str] = None) -> dict:
+        # Imported here so the other backends work without the Vertex SDK configured
+        from vertexai.generative_models import ChatSession
+        from utils.models import SAFETY_SETTINGS
+
+        model = await self._model(prefix)
+        generation_config = {"temperature": temperature, "response_mime_type": "application/json"}
+
+        async def send():
+            async with llm_concurrency:
+                if history is None:
+                    return await model.generate_content_async(
+                        prompt, generation_config=generation_config, safety_settings=SAFETY_SETTINGS
+                    )
+                # A per-call session, so concurrent requests never share history
+                chat_session = ChatSession(model=model, history=list(history))
+                return await chat_session.send_message_async(
+                    [prompt], generation_config=generation_config, safety_settings=SAFETY_SETTINGS
+                )
+
+        response = await llm_resilience.call(send)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            report_usage(
+                input_tokens=getattr(usage, "prompt_token_count", None),
+                output_tokens=getattr(usage, "candidates_token_count", None),
+                cached_tokens=getattr(usage, "cached_content_token_count", None),
+            )
+        return parse_json_object(response.candidates[0].content.parts[0].text)
+
+    async def stream_text(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                          prefix: Optional[str] = None) -> AsyncIterator[str]:
+        from vertexai.generative_models import ChatSession
+        from utils.models import SAFETY_SETTINGS
+
+        model = await self._model(prefix)
+        generation_config = {"temperature": temperature, "response_mime_type": "application/json"}
+
+        async def start():
+            if history is None:
+                return await model.generate_content_async(
+                    prompt, generation_config=generation_config, safety_settings=SAFETY_SETTINGS, stream=True
+                )
+            chat_session = ChatSession(model=model, history=list(history))
+            return await chat_session.send_message_async(
+                [prompt], generation_config=generation_config, safety_settings=SAFETY_SETTINGS, stream=True
+            )
+
+        # Retries cover opening the stream; the slot is held until the last chunk
+        async with llm_concurrency:
+            chunks = await llm_resilience.call(start)
+            async for chunk in chunks:
+                parts = chunk.candidates[0].content.parts if chunk.candidates else []
+                text = "".join(getattr(part, "text", "") or "" for part in parts)
+                if text:
+                    yield text
+
+
+class TunedGeminiEndpointBackend(VertexGeminiBackend):
+    """
+    A tuned Gemini model served from a Vertex AI endpoint (model_finetuning/Gemini).
+
+    Vertex serves tuned Gemini models through the same GenerativeModel API,
+    with the endpoint's resource name in place of the model name.
+    """
+    def __init__(self, endpoint_id: str, project: Optional[str] = None, location: Optional[str] = None, name: Optional[str] = None,
+                 context_cache_ttl: float = 0):
+        project = project or os.getenv("GOOGLE_CLOUD_PROJECT")
+        location = location or os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
+        super().__init__(f"projects/{project}/locations/{location}/endpoints/{endpoint_id}", name=name or f"tuned-{endpoint_id}",
+                         context_cache_ttl=context_cache_ttl)
+
+
+class OpenAIChatBackend(LLMBackend):
+    """
+    OpenAI chat completions, e.g. the fine-tuned gpt-4o-mini grievance classifier.
+
+    The openai package is only needed when this backend is configured. The
+    API key is read from api_key_env (the fine-tuning scripts use
+    Openai_api_key). Calls share the worker's concurrency limit and go through
+    their own retry / circuit breaker, so OpenAI errors never open the breaker
+    for Vertex. The prefix goes first as the system message, which OpenAI's
+    automatic prompt caching picks up.
+    """
+    def __init__(self, model: str, api_key_env: str = "OPENAI_API_KEY", name: Optional[str] = None,
+                 json_mode: bool = True, resilience: Optional[Resilience] = None):
+        self.model = model
+        self.api_key_env = api_key_env
+        self.name = name or model
+        self.json_mode = json_mode
+        self.resilience = resilience or Resilience()
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=os.getenv(self.api_key_env) or os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    async def generate_json(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                            prefix: Optional[str] = None) -> dict:
+        messages = [{"role": "system", "content": prefix}] if prefix else []
+        messages.extend({"role": role, "content": text} for role, text in history_messages(history))
+        messages.append({"role": "user", "content": prompt})
+        kwargs = {"response_format": {"type": "json_object"}} if self.json_mode else {}
+
+        async def send():
+            async with llm_concurrency:
+                return await self._get_client().chat.completions.create(
+                    model=self.model, messages=messages, temperature=temperature, **kwargs
+                )
+
+        response = await self.resilience.call(send)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            report_usage(
+                input_tokens=getattr(usage, "prompt_tokens", None),
+                output_tokens=getattr(usage, "completion_tokens", None),
+                cached_tokens=getattr(details, "cached_tokens", None),
+            )
+        return parse_json_object(response.choices[0].message.content)
+
+    async def stream_text(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                          prefix: Optional[str] = None) -> AsyncIterator[str]:
+        messages = [{"role": "system", "content": prefix}] if prefix else []
+        messages.extend({"role": role, "content": text} for role, text in history_messages(history))
+        messages.append({"role": "user", "content": prompt})
+        kwargs = {"response_format": {"type": "json_object"}} if self.json_mode else {}
+
+        async def start():
+            return await self._get_client().chat.completions.create(
+                model=self.model, messages=messages, temperature=temperature, stream=True, **kwargs
+            )
+
+        async with llm_concurrency:
+            chunks = await self.resilience.call(start)
+            async for chunk in chunks:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+
+
+class StubBackend(LLMBackend):
+    """
+    Local stand-in that answers every stage without a model.
+
+    The classifier picks the option sharing the most words with the query
+    (the first option when none does, unless decisive is False, in which case
+    it answers "not found"); the flat classifier picks the first candidate;
+    the clarifying question is a fixed sentence. `answer` replaces all of that
+    with a function of the prompt.
+    """
+    OPTIONS = re.compile(r"Current Level Department Options \(topic and summary\): (\[.*?\])\n", re.S)
+    # At the start of a line, so the examples inside the prompts don't match
+    QUERY = re.compile(r"^User Query: (.*)", re.M)
+
+    def __init__(self, latency: float = 0.0, decisive: bool = True, answer: Optional[Callable[[str], dict]] = None, name: str = "stub"):
+        self.latency = latency
+        self.decisive = decisive
+        self.answer = answer
+        self.name = name
+        self.calls = 0
+
+    @staticmethod
+    def _words(text: str) -> set:
+        return {word for word in re.findall(r"[a-z0-9]+", text.lower()) if len(word) > 2}
+
+    def question(self, options: list) -> str:
+        return "Could you tell me a little more about your grievance?"
+
+    def respond(self, prompt: str) -> dict:
+        if self.answer is not None:
+            return self.answer(prompt)
+        if "Candidate Paths:" in prompt:
+            return {"status": "found", "path_number": 1, "confidence": 0.9}
+        options = self.OPTIONS.search(prompt)
+        options = json.loads(options.group(1)) if options else None
+        question = self.question(options or [])
+        if '"classified_department"' not in prompt or options is None:
+            return {"clarifying_question": question}
+        query = self.QUERY.search(prompt)
+        words = self._words(query.group(1)) if query else set()
+        scores = [len(words & self._words(str(option))) for option in options]
+        if options and (max(scores) > 0 or self.decisive):
+            return {"status": "found", "classified_department": options[scores.index(max(scores))], "clarifying_question": None}
+        answer = {"status": "not found", "classified_department": None}
+        if '"clarifying_question"' in prompt:
+            answer["clarifying_question"] = question
+        return answer
+
+    async def generate_json(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                            prefix: Optional[str] = None) -> dict:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(full_prompt(prompt, prefix))
+
+    async def stream_text(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                          prefix: Optional[str] = None) -> AsyncIterator[str]:
+        # The first chunk after the full latency, then a few characters at a time
+        text = json.dumps(await self.generate_json(prompt, history=history, temperature=temperature, prefix=prefix))
+        for start in range(0, len(text), 8):
+            yield text[start:start + 8]
+            await asyncio.sleep(0)
+
+
+class OfflineModelError(Exception):
+    """An injected OfflineBackend failure; retried like a Vertex 503."""
+    code = 503
+
+
+class OfflineBackend(StubBackend):
+    """
+    Deterministic stand-in for the Vertex models, for load and regression runs
+    without credentials or network (LLM_OFFLINE=true in chat_utils).
+
+    Answers come from the prompt alone, so from the department tree and the
+    query: the classifier picks the option sharing the most words with the
+    query, the flat classifier the candidate path sharing the most words, and
+    the clarifying question names the options. Latency is lognormal around
+    the `latency` median (latency_sigma = 0 makes it constant), and
+    error_rate of the calls fail with a retryable OfflineModelError. Both are
+    drawn from a generator seeded with `seed`, so a run can be repeated.
+    Calls take a slot of the worker's concurrency limit and go through the
+    same rate limit / retry / circuit breaker layer as the Vertex calls.
+    """
+    CANDIDATE = re.compile(r"^(\d+)\. (.+)$", re.M)
+
+    def __init__(self, latency: float = 0.0, latency_sigma: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 decisive: bool = True, name: str = "offline", resilience: Optional[Resilience] = None):
+        super().__init__(latency=latency, decisive=decisive, name=name)
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.resilience = resilience or llm_resilience
+        self.errors = 0
+        self._rng = random.Random(seed)
+
+    def question(self, options: list) -> str:
+        names = [str(option.get("topic", option)) if isinstance(option, dict) else str(option) for option in options[:3]]
+        if len(names) < 2:
+            return super().question(options)
+        return f"Is your grievance about {', '.join(names[:-1])} or {names[-1]}?"
+
+    def respond(self, prompt: str) -> dict:
+        if "Candidate Paths:" in prompt:
+            query = self.QUERY.search(prompt)
+            words = self._words(query.group(1)) if query else set()
+            candidates = self.CANDIDATE.findall(prompt.split("Candidate Paths:", 1)[1])
+            scores = [len(words & self._words(path)) for _, path in candidates]
+            if not scores:
+                return {"status": "not found", "path_number": None, "confidence": 0.0}
+            best = scores.index(max(scores))
+            return {"status": "found", "path_number": int(candidates[best][0]), "confidence": 0.9 if scores[best] else 0.5}
+        return super().respond(prompt)
+
+    def sample_latency(self) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency
+        return self.latency * math.exp(self._rng.gauss(0.0, self.latency_sigma))
+
+    async def generate_json(self, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                            prefix: Optional[str] = None) -> dict:
+        async def send():
+            self.calls += 1
+            async with llm_concurrency:
+                latency = self.sample_latency()
+                if latency > 0:
+                    await asyncio.sleep(latency)
+            if self.error_rate > 0 and self._rng.random() < self.error_rate:
+                self.errors += 1
+                raise OfflineModelError(f"Injected error from {self.name}")
+            return self.respond(full_prompt(prompt, prefix))
+
+        return await self.resilience.call(send)
+
+
+class BackendStats:
+    """
+    Rolling latency and error rate of one backend on one stage.
+
+    Covers the last `window` calls, and only those from the last max_age
+    seconds (None: no age limit), so a burst of errors stops counting against
+    a backend once it is old even if the backend has not been called since.
+    """
+    def __init__(self, window: int = 50, max_age: Optional[float] = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self._outcomes: Deque[Tuple[float, bool]] = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        now = self.clock()
+        self._outcomes.append((now, ok))
+        if ok:
+            self._latencies.append((now, latency))
+
+    def _expire(self):
+        if self.max_age is None:
+            return
+        cutoff = self.clock() - self.max_age
+        for entries in (self._outcomes, self._latencies):
+            while entries and entries[0][0] < cutoff:
+                entries.popleft()
+
+    @property
+    def outcomes(self) -> List[bool]:
+        self._expire()
+        return [ok for _, ok in self._outcomes]
+
+    @property
+    def latencies(self) -> List[float]:
+        self._expire()
+        return [latency for _, latency in self._latencies]
+
+    @property
+    def error_rate(self) -> float:
+        outcomes = self.outcomes
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    @property
+    def mean_latency(self) -> Optional[float]:
+        latencies = self.latencies
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def as_dict(self) -> dict:
+        return {"calls": len(self.outcomes), "mean_latency": self.mean_latency, "error_rate": self.error_rate}
+
+
+class Hedger:
+    """
+    Request hedging: a duplicate call when the first one is slower than usual.
+
+    Latencies are tracked per stage and backend over the last `window`
+    calls (a cancelled call counts with the time it ran). Once min_samples are in, a call still running at the
+    `percentile` of its backend's latencies gets a duplicate, sent to the
+    stage's next backend (or the same one when to_secondary is False or there
+    is no other). Whichever answers first wins and the other is cancelled.
+    Hedges are capped at max_rate of all calls, so a slow spell cannot double
+    the traffic.
+
+    Example:
+        llm_router.hedger = Hedger(percentile=0.95, max_rate=0.05)
+    """
+    def __init__(self, percentile: float = 0.95, max_rate: float = 0.05, min_samples: int = 20,
+                 window: int = 500, to_secondary: bool = True):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.window = window
+        self.to_secondary = to_secondary
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def observe(self, stage: str, name: str, latency: float):
+        key = (stage, name)
+        if key not in self._latencies:
+            self._latencies[key] = deque(maxlen=self.window)
+        self._latencies[key].append(latency)
+
+    def deadline(self, stage: str, name: str) -> Optional[float]:
+        """Seconds after which a call to this backend is hedged; None until there are enough samples."""
+        latencies = self._latencies.get((stage, name))
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def allow(self) -> bool:
+        """Takes one hedge from the budget if it has one left."""
+        if self.hedges + 1 > self.max_rate * self.calls:
+            return False
+        self.hedges += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_rate": self.hedges / self.calls if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "deadlines": {f"{stage}/{name}": self.deadline(stage, name) for stage, name in self._latencies},
+        }
+
+
+class BackendRouter:
+    """
+    Picks a backend per stage from config and from rolling latency / error statistics.
+
+    Each stage has an ordered list of candidate backends. A call goes to the
+    candidate with the lowest expected cost: its mean latency over the recent
+    window, scaled up by its error rate. Candidates with no recent calls are
+    tried first, and with probability `explore` a random other candidate is
+    used, so the statistics of the slower backends stay current. Backends
+    whose error rate is above max_error_rate are otherwise used only when
+    every candidate is; exploration still probes them, and their statistics
+    expire after stats_max_age seconds, so a past burst of errors does not
+    shut a backend out for good.
+    If the chosen backend fails, the next one is tried; the last error is
+    raised when all fail. With a Hedger, slow calls are also duplicated.
+    Token counts and latency of every successful call are added up per stage
+    in `usage`.
+
+    Example:
+        router = BackendRouter({"gemini": VertexGeminiBackend("gemini-2.0-flash-001"), "stub": StubBackend()},
+                               {"classify": ["gemini", "stub"]})
+        response = await router.generate("classify", prompt, history)
+    """
+    def __init__(self, backends: Dict[str, LLMBackend], stages: Dict[str, Sequence[str]], window: int = 50,
+                 explore: float = 0.05, max_error_rate: float = 0.5, rng: Optional[random.Random] = None,
+                 hedger: Optional[Hedger] = None, stats_max_age: Optional[float] = 300.0):
+        for stage, names in stages.items():
+            missing = [name for name in names if name not in backends]
+            if missing or not names:
+                raise ValueError(f"Stage {stage!r} names unknown or no backends: {missing}")
+        self.backends = backends
+        self.stages = {stage: list(names) for stage, names in stages.items()}
+        self.window = window
+        self.explore = explore
+        self.max_error_rate = max_error_rate
+        self.stats_max_age = stats_max_age
+        self._rng = rng or random.Random()
+        self._stats: Dict[Tuple[str, str], BackendStats] = {}
+        self.hedger = hedger
+        self.usage = TokenUsage()
+
+    def stats_for(self, stage: str, name: str) -> BackendStats:
+        key = (stage, name)
+        if key not in self._stats:
+            self._stats[key] = BackendStats(self.window, self.stats_max_age)
+        return self._stats[key]
+
+    def _cost(self, stage: str, name: str) -> float:
+        stats = self.stats_for(stage, name)
+        if stats.mean_latency is None:
+            return 0.0
+        return stats.mean_latency * (1 + 4 * stats.error_rate)
+
+    def order(self, stage: str) -> List[str]:
+        """Candidates for stage, in the order they would be tried."""
+        names = self.stages[stage]
+        healthy = [name for name in names if self.stats_for(stage, name).error_rate <= self.max_error_rate] or list(names)
+        ranked = sorted(healthy, key=lambda name: self._cost(stage, name))
+        ranked += [name for name in names if name not in ranked]
+        if len(ranked) > 1 and self._rng.random() < self.explore:
+            # Unhealthy backends are probed too, so one that recovered is noticed
+            ranked.insert(0, ranked.pop(self._rng.randrange(1, len(ranked))))
+        return ranked
+
+    def _record_usage(self, stage: str, call: dict, response: dict, reported: dict, latency: float):
+        prefix_tokens = approx_tokens(call["prefix"])
+        input_tokens = reported.get("input_tokens")
+        output_tokens = reported.get("output_tokens")
+        estimated = input_tokens is None or output_tokens is None
+        if input_tokens is None:
+            input_tokens = prefix_tokens + approx_tokens(call["prompt"]) + sum(
+                approx_tokens(text) for _, text in history_messages(call["history"])
+            )
+        if output_tokens is None:
+            output_tokens = approx_tokens(json.dumps(response))
+        self.usage.record(stage, input_tokens, output_tokens, latency, prefix_tokens=prefix_tokens,
+                          cached_tokens=reported.get("cached_tokens") or 0, estimated=estimated)
+
+    async def _timed(self, stage: str, name: str, call: dict) -> dict:
+        start = time.perf_counter()
+        try:
+            with UsageCapture() as reported:
+                response = await self.backends[name].generate_json(**call)
+        except asyncio.CancelledError:
+            if self.hedger is not None:
+                # A cancelled call took at least this long; leaving it out would hide the tail
+                self.hedger.observe(stage, name, time.perf_counter() - start)
+            raise
+        except Exception:
+            self.stats_for(stage, name).record(time.perf_counter() - start, False)
+            raise
+        latency = time.perf_counter() - start
+        self.stats_for(stage, name).record(latency, True)
+        self._record_usage(stage, call, response, reported, latency)
+        if self.hedger is not None:
+            self.hedger.observe(stage, name, latency)
+        return response
+
+    async def _hedged(self, stage: str, name: str, secondary: Optional[str], call: dict) -> dict:
+        hedger = self.hedger
+        hedger.calls += 1
+        deadline = hedger.deadline(stage, name)
+        primary = asyncio.ensure_future(self._timed(stage, name, call))
+        if deadline is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=deadline)
+        if done or not hedger.allow():
+            return await primary
+
+        hedge_name = secondary if hedger.to_secondary and secondary is not None else name
+        logger.info(f"Hedging {stage} call to {name} after {deadline:.2f}s with {hedge_name}")
+        hedge = asyncio.ensure_future(self._timed(stage, hedge_name, call))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            hedger.hedge_wins += 1
+                        return task.result()
+            # Both failed: report the original call's error
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if not task.done():
+                    task.cancel()
+
+    async def generate(self, stage: str, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                       prefix: Optional[str] = None) -> dict:
+        call = {"prompt": prompt, "history": history, "temperature": temperature, "prefix": prefix}
+        error = None
+        names = self.order(stage)
+        for position, name in enumerate(names):
+            try:
+                if self.hedger is None:
+                    return await self._timed(stage, name, call)
+                secondary = names[position + 1] if position + 1 < len(names) else None
+                return await self._hedged(stage, name, secondary, call)
+            except Exception as exc:
+                logger.warning(f"Backend {name} failed on {stage}: {exc}")
+                error = exc
+        raise error
+
+    async def stream(self, stage: str, prompt: str, history: Optional[list] = None, temperature: float = 0.5,
+                     prefix: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Like generate(), but yields the answer's text as it arrives.
+
+        A backend that fails before its first chunk falls through to the next
+        one; once text has been yielded the error is raised. Streamed calls
+        are not hedged, and their token counts are estimates.
+        """
+        call = {"prompt": prompt, "history": history, "temperature": temperature, "prefix": prefix}
+        error = None
+        for name in self.order(stage):
+            start = time.perf_counter()
+            chunks = []
+            try:
+                async for chunk in self.backends[name].stream_text(**call):
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as exc:
+                self.stats_for(stage, name).record(time.perf_counter() - start, False)
+                if chunks:
+                    raise
+                logger.warning(f"Backend {name} failed on {stage}: {exc}")
+                error = exc
+                continue
+            latency = time.perf_counter() - start
+            self.stats_for(stage, name).record(latency, True)
+            self.usage.record(
+                stage,
+                approx_tokens(prefix) + approx_tokens(prompt) + sum(approx_tokens(text) for _, text in history_messages(history)),
+                approx_tokens("".join(chunks)),
+                latency,
+                prefix_tokens=approx_tokens(prefix),
+                estimated=True
+            )
+            return
+        raise error
+
+    async def generate_streaming(self, stage: str, prompt: str, on_text: Callable[[str], None], history: Optional[list] = None,
+                                 temperature: float = 0.5, prefix: Optional[str] = None) -> dict:
+        """The parsed answer of stream(), calling on_text with each chunk as it arrives."""
+        chunks = []
+        async for chunk in self.stream(stage, prompt, history=history, temperature=temperature, prefix=prefix):
+            chunks.append(chunk)
+            on_text(chunk)
+        return parse_json_object("".join(chunks))
+
+    def stats(self) -> dict:
+        return {f"{stage}/{name}": stats.as_dict() for (stage, name), stats in self._stats.items()}
+
+
+def build_backend(name: str, config: dict) -> LLMBackend:
+    """A backend from its config entry, e.g. {"type": "openai", "model": "ft:gpt-4o-mini-..."}."""
+    kind = config.get("type", "vertex")
+    if kind == "vertex":
+        return VertexGeminiBackend(config["model"], name=name, context_cache_ttl=config.get("context_cache_ttl", 0))
+    if kind == "vertex_endpoint":
+        return TunedGeminiEndpointBackend(config["endpoint_id"], config.get("project"), config.get("location"), name=name,
+                                          context_cache_ttl=config.get("context_cache_ttl", 0))
+    if kind == "openai":
+        return OpenAIChatBackend(config["model"], api_key_env=config.get("api_key_env", "OPENAI_API_KEY"), name=name,
+                                 json_mode=config.get("json_mode", True))
+    if kind == "offline":
+        return OfflineBackend(latency=config.get("latency", 0.0), latency_sigma=config.get("latency_sigma", 0.0),
+                              error_rate=config.get("error_rate", 0.0), seed=config.get("seed", 0), name=name)
+    if kind == "stub":
+        return StubBackend(latency=config.get("latency", 0.0), decisive=config.get("decisive", True), name=name)
+    raise ValueError(f"Unknown backend type for {name}: {kind}")
+
+
+def load_router(config: dict, defaults: Dict[str, LLMBackend]) -> BackendRouter:
+    """
+    Router from a config like:
+
+        {
+          "backends": {
+            "gemini-flash": {"type": "vertex", "model": "gemini-2.5-flash-preview-05-20", "context_cache_ttl": 3600},
+            "gpt-ft": {"type": "openai", "model": "ft:gpt-4o-mini-2024-07-18:...", "api_key_env": "Openai_api_key"},
+            "gemini-tuned": {"type": "vertex_endpoint", "endpoint_id": "3493514578816401408"},
+            "stub": {"type": "stub"},
+            "offline": {"type": "offline", "latency": 0.4, "latency_sigma": 0.3, "error_rate": 0.01}
+          },
+          "stages": {"classify": ["gemini-flash", "gpt-ft"], "clarify": ["gemini-flash"]},
+          "routing": {"window": 50, "explore": 0.05, "max_error_rate": 0.5, "stats_max_age": 300}
+        }
+
+    `defaults` maps each stage to the backend it uses when the config does
+    not route it (the built-in Vertex models).
+    """
+    backends = {name: build_backend(name, entry) for name, entry in config.get("backends", {}).items()}
+    stages = {stage: list(names) for stage, names in config.get("stages", {}).items()}
+    for stage, backend in defaults.items():
+        if stage not in stages:
+            backends.setdefault(backend.name, backend)
+            stages[stage] = [backend.name]
+    return BackendRouter(backends, stages, **config.get("routing", {}))
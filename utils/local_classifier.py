@@ -0,0 +1,202 @@
+import csv
+import logging
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.semantic_cache import HashedTfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def load_labeled_csv(csv_path: str, text_column: str = "translated_grievance",
+                     label_column: str = "target_grievance_category") -> Tuple[List[str], List[Tuple[str, ...]]]:
+    """(texts, paths) from a labeled grievance CSV such as data/PM_Kisan/train.csv; labels are "/"-separated paths."""
+    texts, paths = [], []
+    with open(csv_path, "r", newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            label = (row.get(label_column) or "").strip()
+            if label:
+                texts.append(row.get(text_column) or "")
+                paths.append(tuple(name.strip() for name in label.split("/")))
+    return texts, paths
+
+
+class LocalClassifier:
+    """
+    CPU-only grievance classifier: hashed TF-IDF features and a softmax
+    (multinomial logistic regression) layer, trained with NumPy.
+
+    Each class is a full department path from the training labels. predict()
+    returns the likeliest path with its probability, and the cosine
+    similarity of the query to that class's training centroid;
+    predict_prefix() the deepest level it is sure of. The similarity keeps
+    out grievances unlike anything in the training data, which the softmax
+    would still spread over the known classes.
+
+    A model is a few arrays, saved with np.savez and loaded in milliseconds.
+
+    Example:
+        classifier = LocalClassifier.train(*load_labeled_csv("data/PM_Kisan/train.csv"))
+        path, probability, similarity = classifier.predict(query)
+    """
+    def __init__(self, vectorizer: HashedTfidfVectorizer, classes: Sequence[Tuple[str, ...]], weights: np.ndarray,
+                 bias: np.ndarray, centroids: np.ndarray):
+        self.vectorizer = vectorizer
+        self.classes = [tuple(path) for path in classes]
+        self.weights = weights
+        self.bias = bias
+        self.centroids = centroids
+
+    @classmethod
+    def train(cls, texts: Sequence[str], paths: Sequence[Sequence[str]], dimensions: int = 4096,
+              l2: float = 1e-4, epochs: int = 1000, learning_rate: float = 5.0) -> "LocalClassifier":
+        """Fits the IDF weights and the softmax layer (full-batch gradient descent) on labeled grievances."""
+        classes = sorted({tuple(path) for path in paths})
+        index = {path: i for i, path in enumerate(classes)}
+        vectorizer = HashedTfidfVectorizer(dimensions).fit(texts)
+        features = np.stack([vectorizer.transform(text) for text in texts])
+        targets = np.zeros((len(texts), len(classes)), dtype=np.float32)
+        targets[np.arange(len(texts)), [index[tuple(path)] for path in paths]] = 1.0
+
+        # Started at zero, gradient descent keeps the weights a combination of the training
+        # rows (weights = features.T @ coefficients), so each step only needs the
+        # n x n Gram matrix instead of the n x dimensions features
+        gram = features @ features.T
+        coefficients = np.zeros((len(texts), len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        for _ in range(epochs):
+            error = (_softmax(gram @ coefficients + bias) - targets) / len(texts)
+            coefficients -= learning_rate * (error + l2 * coefficients)
+            bias -= learning_rate * error.sum(axis=0)
+        weights = features.T @ coefficients
+
+        centroids = targets.T @ features
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids = centroids / np.where(norms > 0, norms, 1)
+        return cls(vectorizer, classes, weights, bias, centroids.astype(np.float32))
+
+    @classmethod
+    def from_csv(cls, csv_path: str, **kwargs) -> "LocalClassifier":
+        return cls.train(*load_labeled_csv(csv_path), **kwargs)
+
+    def predict_proba(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(probabilities, features): one row per text."""
+        features = np.stack([self.vectorizer.transform(text) for text in texts])
+        return _softmax(features @ self.weights + self.bias), features
+
+    def predict(self, text: str) -> Tuple[Tuple[str, ...], float, float]:
+        """(path, probability, similarity to the path's training centroid)."""
+        probabilities, features = self.predict_proba([text])
+        best = int(np.argmax(probabilities[0]))
+        return self.classes[best], float(probabilities[0, best]), float(features[0] @ self.centroids[best])
+
+    def predict_prefix(self, text: str, threshold: float) -> Tuple[Tuple[str, ...], float, float]:
+        """
+        (prefix, probability, similarity): the deepest proper prefix of the likeliest path
+        whose classes together have at least `threshold` probability; () if none has.
+
+        The leaf itself is never returned: the prefix is a starting point for the
+        model-based descent, not a final answer.
+        """
+        probabilities, features = self.predict_proba([text])
+        best = int(np.argmax(probabilities[0]))
+        path = self.classes[best]
+        similarity = float(features[0] @ self.centroids[best])
+        for depth in range(len(path) - 1, 0, -1):
+            mass = sum(float(probability) for cls, probability in zip(self.classes, probabilities[0]) if cls[:depth] == path[:depth])
+            if mass >= threshold:
+                return path[:depth], mass, similarity
+        return (), 0.0, similarity
+
+    def save(self, file_path: str):
+        terms = list(self.vectorizer.idf)
+        np.savez(
+            file_path,
+            format_version=np.array(FORMAT_VERSION),
+            classes=np.array(["/".join(path) for path in self.classes]),
+            weights=self.weights,
+            bias=self.bias,
+            centroids=self.centroids,
+            idf_terms=np.array(terms),
+            idf_values=np.array([self.vectorizer.idf[term] for term in terms], dtype=np.float64),
+            default_idf=np.array(self.vectorizer.default_idf),
+        )
+
+    @classmethod
+    def load(cls, file_path: str) -> "LocalClassifier":
+        with np.load(file_path) as data:
+            if int(data["format_version"]) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported local classifier format in {file_path}: {int(data['format_version'])}")
+            weights = data["weights"]
+            vectorizer = HashedTfidfVectorizer(weights.shape[0])
+            vectorizer.idf = dict(zip(data["idf_terms"].tolist(), data["idf_values"].tolist()))
+            vectorizer.default_idf = float(data["default_idf"])
+            classes = [tuple(label.split("/")) for label in data["classes"].tolist()]
+            return cls(vectorizer, classes, weights, data["bias"], data["centroids"])
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class LocalWarmStart:
+    """
+    Starting path for query_classifier's descent, from the local classifier.
+
+    The deepest level on which the classifier is sure (see predict_prefix) is
+    used as a warm start, like the semantic cache's; the model still makes
+    every remaining decision down to the leaf, so a session is never
+    finalized on a local prediction. The classifier's label paths are snapped
+    to the department tree (with name_resolver, level by level); a prefix
+    that is not in the current tree is never returned, nor one for a query
+    whose centroid similarity is below `min_similarity`.
+
+    Example:
+        path = local_warm_start.warm_start(query)  # [] when the classifier is unsure
+    """
+    def __init__(self, classifier: LocalClassifier, registry, resolver, threshold: float = 0.97,
+                 min_similarity: float = 0.1):
+        self.classifier = classifier
+        self.registry = registry
+        self.resolver = resolver
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.hits = 0
+        self.misses = 0
+        self.levels = 0
+
+    def _snap(self, path: Sequence[str]) -> Optional[List[str]]:
+        snapped = []
+        for name in path:
+            resolved, _ = self.resolver.resolve(name, self.registry.children(snapped))
+            if resolved is None:
+                return None
+            snapped.append(resolved)
+        return snapped
+
+    def warm_start(self, query: str) -> List[str]:
+        prefix, probability, similarity = self.classifier.predict_prefix(query, self.threshold)
+        tree_path = self._snap(prefix) if prefix and similarity >= self.min_similarity else None
+        if not tree_path or self.registry.is_leaf(tree_path):
+            self.misses += 1
+            return []
+        self.hits += 1
+        self.levels += len(tree_path)
+        logger.info(f"Local classifier warm start at level {len(tree_path)}: {tree_path[-1]} "
+                    f"(p={probability:.2f}, similarity={similarity:.2f})")
+        return tree_path
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coverage": self.hits / total if total else 0.0,
+            "levels_per_hit": self.levels / self.hits if self.hits else 0.0,
+            "threshold": self.threshold,
+        }
@@ -1,50 +1,69 @@
 import vertexai
 import vertexai.generative_models
-import json
+import threading
+from typing import Dict, Optional, Tuple
 
-class Gemini_Model_VertexAI_With_History():
+SAFETY_SETTINGS = {
+    vertexai.generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
+    vertexai.generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
+    vertexai.generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
+    vertexai.generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
+}
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def init_vertexai(**kwargs):
+    """Initializes the Vertex AI SDK once per process; later calls are no-ops."""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            vertexai.init(**kwargs)
+            _initialized = True
+
+
+class ModelPool:
     """
-    This is done using chat sessions (gemini multiturn)
-    Example chat history
+    Process-wide pool of GenerativeModel objects keyed by model name plus config.
+
+    A GenerativeModel holds no conversation state, so one instance per
+    (model_name, system_instruction, safety settings) is shared by every
+    request in the worker. Per-call history goes into a ChatSession, which is
+    a plain wrapper around the model and the history list.
 
-    gemini_history = [
-        {role: "user", parts: "What is the capital of France?"},
-        {role: "model", parts: "The capital of France is Paris."},
+    Example:
+        model = model_pool.get("gemini-2.0-flash-001")
     """
-    def __init__(self,model_name="gemini-1.5-pro",chat_history=[]):
-        vertexai.init()
-        self.model = vertexai.generative_models.GenerativeModel(
-            model_name=model_name,
-            safety_settings={
-                vertexai.generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-                vertexai.generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-                vertexai.generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-                vertexai.generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-            },
-        )
-        self.current_chat_session = vertexai.generative_models.ChatSession(model=self.model,history=chat_history)
-        
-    def generate(self,prompt: str):
-        generation_config={
-            "temperature": 0.5,
-            "response_mime_type": "application/json",
-        }
-
-        response=self.current_chat_session.send_message(
-            [prompt],
-            generation_config=generation_config
-        )
-
-        response = json.loads(response.candidates[0].content.parts[0].text)
-        return response
-
-
-g1f = vertexai.generative_models.GenerativeModel(
-    model_name="gemini-2.0-flash-001",
-    safety_settings={
-        vertexai.generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-        vertexai.generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-        vertexai.generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-        vertexai.generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: vertexai.generative_models.HarmBlockThreshold.BLOCK_NONE,
-    },
-)
\ No newline at end of file
+    def __init__(self):
+        self._models: Dict[Tuple, vertexai.generative_models.GenerativeModel] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_name: str, system_instruction: Optional[str] = None, safety_settings: Optional[dict] = None) -> Tuple:
+        settings = SAFETY_SETTINGS if safety_settings is None else safety_settings
+        return (model_name, system_instruction, tuple(sorted((int(k), int(v)) for k, v in settings.items())))
+
+    def get(self, model_name: str, system_instruction: Optional[str] = None, safety_settings: Optional[dict] = None) -> vertexai.generative_models.GenerativeModel:
+        key = self.key(model_name, system_instruction, safety_settings)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    init_vertexai()
+                    model = vertexai.generative_models.GenerativeModel(
+                        model_name=model_name,
+                        system_instruction=system_instruction,
+                        safety_settings=SAFETY_SETTINGS if safety_settings is None else safety_settings,
+                    )
+                    self._models[key] = model
+        return model
+
+    def __len__(self):
+        return len(self._models)
+
+
+model_pool = ModelPool()
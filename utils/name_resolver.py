@@ -0,0 +1,193 @@
+import re
+import logging
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXACT = "exact"
+NORMALIZED = "normalized"
+EDIT_DISTANCE = "edit_distance"
+TOKEN_OVERLAP = "token_overlap"
+REJECTED = "rejected"
+
+
+def normalize_name(name: str) -> str:
+    """Upper case, ASCII-folded, with every run of punctuation / whitespace collapsed to one space."""
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.findall(r"[A-Z0-9]+", name.upper()))
+
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance between a and b, or limit + 1 as soon as it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # A near miss shares most of both ends; only the differing middle needs the table
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for j in range(1, len(b) + 1):
+        current = [j] + [0] * len(a)
+        row_min = j
+        # Only cells within limit of the diagonal can stay under the limit
+        low, high = max(1, j - limit), min(len(a), j + limit)
+        if low > 1:
+            current[low - 1] = limit + 1
+        for i in range(low, high + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[i] = min(previous[i] + 1, current[i - 1] + 1, previous[i - 1] + cost)
+            row_min = min(row_min, current[i])
+        if high < len(a):
+            current[high + 1:] = [limit + 1] * (len(a) - high)
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return min(previous[len(a)], limit + 1)
+
+
+class _SiblingIndex:
+    """Normalized keys and token sets for one set of sibling names."""
+    __slots__ = ("names", "exact", "normalized", "tokens", "resolved")
+
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        self.exact = set(self.names)
+        self.normalized: Dict[str, Optional[str]] = {}
+        for name in self.names:
+            key = normalize_name(name)
+            # Two siblings that only differ in punctuation are ambiguous; never snap to either
+            self.normalized[key] = name if key not in self.normalized else None
+        self.tokens = [(name, set(normalize_name(name).split())) for name in self.names]
+        # The model tends to repeat the same near miss; remember the outcome
+        self.resolved: Dict[str, Tuple[Optional[str], str]] = {}
+
+
+class NameResolver:
+    """
+    Snaps a department name returned by the LLM to the exact sibling name in the tree.
+
+    The model sometimes answers with a name that is not byte-identical to the
+    tree: different case or punctuation, a collapsed double space ("GOOD SEEDS
+    TO THE  STATE"), or a corrected typo ("FINANCIALL"). Appending that to the
+    path would leave the session on a path with no children. resolve() tries,
+    in order, an exact match, a match on normalized keys, a bounded edit
+    distance and a token overlap. The last two only accept a single clear
+    winner. Anything else is rejected.
+
+    The index for each set of siblings is built on first use and kept in an LRU,
+    together with the outcome for every near miss already seen, so resolving a
+    name usually costs a few dict lookups (tens of microseconds for a new fuzzy
+    match). Every outcome is counted in counts; snapped names are logged.
+
+    Example:
+        name, quality = name_resolver.resolve("Financial Assistance", siblings)
+    """
+    def __init__(self, max_distance_ratio: float = 0.1, max_distance: int = 4, min_token_overlap: float = 0.8, cache_size: int = 4096, log_every: int = 100):
+        self.max_distance_ratio = max_distance_ratio
+        self.max_distance = max_distance
+        self.min_token_overlap = min_token_overlap
+        self.cache_size = cache_size
+        self.log_every = log_every
+        self.counts = Counter()
+        self._indexes: "OrderedDict[Tuple[str, ...], _SiblingIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, siblings: Sequence[str]) -> _SiblingIndex:
+        key = tuple(siblings)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = _SiblingIndex(key)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.cache_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def resolve(self, candidate: Optional[str], siblings: Sequence[str]) -> Tuple[Optional[str], str]:
+        """
+        Resolves candidate against siblings.
+
+        Args:
+            candidate: The department name as returned by the LLM
+            siblings: The exact names of the children at the current level
+
+        Returns:
+            (name, quality): the exact sibling name, or None if rejected, and one of
+            exact / normalized / edit_distance / token_overlap / rejected
+        """
+        name, quality = self._resolve(candidate, siblings)
+        self.counts[quality] += 1
+        if quality not in (EXACT, REJECTED):
+            logger.info(f"Snapped department name {candidate!r} to {name!r} ({quality})")
+        elif quality == REJECTED:
+            logger.warning(f"Could not resolve department name {candidate!r} against {len(siblings)} options")
+        if sum(self.counts.values()) % self.log_every == 0:
+            logger.info(f"Department name resolution: {self.stats()}")
+        return name, quality
+
+    def _resolve(self, candidate: Optional[str], siblings: Sequence[str]) -> Tuple[Optional[str], str]:
+        if not candidate or not siblings:
+            return None, REJECTED
+        index = self._index(siblings)
+        if candidate in index.exact:
+            return candidate, EXACT
+        result = index.resolved.get(candidate)
+        if result is None:
+            result = self._match(candidate, index)
+            if len(index.resolved) < 256:
+                index.resolved[candidate] = result
+        return result
+
+    def _match(self, candidate: str, index: _SiblingIndex) -> Tuple[Optional[str], str]:
+        key = normalize_name(candidate)
+        if not key:
+            return None, REJECTED
+        name = index.normalized.get(key)
+        if name is not None:
+            return name, NORMALIZED
+        if key in index.normalized:
+            return None, REJECTED
+
+        limit = min(self.max_distance, max(1, int(len(key) * self.max_distance_ratio)))
+        best, best_distance, tied = None, limit + 1, False
+        for sibling_key, sibling in index.normalized.items():
+            if sibling is None:
+                continue
+            distance = bounded_edit_distance(key, sibling_key, min(limit, best_distance))
+            if distance < best_distance:
+                best, best_distance, tied = sibling, distance, False
+            elif distance == best_distance and distance <= limit:
+                tied = True
+        if best is not None and not tied:
+            return best, EDIT_DISTANCE
+
+        tokens = set(key.split())
+        scored = []
+        for sibling, sibling_tokens in index.tokens:
+            union = tokens | sibling_tokens
+            scored.append((len(tokens & sibling_tokens) / len(union) if union else 0.0, sibling))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        if scored and scored[0][0] >= self.min_token_overlap and (len(scored) == 1 or scored[1][0] < scored[0][0]):
+            return scored[0][1], TOKEN_OVERLAP
+        return None, REJECTED
+
+    def stats(self) -> Dict[str, int]:
+        """Counts per match quality; snapped is every accepted non-exact match."""
+        counts = dict(self.counts)
+        counts["snapped"] = sum(self.counts[quality] for quality in (NORMALIZED, EDIT_DISTANCE, TOKEN_OVERLAP))
+        return counts
+
+
+name_resolver = NameResolver()
@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.flat_classifier import path_text
+from utils.semantic_cache import HashedTfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Offered next to the top-k children when a level is pruned; picking it sends the rest to the model
+OTHER_OPTION = "OTHER (none of the departments above)"
+
+
+def tree_nodes(registry) -> Tuple[List[str], List[int]]:
+    """(names, depths) of every node in the registry in depth-first order; depth 1 is a root department."""
+    names, depths = [], []
+    stack = [(name, (name,)) for name in reversed(registry.root_departments())]
+    while stack:
+        name, path = stack.pop()
+        names.append(name)
+        depths.append(len(path))
+        stack.extend((child, path + (child,)) for child in reversed(registry.children(list(path))))
+    return names, depths
+
+
+def nodes_digest(names: Sequence[str], depths: Sequence[int]) -> str:
+    return hashlib.sha1(json.dumps([list(names), list(depths)]).encode("utf-8")).hexdigest()[:16]
+
+
+class NodeIndex:
+    """
+    One hashed TF-IDF row per department node, for ranking the children of a level.
+
+    Rows are in depth-first order, so the subtree of any node is a contiguous
+    block of rows. A child is scored by the best match anywhere in its
+    subtree (a query naming a leaf ranks the leaf's ancestors too): one
+    matrix-vector product over the parent's block and one
+    np.maximum.reduceat over the children's sub-blocks.
+
+    The index is built offline (python -m utils.node_index) and loaded as
+    plain arrays; digest identifies the tree it was built from.
+
+    Example:
+        index = NodeIndex.build(registry)
+        index.rank("PM Kisan installment not received", ["AGRICULTURE DEPARTMENT"])  # [(child, score), ...]
+    """
+    def __init__(self, names: Sequence[str], depths: Sequence[int], vectorizer: HashedTfidfVectorizer, matrix: np.ndarray):
+        self.names = list(names)
+        self.depths = np.asarray(depths, dtype=np.int32)
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.digest = nodes_digest(self.names, self.depths.tolist())
+        # ends[row]: one past the last row of the node's subtree
+        self.ends = np.empty(len(self.names), dtype=np.int64)
+        open_rows: List[int] = []
+        for row, depth in enumerate(self.depths.tolist()):
+            while open_rows and self.depths[open_rows[-1]] >= depth:
+                self.ends[open_rows.pop()] = row
+            open_rows.append(row)
+        for row in open_rows:
+            self.ends[row] = len(self.names)
+        self._rows = {}
+        path: List[str] = []
+        for row, (name, depth) in enumerate(zip(self.names, self.depths.tolist())):
+            del path[depth - 1:]
+            path.append(name)
+            self._rows[tuple(path)] = row
+
+    @classmethod
+    def build(cls, registry, dimensions: int = 2048) -> "NodeIndex":
+        names, depths = tree_nodes(registry)
+        texts, path = [], []
+        for name, depth in zip(names, depths):
+            del path[depth - 1:]
+            path.append(name)
+            texts.append(path_text(path))
+        vectorizer = HashedTfidfVectorizer(dimensions).fit(texts)
+        matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            matrix[row] = vectorizer.transform(text)
+        return cls(names, depths, vectorizer, matrix)
+
+    def rank(self, query: str, dept_path: Sequence[str]) -> List[Tuple[str, float]]:
+        """(child, score) for every child of dept_path, best first; [] if dept_path is not indexed."""
+        if dept_path:
+            row = self._rows.get(tuple(dept_path))
+            if row is None:
+                return []
+            start, end = row + 1, int(self.ends[row])
+        else:
+            start, end = 0, len(self.names)
+        if start == end:
+            return []
+        children = np.flatnonzero(self.depths[start:end] == len(dept_path) + 1)
+        scores = np.maximum.reduceat(self.matrix[start:end] @ self.vectorizer.transform(query), children)
+        order = np.argsort(-scores, kind="stable")
+        return [(self.names[start + children[i]], float(scores[i])) for i in order]
+
+    def save(self, file_path: str):
+        """Writes the index to a temp file and renames it into place."""
+        terms = list(self.vectorizer.idf)
+        temp_path = f"{file_path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temp_path,
+            format_version=np.array(FORMAT_VERSION),
+            names=np.array(self.names),
+            depths=self.depths,
+            matrix=self.matrix,
+            idf_terms=np.array(terms),
+            idf_values=np.array([self.vectorizer.idf[term] for term in terms], dtype=np.float64),
+            default_idf=np.array(self.vectorizer.default_idf),
+        )
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> "NodeIndex":
+        with np.load(file_path) as data:
+            if int(data["format_version"]) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported node index format in {file_path}: {int(data['format_version'])}")
+            matrix = data["matrix"]
+            vectorizer = HashedTfidfVectorizer(matrix.shape[1])
+            vectorizer.idf = dict(zip(data["idf_terms"].tolist(), data["idf_values"].tolist()))
+            vectorizer.default_idf = float(data["default_idf"])
+            return cls(data["names"].tolist(), data["depths"], vectorizer, matrix)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class CandidatePruner:
+    """
+    Top-k children per level for the per-level classifier prompt.
+
+    A level whose children outnumber k + 1 is cut to the k best ranked by the
+    NodeIndex, and OTHER_OPTION is offered next to them. When the model picks
+    it, the level is asked again with the remaining children. top_k holds k
+    per level (top_k[len(dept_path)], the last entry for deeper levels);
+    0 leaves that level whole, as does a query that scores below min_score
+    against every child.
+
+    The index is loaded from index_path when that file was built from the
+    current tree, and built in-process otherwise (a few hundred ms for a
+    thousand nodes); it is checked again when the tree version changes.
+
+    Example:
+        shown, rest = candidate_pruner.prune(query, dept_path, children)
+        options = shown + [OTHER_OPTION] if rest else shown
+    """
+    def __init__(self, registry, top_k: Sequence[int] = (), min_score: float = 0.05, index_path: Optional[str] = None):
+        self.registry = registry
+        self.top_k = list(top_k)
+        self.min_score = min_score
+        self.index_path = index_path
+        self.levels = 0
+        self.pruned = 0
+        self.other_chosen = 0
+        self.options_total = 0
+        self.options_shown = 0
+        self._index: Optional[NodeIndex] = None
+        self._tree_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def k_for(self, depth: int) -> int:
+        if not self.top_k:
+            return 0
+        return self.top_k[min(depth, len(self.top_k) - 1)]
+
+    def index(self) -> NodeIndex:
+        tree_version = self.registry.version
+        if self._index is None or tree_version != self._tree_version:
+            with self._lock:
+                if self._index is None or tree_version != self._tree_version:
+                    self._index = self._load_or_build()
+                    self._tree_version = tree_version
+        return self._index
+
+    def _load_or_build(self) -> NodeIndex:
+        if self.index_path and os.path.exists(self.index_path):
+            index = NodeIndex.load(self.index_path)
+            if index.digest == nodes_digest(*tree_nodes(self.registry)):
+                logger.info(f"Loaded node index of {len(index)} departments from {self.index_path}")
+                return index
+            logger.warning(f"Node index {self.index_path} was built from another department tree; rebuilding it in memory")
+        index = NodeIndex.build(self.registry)
+        logger.info(f"Built node index of {len(index)} departments")
+        return index
+
+    def prune(self, query: str, dept_path: Sequence[str], children: Sequence[str]) -> Tuple[List[str], List[str]]:
+        """(shown, rest): the children to offer, best first when pruned, and the ones left out ([] if none)."""
+        k = self.k_for(len(dept_path))
+        if k <= 0 or len(children) <= k + 1:
+            return list(children), []
+        self.levels += 1
+        self.options_total += len(children)
+        ranked = self.index().rank(query, dept_path)
+        if not ranked or ranked[0][1] < self.min_score:
+            self.options_shown += len(children)
+            return list(children), []
+        wanted = set(children)
+        shown = [child for child, _ in ranked if child in wanted][:k]
+        # Children the index does not know are never hidden
+        indexed = {child for child, _ in ranked}
+        shown += [child for child in children if child not in indexed]
+        rest = [child for child in children if child not in shown]
+        self.pruned += 1
+        self.options_shown += len(shown) + 1
+        return shown, rest
+
+    def record_other(self):
+        """Counts a pruned level where the model picked OTHER_OPTION."""
+        self.other_chosen += 1
+
+    def stats(self) -> dict:
+        return {
+            "top_k": self.top_k,
+            "levels": self.levels,
+            "pruned": self.pruned,
+            "other_chosen": self.other_chosen,
+            "other_rate": self.other_chosen / self.pruned if self.pruned else 0.0,
+            "options_per_level": self.options_total / self.levels if self.levels else 0.0,
+            "options_shown_per_level": self.options_shown / self.levels if self.levels else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    # python -m utils.node_index data/node_index.npz utils data
+    if len(sys.argv) < 2:
+        print("Usage: python -m utils.node_index <index.npz> [<tree directory> ...]")
+        sys.exit(1)
+    from utils.department_tree import TreeRegistry
+    node_index = NodeIndex.build(TreeRegistry(sys.argv[2:] or ["utils", "data"]))
+    node_index.save(sys.argv[1])
+    print(f"{len(node_index)} departments -> {sys.argv[1]} ({os.path.getsize(sys.argv[1])} bytes)")
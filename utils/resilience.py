@@ -0,0 +1,296 @@
+import os
+import time
+import math
+import random
+import struct
+import asyncio
+import logging
+import weakref
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows: the bucket is shared by the threads of one process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: quota (429) and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class ModelUnavailableError(Exception):
+    """
+    The model API is overloaded or failing; the caller should come back after retry_after seconds.
+
+    The API turns this into a 503 with a Retry-After header.
+    """
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Quota errors, transient 5xx errors, timeouts and dropped connections."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    # google.api_core exceptions carry the HTTP status in .code, OpenAI's in .status_code
+    for attribute in ("code", "status_code"):
+        status = getattr(exc, attribute, None)
+        if isinstance(status, int) and status in RETRYABLE_STATUS:
+            return True
+    return False
+
+
+class ConcurrencyLimit:
+    """
+    Caps the number of LLM calls a worker has in flight at once.
+
+    Used as "async with llm_concurrency:" around every awaited model call.
+    Calls over the limit wait for a slot instead of piling up requests on the
+    API. The semaphore is created per event loop, so the limit also works
+    when scripts and tests call asyncio.run() more than once.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores.setdefault(loop, asyncio.Semaphore(self.limit))
+        return semaphore
+
+    async def __aenter__(self):
+        await self._semaphore().acquire()
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._semaphore().release()
+        return False
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter, shared by every worker process on the host.
+
+    The bucket state (tokens, timestamp) lives in `path`, read and written
+    under an exclusive flock, so all the uvicorn workers draw from one quota.
+    Without a path the bucket is per process. A caller that finds the bucket
+    empty sleeps until the next token is due and tries again.
+    """
+    _STATE = struct.Struct("dd")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, path: Optional[str] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.path = path
+        self.waited = 0.0
+        self._fd: Optional[int] = None
+        self._tokens = self.capacity
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def _file(self) -> int:
+        if self._fd is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    def _refill_and_take(self, tokens: float, stamp: float, now: float):
+        tokens = min(self.capacity, tokens + (now - stamp) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def try_acquire(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is due."""
+        with self._lock:
+            now = time.time()
+            if self.path is None:
+                self._tokens, wait = self._refill_and_take(self._tokens, self._stamp, now)
+                self._stamp = now
+                return wait
+            fd = self._file()
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                state = os.pread(fd, self._STATE.size, 0)
+                tokens, stamp = self._STATE.unpack(state) if len(state) == self._STATE.size else (self.capacity, now)
+                tokens, wait = self._refill_and_take(tokens, min(stamp, now), now)
+                os.pwrite(fd, self._STATE.pack(tokens, now), 0)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            return wait
+
+    async def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            self.waited += wait
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Fails fast once the model API keeps failing.
+
+    After failure_threshold consecutive retryable failures the breaker opens
+    and calls are refused with ModelUnavailableError for reset_timeout
+    seconds. Then calls go through again (half-open); one success closes the
+    breaker, one more failure opens it for another reset_timeout.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets calls through; 0 when it does now."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        retry_after = self.retry_after()
+        if retry_after > 0:
+            self.rejected += 1
+            raise ModelUnavailableError("Model API circuit breaker is open", retry_after)
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Model API circuit breaker closed")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.retry_after() == 0:
+                logger.warning(f"Model API circuit breaker open for {self.reset_timeout:g}s after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+class Resilience:
+    """
+    Rate limit, retry and circuit breaker around one model call.
+
+    Each attempt first checks the breaker, then takes a token from the
+    bucket (if any). Retryable errors (is_retryable) are retried up to
+    max_retries times with full-jitter exponential backoff: a random delay
+    between 0 and min(max_delay, base_delay * 2**attempt). When the retries
+    run out or the breaker is open, ModelUnavailableError is raised with the
+    time to wait. Other errors are raised as they are.
+
+    Example:
+        async def send():
+            async with llm_concurrency:
+                return await chat_session.send_message_async([prompt])
+        response = await llm_resilience.call(send)
+    """
+    def __init__(self, bucket: Optional[TokenBucket] = None, breaker: Optional[CircuitBreaker] = None,
+                 max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.bucket = bucket
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _failed(self, exc: Exception, attempt: int) -> float:
+        """Records a retryable failure; returns the delay before the next attempt, or raises."""
+        self.breaker.record_failure()
+        delay = self.backoff(attempt)
+        if attempt >= self.max_retries:
+            self.failures += 1
+            retry_after = max(self.breaker.retry_after(), delay, 1.0)
+            raise ModelUnavailableError(f"Model API unavailable after {attempt + 1} attempts: {exc}", retry_after) from exc
+        self.retries += 1
+        logger.info(f"Retrying model call in {delay:.2f}s after: {exc}")
+        return delay
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        self.calls += 1
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as exc:
+                if not is_retryable(exc):
+                    raise
+                await asyncio.sleep(self._failed(exc, attempt))
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    def call_sync(self, func: Callable[..., T], *args, **kwargs) -> T:
+        self.calls += 1
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            if self.bucket is not None:
+                self.bucket.acquire_sync()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                if not is_retryable(exc):
+                    raise
+                time.sleep(self._failed(exc, attempt))
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "breaker_open": self.breaker.retry_after() > 0,
+            "breaker_rejected": self.breaker.rejected,
+            "rate_limit_wait": self.bucket.waited if self.bucket is not None else 0.0,
+        }
+
+
+def retry_after_header(exc: ModelUnavailableError) -> str:
+    """Retry-After value in whole seconds, at least 1."""
+    return str(max(1, math.ceil(exc.retry_after)))
+
+
+# The limit is set from LLM_MAX_CONCURRENCY in chat_utils, before the first call
+llm_concurrency = ConcurrencyLimit(32)
+
+# Rate limit, retries and circuit breaker for every Vertex call; configured from the LLM_* settings in chat_utils
+llm_resilience = Resilience()
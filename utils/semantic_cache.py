@@ -0,0 +1,286 @@
+import re
+import csv
+import math
+import zlib
+import logging
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "been", "but", "by", "for", "from", "has", "have", "i", "in",
+    "is", "it", "its", "me", "my", "of", "on", "or", "our", "please", "sir", "so", "that", "the", "this", "to",
+    "was", "we", "were", "which", "with", "you", "your", "madam", "subject", "kindly", "request", "requesting",
+}
+
+IDENTIFIER_PATTERNS = [
+    # Relations and labelled personal fields: "S/o Amarappa", "NAME: KARIYAMMA,". The
+    # lookahead and lookbehind below only save time: fewer start positions are tried
+    re.compile(r"\b[SDWC]\s*/\s*[Oo]\.?\s+(?:[A-Z][\w.]*\s*){1,3}"),
+    re.compile(r"\b(?=[nNdDaAfFmMpP])(?:name|dob|adhaar|aadhaar|aadhar|fid|mobile|phone|account)\s*(?:no\.?|number)?\s*[:\-]\s*[^,.;\n]*", re.I),
+    # Any token with a digit in it: Aadhaar / phone / account / survey numbers, FIDs, dates
+    re.compile(r"(?<![\w/*.\-])[\w/*.\-]*\d[\w/*.\-]*"),
+]
+
+
+def strip_identifiers(text: str) -> str:
+    """Removes beneficiary IDs, numbers, dates and labelled names so only the complaint is left."""
+    for pattern in IDENTIFIER_PATTERNS:
+        text = pattern.sub(" ", text)
+    return text
+
+
+def tokenize(text: str) -> List[str]:
+    text = strip_identifiers(text).lower().replace("n't", " not")
+    words = [word for word in re.findall(r"[a-z]+", text) if len(word) > 1 and word not in STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _hash(term: str) -> int:
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(term.encode("utf-8"))
+
+
+class HashedTfidfVectorizer:
+    """
+    Feature-hashed TF-IDF over word unigrams and bigrams, L2-normalized.
+
+    Terms are hashed straight into `dimensions` signed buckets, so there is no
+    vocabulary to store and a vector costs one pass over the text. IDF weights
+    come from fit() on a corpus of grievances; terms never seen there (mostly
+    names and places) get the median weight, not the maximum, so they don't
+    dominate the similarity.
+    """
+    def __init__(self, dimensions: int = 128):
+        self.dimensions = dimensions
+        self.idf: Dict[str, float] = {}
+        self.default_idf = 1.0
+
+    @classmethod
+    def from_csv(cls, csv_path: str, column: str = "translated_grievance", dimensions: int = 128) -> "HashedTfidfVectorizer":
+        """Vectorizer with IDF weights fitted on one column of a CSV (e.g. data/PM_Kisan/train.csv)."""
+        with open(csv_path, "r", newline="") as file:
+            return cls(dimensions).fit(row.get(column) or "" for row in csv.DictReader(file))
+
+    def fit(self, documents: Iterable[str]) -> "HashedTfidfVectorizer":
+        document_frequency = Counter()
+        count = 0
+        for document in documents:
+            document_frequency.update(set(tokenize(document)))
+            count += 1
+        self.idf = {term: math.log((count + 1) / (frequency + 1)) + 1 for term, frequency in document_frequency.items()}
+        if self.idf:
+            self.default_idf = float(np.median(list(self.idf.values())))
+        return self
+
+    def transform(self, text: str) -> np.ndarray:
+        indices = []
+        weights = []
+        idf, default_idf, dimensions = self.idf, self.default_idf, self.dimensions
+        for term, frequency in Counter(tokenize(text)).items():
+            hashed = _hash(term)
+            indices.append(hashed % dimensions)
+            weight = idf.get(term, default_idf)
+            if frequency > 1:
+                weight *= 1 + math.log(frequency)
+            weights.append(weight if hashed & 0x80000000 else -weight)
+        if not indices:
+            return np.zeros(dimensions, dtype=np.float32)
+        vector = np.bincount(indices, weights=weights, minlength=dimensions).astype(np.float32)
+        norm = math.sqrt(float(vector @ vector))
+        return vector / norm if norm > 0 else vector
+
+
+class SemanticMatch:
+    __slots__ = ("path", "similarity", "neighbours")
+
+    def __init__(self, path: List[str], similarity: float, neighbours: List[Tuple[List[str], float]]):
+        self.path = path
+        self.similarity = similarity
+        self.neighbours = neighbours
+
+    def __repr__(self):
+        return f"SemanticMatch(path={self.path!r}, similarity={self.similarity:.3f})"
+
+
+class SemanticCache:
+    """
+    Near-duplicate lookup from grievance text to the department path it was resolved to.
+
+    Farmers file the same PM-KISAN complaint with different beneficiary IDs,
+    survey numbers and names, so exact-match caching misses most repeats.
+    Queries are stripped of identifiers and turned into hashed TF-IDF vectors,
+    which are rows of one float32 NumPy matrix (a ring buffer of max_entries
+    rows; the oldest entry is overwritten). Cosine similarity is a dot product.
+
+    To stay under a millisecond at 100k entries, only candidate rows are
+    scored. Each of hash_tables tables buckets the rows by the signs of
+    hash_bits random projections (locality-sensitive hashing). A lookup takes
+    the query's bucket in every table, plus the buckets one sign away on the
+    `probes` projections closest to zero (the signs a near duplicate is most
+    likely to have the other way). Narrow buckets and few probes keep the
+    candidates to a few hundred rows; tests/bench_semantic_cache.py measures
+    the latency and recall of these defaults. A miss just means the normal
+    classification runs. Buckets are append-only arrays of row numbers. An
+    overwritten row stays in its old buckets (where it is scored as whatever
+    now occupies the row) until the tables are rebuilt.
+
+    Example:
+        semantic_cache.add(first_query, final_path)
+        match = semantic_cache.lookup(query)  # None below min_similarity
+    """
+    def __init__(self, vectorizer: Optional[HashedTfidfVectorizer] = None, max_entries: int = 100000,
+                 hash_tables: int = 16, hash_bits: int = 16, probes: int = 2, min_similarity: float = 0.75,
+                 duplicate_similarity: float = 0.98, seed: int = 7):
+        self.vectorizer = vectorizer or HashedTfidfVectorizer()
+        self.max_entries = max_entries
+        self.hash_tables = hash_tables
+        self.hash_bits = hash_bits
+        self.probes = min(probes, hash_bits)
+        self.min_similarity = min_similarity
+        self.duplicate_similarity = duplicate_similarity
+        self.hits = 0
+        self.misses = 0
+        dimensions = self.vectorizer.dimensions
+        self._planes = np.random.default_rng(seed).standard_normal((hash_tables * hash_bits, dimensions)).astype(np.float32)
+        self._bit_values = 1 << np.arange(hash_bits)
+        self._matrix = np.zeros((min(1024, max_entries), dimensions), dtype=np.float32)
+        self._row_keys = np.zeros((len(self._matrix), hash_tables), dtype=np.int64)
+        self._paths: List[Optional[List[str]]] = []
+        self._tables: List[Dict[int, array]] = [{} for _ in range(hash_tables)]
+        self._postings = 0
+        self._next_row = 0
+        self._tree_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _projections(self, vector: np.ndarray) -> np.ndarray:
+        return (self._planes @ vector).reshape(self.hash_tables, self.hash_bits)
+
+    def _bucket_keys(self, projections: np.ndarray) -> List[int]:
+        return ((projections > 0) @ self._bit_values).tolist()
+
+    def _search(self, vector: np.ndarray, projections: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        flips = self._bit_values[np.argsort(np.abs(projections), axis=1)[:, :self.probes]].tolist()
+        postings = array("q")
+        for table, key, table_flips in zip(self._tables, self._bucket_keys(projections), flips):
+            for flip in [0] + table_flips:
+                bucket = table.get(key ^ flip)
+                if bucket:
+                    postings.extend(bucket)
+        if not postings:
+            return []
+        rows = np.unique(np.frombuffer(postings, dtype=np.int64))
+        scores = self._matrix[rows] @ vector
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def check_tree_version(self, tree_version: str):
+        """Forgets every path when the department tree has changed."""
+        if tree_version != self._tree_version:
+            with self._lock:
+                if self._tree_version is not None and len(self):
+                    logger.info(f"Department tree changed; clearing {len(self)} semantic cache entries")
+                    self._tables = [{} for _ in range(self.hash_tables)]
+                    self._paths = []
+                    self._postings = 0
+                    self._next_row = 0
+                self._tree_version = tree_version
+
+    def _grow(self):
+        size = min(2 * len(self._matrix), self.max_entries)
+        for name in ("_matrix", "_row_keys"):
+            old = getattr(self, name)
+            new = np.zeros((size,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _rebuild_tables(self):
+        # Drops the postings of overwritten rows
+        count = len(self._paths)
+        self._tables = []
+        for table in range(self.hash_tables):
+            keys = self._row_keys[:count, table]
+            order = np.argsort(keys, kind="stable")
+            starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+            ends = np.append(starts[1:], count)
+            rows = order.tolist()
+            self._tables.append({
+                key: array("q", rows[start:end])
+                for key, start, end in zip(keys[order[starts]].tolist(), starts.tolist(), ends.tolist())
+            })
+        self._postings = count * self.hash_tables
+
+    def add(self, query: str, path: Sequence[str]) -> bool:
+        """Remembers the resolved path for a grievance; returns False for a duplicate."""
+        vector = self.vectorizer.transform(query)
+        if not vector.any():
+            return False
+        projections = self._projections(vector)
+        keys = self._bucket_keys(projections)
+        with self._lock:
+            nearest = self._search(vector, projections, 1)
+            if nearest and nearest[0][1] >= self.duplicate_similarity and self._paths[nearest[0][0]] == list(path):
+                return False
+            row = self._next_row % self.max_entries
+            self._next_row += 1
+            if row >= len(self._matrix):
+                self._grow()
+            self._matrix[row] = vector
+            self._row_keys[row] = keys
+            if row == len(self._paths):
+                self._paths.append(list(path))
+            else:
+                self._paths[row] = list(path)
+            for table, key in zip(self._tables, keys):
+                bucket = table.get(key)
+                if bucket is None:
+                    bucket = table[key] = array("q")
+                bucket.append(row)
+            self._postings += self.hash_tables
+            if self._postings > 2 * self.hash_tables * len(self._paths):
+                self._rebuild_tables()
+        return True
+
+    def lookup(self, query: str, k: int = 5) -> Optional[SemanticMatch]:
+        """
+        The closest previously resolved grievance, if its similarity is at least min_similarity.
+
+        neighbours holds up to k matches above min_similarity (best first), so
+        the caller can tell a clear answer from a split one.
+        """
+        vector = self.vectorizer.transform(query)
+        neighbours = []
+        if vector.any() and self._paths:
+            neighbours = [
+                (self._paths[row], similarity)
+                for row, similarity in self._search(vector, self._projections(vector), k)
+                if similarity >= self.min_similarity
+            ]
+        if not neighbours:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return SemanticMatch(neighbours[0][0], neighbours[0][1], neighbours)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self._paths)
+
+
+def common_prefix(paths: Sequence[Sequence[str]]) -> List[str]:
+    """Longest department path prefix shared by all paths."""
+    prefix = []
+    for names in zip(*paths):
+        if any(name != names[0] for name in names):
+            break
+        prefix.append(names[0])
+    return prefix
@@ -0,0 +1,193 @@
+import gzip
+import json
+import os
+import sys
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: segment appends are only serialized within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SessionArchive:
+    """
+    Compressed, time-bucketed archive for sessions that are no longer active.
+
+    Archived sessions are appended to one segment file per day of their
+    last_updated timestamp, archive/<YYYY-MM-DD>.jsonl.gz. Each session is its
+    own gzip member, so a segment is still a valid .jsonl.gz for bulk export,
+    while index.db (SQLite) records the segment, byte offset and length of
+    every session so a single session is fetched with one seek and read.
+
+    Example:
+        archive.add([(session_id, session_data)])
+        session_data = archive.get(session_id)
+    """
+    def __init__(self, directory: str = "chat_history/archive"):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.db")
+        self._local = threading.local()
+        self._append_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS archived_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    segment TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    last_updated TEXT NOT NULL DEFAULT '',
+                    archived_at TEXT NOT NULL
+                )
+                """
+            )
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def segment_name(session_data: dict) -> str:
+        last_updated = session_data.get("last_updated") or datetime.now().isoformat()
+        return f"{last_updated[:10]}.jsonl.gz"
+
+    def add(self, sessions: List[Tuple[str, dict]]):
+        """Appends sessions to their segments and indexes them (replacing older copies)."""
+        rows = []
+        archived_at = datetime.now().isoformat()
+        with self._append_lock:
+            for session_id, session_data in sessions:
+                segment = self.segment_name(session_data)
+                member = gzip.compress((json.dumps(session_data) + "\n").encode("utf-8"))
+                offset = self._append(os.path.join(self.directory, segment), member)
+                rows.append((session_id, segment, offset, len(member), session_data.get("last_updated", ""), archived_at))
+
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO archived_sessions VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def _append(self, segment_path: str, member: bytes) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(segment_path, "ab") as file:
+            # Other workers may archive into the same segment
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                file.seek(0, os.SEEK_END)
+                offset = file.tell()
+                file.write(member)
+                file.flush()
+                os.fsync(file.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        return offset
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """Returns an archived session, or None if it was never archived."""
+        if not os.path.exists(self.index_path):
+            return None
+        row = self._connection().execute(
+            "SELECT segment, offset, length FROM archived_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length = row
+        with open(os.path.join(self.directory, segment), "rb") as file:
+            file.seek(offset)
+            member = file.read(length)
+        return json.loads(gzip.decompress(member).decode("utf-8"))
+
+
+def is_archivable(session_data: dict, final_cutoff: datetime, idle_cutoff: datetime) -> bool:
+    """Finalized sessions past the final TTL, or any session past the idle TTL."""
+    last_updated = session_data.get("last_updated") or ""
+    if str(session_data.get("path_final", "False")).lower() == "true":
+        return last_updated < final_cutoff.isoformat()
+    return last_updated < idle_cutoff.isoformat()
+
+
+async def archive_expired_sessions(store, locks, archive: SessionArchive, final_ttl: float, idle_ttl: float) -> int:
+    """
+    Moves expired sessions from the active backend into the archive.
+
+    Candidates are checked without their lock first, so no lock file is
+    created for a session that stays. Each session is then archived under its
+    session lock, so a turn in progress is never archived from under it, and
+    its lock file is removed before the lock is released (a turn waiting on
+    it re-locks the current file; see SessionLockRegistry). Returns the
+    number of sessions archived.
+
+    Args:
+        store: The SessionStore whose backend holds the active sessions
+        locks: The SessionLockRegistry used by chat turns
+        archive: The SessionArchive to move sessions into
+        final_ttl: Seconds after the last update before a finalized session is archived
+        idle_ttl: Seconds after the last update before an unfinished session is archived
+    """
+    now = datetime.now()
+    final_cutoff = now - timedelta(seconds=final_ttl)
+    idle_cutoff = now - timedelta(seconds=idle_ttl)
+    loop = asyncio.get_running_loop()
+
+    backend = store.backend
+    candidates = await loop.run_in_executor(
+        store.executor, backend.list_sessions_older_than, min(final_cutoff, idle_cutoff)
+    )
+
+    archived = 0
+    for session_id in candidates:
+        if store.is_dirty(session_id):
+            continue
+        session_data = await loop.run_in_executor(store.executor, backend.read, session_id)
+        if session_data is None or not is_archivable(session_data, final_cutoff, idle_cutoff):
+            continue
+        async with locks.lock(session_id):
+            if store.is_dirty(session_id):
+                continue
+            session_data = await loop.run_in_executor(store.executor, backend.read, session_id)
+            if session_data is None or not is_archivable(session_data, final_cutoff, idle_cutoff):
+                continue
+            await loop.run_in_executor(store.executor, archive.add, [(session_id, session_data)])
+            await loop.run_in_executor(store.executor, backend.delete, session_id)
+            store.discard(session_id)
+            locks.remove_lock_file(session_id)
+            archived += 1
+
+    if archived:
+        logger.info(f"Archived {archived} expired sessions into {archive.directory}")
+    return archived
+
+
+async def run_session_archiver(store, locks, archive: SessionArchive, final_ttl: float, idle_ttl: float, interval: float):
+    """Background task: archives expired sessions every interval seconds."""
+    while True:
+        try:
+            await archive_expired_sessions(store, locks, archive, final_ttl, idle_ttl)
+        except Exception as e:
+            logger.error(f"Error archiving sessions: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    # python -m utils.session_archive  -- one archiving pass with the configured TTLs
+    from utils.chat_utils import session_store, session_locks, session_archive, SESSION_FINAL_TTL, SESSION_IDLE_TTL
+    logging.basicConfig(level=logging.INFO)
+    count = asyncio.run(archive_expired_sessions(session_store, session_locks, session_archive, SESSION_FINAL_TTL, SESSION_IDLE_TTL))
+    print(f"Archived {count} sessions")
+    sys.exit(0)
@@ -0,0 +1,583 @@
+import json
+import os
+import sys
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def new_session_data(session_id: str) -> dict:
+    """Returns the empty session record written for a new chat session."""
+    return {
+        "session_id": session_id,
+        "history": [],
+        "current_path": [],
+        "path_final": "False",
+        "last_updated": ""
+    }
+
+
+def message_event(role: str, content: str) -> dict:
+    return {"type": "message", "role": role, "content": content, "ts": datetime.now().isoformat()}
+
+
+def path_event(current_path: List[str]) -> dict:
+    return {"type": "path", "current_path": list(current_path), "ts": datetime.now().isoformat()}
+
+
+def final_event(value: str) -> dict:
+    return {"type": "final", "path_final": value, "ts": datetime.now().isoformat()}
+
+
+def atomic_write_text(file_path: str, text: str):
+    """
+    Writes a file via a temp file + rename, so readers (and a crash) only ever
+    see the old or the new contents, never a partial write. The temp file is
+    per process and thread, so concurrent writers never share one.
+    """
+    temp_file_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file_path, "w") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_file_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def file_stamp(file_path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a session file, used to detect writes by other workers."""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def apply_event(session_data: dict, event: dict) -> dict:
+    """
+    Applies one session event to a session record in place.
+
+    Events are what the chat helpers do to a session:
+        message  - a chat message was appended to the history
+        path     - the department path was updated
+        final    - path_final was set
+        snapshot - the whole session state (written by compaction)
+    """
+    event_type = event.get("type")
+    if event_type == "message":
+        session_data["history"].append({"role": event["role"], "content": event["content"]})
+        session_data["last_updated"] = event.get("ts", "")
+    elif event_type == "path":
+        session_data["current_path"] = list(event["current_path"])
+        session_data["last_updated"] = event.get("ts", "")
+    elif event_type == "final":
+        session_data["path_final"] = event["path_final"]
+    elif event_type == "snapshot":
+        for key in ("history", "current_path", "path_final", "last_updated"):
+            if key in event:
+                session_data[key] = event[key]
+    else:
+        logger.warning(f"Skipping unknown session event type: {event_type}")
+    return session_data
+
+
+class FileSessionBackend:
+    """
+    Shared layout of the file based backends: one file per session.
+
+    With sharded=True (the default) session files live under a directory named
+    after the first two characters of the session id,
+    chat_history/<id[:2]>/<session_id><extension>, so no single directory grows
+    with the total number of sessions and a session is still found with one
+    path computation. Files from the old flat layout are read in place and
+    moved into their shard on the next write.
+    """
+    extension = ""
+
+    def __init__(self, directory: str = "chat_history", sharded: bool = True):
+        self.directory = directory
+        self.sharded = sharded
+
+    def session_file_path(self, session_id: str) -> str:
+        if not self.sharded:
+            return self.legacy_file_path(session_id)
+        return os.path.join(self.directory, session_id[:2].lower(), f"{session_id}{self.extension}")
+
+    def legacy_file_path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}{self.extension}")
+
+    def _existing_file_path(self, session_id: str) -> Optional[str]:
+        session_file_path = self.session_file_path(session_id)
+        if os.path.exists(session_file_path):
+            return session_file_path
+        legacy_file_path = self.legacy_file_path(session_id)
+        if self.sharded and os.path.exists(legacy_file_path):
+            return legacy_file_path
+        return None
+
+    def _prepare_write(self, session_id: str) -> str:
+        """Creates the shard directory and moves a flat-layout file into it."""
+        session_file_path = self.session_file_path(session_id)
+        os.makedirs(os.path.dirname(session_file_path), exist_ok=True)
+        legacy_file_path = self.legacy_file_path(session_id)
+        if self.sharded and not os.path.exists(session_file_path) and os.path.exists(legacy_file_path):
+            os.replace(legacy_file_path, session_file_path)
+        return session_file_path
+
+    def stamp(self, session_id: str):
+        session_file_path = self._existing_file_path(session_id)
+        return file_stamp(session_file_path) if session_file_path else None
+
+    def delete(self, session_id: str):
+        session_file_path = self._existing_file_path(session_id)
+        if session_file_path:
+            os.remove(session_file_path)
+
+    def list_sessions_older_than(self, cutoff: datetime) -> List[str]:
+        """Session ids whose file was last modified before cutoff (used by the archiver)."""
+        cutoff_ts = cutoff.timestamp()
+        session_ids = []
+        patterns = [f"*{self.extension}", f"*/*{self.extension}"]
+        for pattern in patterns:
+            for session_file_path in Path(self.directory).glob(pattern):
+                if session_file_path.stat().st_mtime < cutoff_ts:
+                    session_ids.append(session_file_path.name[:-len(self.extension)])
+        return session_ids
+
+
+class JsonSessionBackend(FileSessionBackend):
+    """
+    One pretty-printed chat_history/<id[:2]>/<session_id>.json file per session.
+
+    Every write atomically replaces the whole file with the current session snapshot.
+    """
+    name = "json"
+    extension = ".json"
+
+    def read(self, session_id: str) -> Optional[dict]:
+        session_file_path = self._existing_file_path(session_id)
+        if session_file_path is None:
+            return None
+        with open(session_file_path, "r") as file:
+            return json.load(file)
+
+    def write(self, session_id: str, session_data: dict, events: List[dict]):
+        session_file_path = self._prepare_write(session_id)
+        atomic_write_text(session_file_path, json.dumps(session_data, indent=2))
+
+
+class JournalSessionBackend(FileSessionBackend):
+    """
+    Append-only chat_history/<id[:2]>/<session_id>.jsonl event log per session.
+
+    The first line is a small header, the remaining lines are session events
+    (see apply_event). A turn appends only its new events, so writes no longer
+    grow with the length of the history, and a crash mid-append can at worst
+    leave a truncated last line, which replay skips. Once a log holds more than
+    compact_after events it is folded back into header + one snapshot event.
+
+    Example file:
+        {"type": "header", "session_id": "...", "format": 1, "created": "..."}
+        {"type": "message", "role": "user", "content": "...", "ts": "..."}
+        {"type": "path", "current_path": ["AGRICULTURE DEPARTMENT"], "ts": "..."}
+    """
+    name = "journal"
+    extension = ".jsonl"
+    FORMAT_VERSION = 1
+
+    def __init__(self, directory: str = "chat_history", sharded: bool = True, compact_after: int = 200):
+        super().__init__(directory=directory, sharded=sharded)
+        self.compact_after = compact_after
+        self._event_counts: Dict[str, int] = {}
+
+    def _header(self, session_id: str) -> dict:
+        return {
+            "type": "header",
+            "session_id": session_id,
+            "format": self.FORMAT_VERSION,
+            "created": datetime.now().isoformat()
+        }
+
+    def read(self, session_id: str) -> Optional[dict]:
+        session_file_path = self._existing_file_path(session_id)
+        if session_file_path is None:
+            return None
+
+        session_data = new_session_data(session_id)
+        event_count = 0
+        with open(session_file_path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final append from a crash; everything before it is intact
+                    logger.warning(f"Skipping corrupt journal line in {session_file_path}")
+                    continue
+                if event.get("type") == "header":
+                    continue
+                apply_event(session_data, event)
+                event_count += 1
+
+        self._event_counts[session_id] = event_count
+        return session_data
+
+    def write(self, session_id: str, session_data: dict, events: List[dict]):
+        session_file_path = self._prepare_write(session_id)
+
+        if not events:
+            # Modified without events (e.g. mark_dirty); persist as a snapshot
+            self.compact(session_id, session_data)
+            return
+
+        lines = []
+        if not os.path.exists(session_file_path):
+            lines.append(json.dumps(self._header(session_id)))
+            self._event_counts[session_id] = 0
+        elif not self._ends_with_newline(session_file_path):
+            # Terminate a torn line so it doesn't swallow the events appended after it
+            lines.append("")
+        lines.extend(json.dumps(event) for event in events)
+
+        with open(session_file_path, "a") as file:
+            file.write("\n".join(lines) + "\n")
+
+        if session_id not in self._event_counts:
+            self.read(session_id)
+        else:
+            self._event_counts[session_id] += len(events)
+
+        if self._event_counts[session_id] > self.compact_after:
+            self.compact(session_id, session_data)
+
+    @staticmethod
+    def _ends_with_newline(session_file_path: str) -> bool:
+        with open(session_file_path, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() == 0:
+                return True
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def compact(self, session_id: str, session_data: dict):
+        """Rewrites the log as header + a single snapshot event."""
+        snapshot = {
+            "type": "snapshot",
+            "history": session_data.get("history", []),
+            "current_path": session_data.get("current_path", []),
+            "path_final": session_data.get("path_final", "False"),
+            "last_updated": session_data.get("last_updated", "")
+        }
+        atomic_write_text(
+            self._prepare_write(session_id),
+            json.dumps(self._header(session_id)) + "\n" + json.dumps(snapshot) + "\n"
+        )
+        self._event_counts[session_id] = 1
+
+    def delete(self, session_id: str):
+        super().delete(session_id)
+        self._event_counts.pop(session_id, None)
+
+
+class SqliteSessionBackend:
+    """
+    Sessions, messages and department paths in one SQLite database (WAL mode).
+
+    WAL lets every uvicorn worker read while another one writes, and all the
+    events of a flush are committed in a single transaction. The sessions table
+    is indexed on last_updated, path_final and final_department so the admin
+    queries below don't have to scan every session.
+
+    Tables:
+        sessions (session_id, path_final, final_department, finalized_at, last_updated, created)
+        messages (id, session_id, role, content, ts) - content is JSON encoded,
+                                                       final answers store the path list
+        paths    (session_id, level, name)
+    """
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            path_final TEXT NOT NULL DEFAULT 'False',
+            final_department TEXT,
+            finalized_at TEXT,
+            last_updated TEXT NOT NULL DEFAULT '',
+            created TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            ts TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS paths (
+            session_id TEXT NOT NULL,
+            level INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (session_id, level)
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_last_updated ON sessions (last_updated);
+        CREATE INDEX IF NOT EXISTS idx_sessions_path_final ON sessions (path_final, last_updated);
+        CREATE INDEX IF NOT EXISTS idx_sessions_final_department ON sessions (final_department, finalized_at);
+        CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+    """
+
+    def __init__(self, directory: str = "chat_history", db_path: Optional[str] = None, sharded: bool = True):
+        # sharded only applies to the file backends
+        self.directory = directory
+        self.db_path = db_path or os.getenv("SESSION_DB_PATH") or os.path.join(directory, "sessions.db")
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def read(self, session_id: str) -> Optional[dict]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT path_final, last_updated FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        session_data = new_session_data(session_id)
+        session_data["path_final"], session_data["last_updated"] = row
+        session_data["history"] = [
+            {"role": role, "content": json.loads(content)}
+            for role, content in conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+            )
+        ]
+        session_data["current_path"] = [
+            name for (name,) in conn.execute(
+                "SELECT name FROM paths WHERE session_id = ? ORDER BY level", (session_id,)
+            )
+        ]
+        return session_data
+
+    def write(self, session_id: str, session_data: dict, events: List[dict]):
+        self.write_many([(session_id, session_data, events)])
+
+    def write_many(self, items: Iterable[Tuple[str, dict, List[dict]]]):
+        """Writes several sessions in one transaction."""
+        conn = self._connection()
+        with conn:
+            for session_id, session_data, events in items:
+                self._write_session(conn, session_id, session_data, events)
+
+    def _write_session(self, conn: sqlite3.Connection, session_id: str, session_data: dict, events: List[dict]):
+        current_path = session_data.get("current_path", [])
+        path_final = session_data.get("path_final", "False")
+        is_final = str(path_final).lower() == "true"
+        finalized_at = None
+        for event in events:
+            if event.get("type") == "final" and str(event["path_final"]).lower() == "true":
+                finalized_at = event.get("ts")
+        if is_final and finalized_at is None and not events:
+            finalized_at = session_data.get("last_updated") or None
+
+        conn.execute(
+            """
+            INSERT INTO sessions (session_id, path_final, final_department, finalized_at, last_updated, created)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (session_id) DO UPDATE SET
+                path_final = excluded.path_final,
+                final_department = excluded.final_department,
+                finalized_at = COALESCE(excluded.finalized_at, sessions.finalized_at),
+                last_updated = excluded.last_updated
+            """,
+            (
+                session_id,
+                "True" if is_final else "False",
+                current_path[-1] if is_final and current_path else None,
+                finalized_at,
+                session_data.get("last_updated", ""),
+                datetime.now().isoformat()
+            )
+        )
+
+        if events:
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, ts) VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, event["role"], json.dumps(event["content"]), event.get("ts", ""))
+                    for event in events if event.get("type") == "message"
+                ]
+            )
+        else:
+            # No events: the whole snapshot is authoritative
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, ts) VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, entry["role"], json.dumps(entry["content"]), session_data.get("last_updated", ""))
+                    for entry in session_data.get("history", [])
+                ]
+            )
+
+        if not events or any(event.get("type") in ("path", "snapshot") for event in events):
+            conn.execute("DELETE FROM paths WHERE session_id = ?", (session_id,))
+            conn.executemany(
+                "INSERT INTO paths (session_id, level, name) VALUES (?, ?, ?)",
+                [(session_id, level, name) for level, name in enumerate(current_path)]
+            )
+
+    def stamp(self, session_id: str):
+        # Rows can change without touching last_updated (e.g. path_final); always reload
+        return None
+
+    def delete(self, session_id: str):
+        conn = self._connection()
+        with conn:
+            for table in ("messages", "paths", "sessions"):
+                conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+
+    def list_sessions_older_than(self, cutoff: datetime) -> List[str]:
+        """Session ids last updated before cutoff (used by the archiver)."""
+        return [
+            session_id for (session_id,) in self._connection().execute(
+                "SELECT session_id FROM sessions WHERE last_updated < ? ORDER BY last_updated",
+                (cutoff.isoformat(),)
+            )
+        ]
+
+    # Admin queries
+
+    def count_open_sessions(self) -> int:
+        """Number of sessions that have not reached a final department."""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions WHERE path_final != 'True'"
+        ).fetchone()[0]
+
+    def sessions_finalized_at(self, department: str, since: Optional[str] = None) -> List[str]:
+        """
+        Session ids that finalized at the given leaf department.
+
+        Args:
+            department: Name of the final (leaf) department
+            since: ISO timestamp; defaults to the start of today
+        """
+        if since is None:
+            since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+        return [
+            session_id for (session_id,) in self._connection().execute(
+                "SELECT session_id FROM sessions WHERE final_department = ? AND finalized_at >= ? ORDER BY finalized_at",
+                (department, since)
+            )
+        ]
+
+    def idle_sessions(self, idle_minutes: int = 30) -> List[str]:
+        """Open session ids that have not been updated for idle_minutes."""
+        cutoff = (datetime.now() - timedelta(minutes=idle_minutes)).isoformat()
+        return [
+            session_id for (session_id,) in self._connection().execute(
+                "SELECT session_id FROM sessions WHERE path_final != 'True' AND last_updated < ? ORDER BY last_updated",
+                (cutoff,)
+            )
+        ]
+
+
+SESSION_BACKENDS = {
+    JsonSessionBackend.name: JsonSessionBackend,
+    JournalSessionBackend.name: JournalSessionBackend,
+    SqliteSessionBackend.name: SqliteSessionBackend,
+}
+
+
+def get_session_backend(name: str = "json", directory: str = "chat_history", sharded: bool = True):
+    """Returns the session persistence backend configured by SESSION_BACKEND."""
+    if name not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown session backend: {name}. Expected one of {list(SESSION_BACKENDS)}")
+    return SESSION_BACKENDS[name](directory=directory, sharded=sharded)
+
+
+def read_json_sessions(directory: str = "chat_history"):
+    """Yields (session_id, session_data) for every chat_history/*.json session, flat or sharded."""
+    json_backend = JsonSessionBackend(directory=directory)
+    session_file_paths = list(Path(directory).glob("*.json")) + list(Path(directory).glob("*/*.json"))
+    for session_file_path in sorted(session_file_paths):
+        session_id = session_file_path.stem
+        try:
+            session_data = new_session_data(session_id)
+            session_data.update(json_backend.read(session_id) or {})
+            # Older sessions created by update_dept_path used "chat_history" as the key
+            session_data["history"] = session_data.get("history") or session_data.pop("chat_history", [])
+            yield session_id, session_data
+        except Exception as e:
+            logger.error(f"Error reading session {session_id}: {str(e)}")
+
+
+def convert_json_sessions_to_journal(directory: str = "chat_history") -> int:
+    """
+    Converts every chat_history/*.json session into a compacted .jsonl journal.
+
+    The original .json files are left in place. Returns the number of sessions converted.
+    """
+    journal_backend = JournalSessionBackend(directory=directory)
+    converted = 0
+    for session_id, session_data in read_json_sessions(directory):
+        journal_backend.compact(session_id, session_data)
+        converted += 1
+    return converted
+
+
+def migrate_json_sessions_to_sqlite(directory: str = "chat_history", db_path: Optional[str] = None, batch_size: int = 500) -> int:
+    """
+    Bulk-imports every chat_history/*.json session into the SQLite backend.
+
+    Sessions are committed in batches of batch_size. The original .json files
+    are left in place. Returns the number of sessions imported.
+    """
+    sqlite_backend = SqliteSessionBackend(directory=directory, db_path=db_path)
+    migrated = 0
+    batch = []
+    for session_id, session_data in read_json_sessions(directory):
+        batch.append((session_id, session_data, []))
+        if len(batch) >= batch_size:
+            sqlite_backend.write_many(batch)
+            migrated += len(batch)
+            batch = []
+    if batch:
+        sqlite_backend.write_many(batch)
+        migrated += len(batch)
+    return migrated
+
+
+if __name__ == "__main__":
+    # python -m utils.session_backends convert [chat_history]
+    # python -m utils.session_backends migrate-sqlite [chat_history] [db_path]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] not in ("convert", "migrate-sqlite"):
+        print("Usage: python -m utils.session_backends convert|migrate-sqlite [directory] [db_path]")
+        sys.exit(1)
+    directory = sys.argv[2] if len(sys.argv) > 2 else "chat_history"
+    if sys.argv[1] == "convert":
+        print(f"Converted {convert_json_sessions_to_journal(directory)} sessions in {directory}")
+    else:
+        db_path = sys.argv[3] if len(sys.argv) > 3 else None
+        print(f"Imported {migrate_json_sessions_to_sqlite(directory, db_path)} sessions from {directory}")
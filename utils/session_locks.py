@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+import logging
+import weakref
+from contextlib import asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, only the in-process lock applies
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLockRegistry:
+    """
+    Serializes chat turns per session, within a worker and across workers.
+
+    Inside a worker each session gets its own asyncio.Lock (kept in a weak
+    registry, so it goes away once no turn holds it). Across uvicorn workers an
+    advisory flock() on <lock_directory>/<id[:2]>/<session_id>.lock is taken
+    while the asyncio lock is held; the lock files are sharded like the session
+    files. The file lock is polled with LOCK_NB so a waiting turn never blocks
+    the event loop. Different sessions use different locks and run fully in
+    parallel.
+
+    remove_lock_file() deletes a session's lock file while its lock is held
+    (when the session itself is deleted). A turn that was waiting on the
+    removed file notices, once it gets the flock, that the path no longer
+    leads to the file it locked, and locks the current file instead.
+
+    Example:
+        async with session_locks.lock(session_id):
+            ...  # load, classify, flush
+    """
+    def __init__(self, lock_directory: str = "chat_history/.locks", poll_interval: float = 0.01, timeout: float = 120.0):
+        self.lock_directory = lock_directory
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _local_lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    def lock_file_path(self, session_id: str) -> str:
+        return os.path.join(self.lock_directory, session_id[:2].lower(), f"{session_id}.lock")
+
+    @staticmethod
+    def _is_current(fd: int, lock_file_path: str) -> bool:
+        try:
+            stat = os.stat(lock_file_path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(fd)
+        return (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino)
+
+    async def _acquire_file_lock(self, session_id: str):
+        if fcntl is None:
+            return None
+        lock_file_path = self.lock_file_path(session_id)
+        deadline = time.monotonic() + self.timeout
+        os.makedirs(os.path.dirname(lock_file_path), exist_ok=True)
+        fd = os.open(lock_file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise TimeoutError(f"Timed out waiting for the session lock of {session_id}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            except Exception:
+                os.close(fd)
+                raise
+            if self._is_current(fd, lock_file_path):
+                return fd
+            # The holder removed the file we waited on; lock the one now at the path
+            self._release_file_lock(fd)
+            os.makedirs(os.path.dirname(lock_file_path), exist_ok=True)
+            fd = os.open(lock_file_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @staticmethod
+    def _release_file_lock(fd):
+        if fd is None:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def remove_lock_file(self, session_id: str):
+        """Deletes the session's lock file; only call it while holding lock(session_id)."""
+        try:
+            os.remove(self.lock_file_path(session_id))
+        except FileNotFoundError:
+            pass
+
+    @asynccontextmanager
+    async def lock(self, session_id: str):
+        # Hold a strong reference for the duration of the turn
+        local_lock = self._local_lock(session_id)
+        async with local_lock:
+            fd = await self._acquire_file_lock(session_id)
+            try:
+                yield
+            finally:
+                self._release_file_lock(fd)
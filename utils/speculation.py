@@ -0,0 +1,142 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Dict, List, Optional, Sequence
+
+from utils.flat_classifier import LeafPathIndex, tree_leaf_paths
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeCall:
+    """A next-level classifier call started before the current level has answered."""
+    __slots__ = ("child", "task", "started", "finished")
+
+    def __init__(self, child: str, task: asyncio.Task):
+        self.child = child
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self.finished = time.perf_counter()
+        # Discarded calls may fail or be cancelled; nobody else will look at them
+        if not task.cancelled():
+            task.exception()
+
+
+class Speculator:
+    """
+    Speculative prefetch of the next level of the per-level descent.
+
+    While the classifier answers level k, the level k+1 call for the `width`
+    most likely children is started as well. The children are predicted
+    lexically, from the leaf paths below each child. When level k answers,
+    the call for the chosen child is kept and awaited by the next level, and
+    the others are cancelled.
+
+    Speculative calls that go unused are billed all the same, so speculation
+    pauses while the unused calls exceed spend_cap per regular classifier
+    call. width=0 turns speculation off.
+
+    Example:
+        speculator.record_primary()
+        calls = {child: speculator.start(child, classify_level(...)) for child in speculator.candidates(query, dept_path, children)}
+        response = await level_call
+        prefetched = speculator.settle(calls, classified_dept)  # the next level's task, or None
+    """
+    def __init__(self, registry, width: int = 0, spend_cap: float = 0.5, min_score: float = 0.05, log_every: int = 100):
+        self.registry = registry
+        self.width = width
+        self.spend_cap = spend_cap
+        self.min_score = min_score
+        self.log_every = log_every
+        self.primary_calls = 0
+        self.speculative_calls = 0
+        self.speculated_levels = 0
+        self.hits = 0
+        self.wasted = 0
+        self.latency_saved = 0.0
+        self._index: Optional[LeafPathIndex] = None
+        self._tree_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _leaf_index(self) -> LeafPathIndex:
+        tree_version = self.registry.version
+        if self._index is None or tree_version != self._tree_version:
+            with self._lock:
+                if self._index is None or tree_version != self._tree_version:
+                    self._index = LeafPathIndex(tree_leaf_paths(self.registry))
+                    self._tree_version = tree_version
+        return self._index
+
+    def record_primary(self):
+        """Counts a classifier call that was not served by a speculative one."""
+        self.primary_calls += 1
+
+    def budget(self) -> int:
+        """How many speculative calls may start now."""
+        if self.width <= 0 or self.wasted >= self.spend_cap * max(self.primary_calls, 1):
+            return 0
+        return self.width
+
+    def candidates(self, query: str, dept_path: Sequence[str], children: Sequence[str]) -> List[str]:
+        """The most likely non-leaf children of dept_path for query, at most budget() of them."""
+        budget = self.budget()
+        if budget == 0 or not children:
+            return []
+        index = self._leaf_index()
+        depth = len(dept_path)
+        ranked = []
+        # Leaf paths come best first, so a child's first appearance is its best score
+        for path, score in index.shortlist(query, k=len(index), prefix=dept_path):
+            if score < self.min_score or len(ranked) == budget:
+                break
+            child = path[depth] if len(path) > depth + 1 else None
+            if child is not None and child in children and child not in ranked:
+                ranked.append(child)
+        return ranked
+
+    def start(self, child: str, call: Awaitable[dict]) -> SpeculativeCall:
+        self.speculative_calls += 1
+        return SpeculativeCall(child, asyncio.ensure_future(call))
+
+    def settle(self, calls: Dict[str, SpeculativeCall], chosen: Optional[str]) -> Optional[asyncio.Task]:
+        """
+        Keeps the call for the chosen child and cancels the rest.
+
+        Returns the kept task for the next level to await, or None on a miss.
+        Call this exactly once per level that started speculative calls.
+        """
+        if not calls:
+            return None
+        self.speculated_levels += 1
+        now = time.perf_counter()
+        kept = None
+        for child, call in calls.items():
+            if child == chosen:
+                kept = call.task
+                self.hits += 1
+                # The next level has been running since call.started instead of starting now
+                self.latency_saved += (call.finished or now) - call.started
+            else:
+                call.task.cancel()
+                self.wasted += 1
+        if self.log_every and self.speculated_levels % self.log_every == 0:
+            logger.info(f"Speculative prefetch: {self.stats()}")
+        return kept
+
+    def stats(self) -> dict:
+        return {
+            "width": self.width,
+            "primary_calls": self.primary_calls,
+            "speculative_calls": self.speculative_calls,
+            "speculated_levels": self.speculated_levels,
+            "hits": self.hits,
+            "wasted_calls": self.wasted,
+            "hit_rate": self.hits / self.speculated_levels if self.speculated_levels else 0.0,
+            "latency_saved": self.latency_saved,
+            "latency_saved_per_hit": self.latency_saved / self.hits if self.hits else 0.0,
+        }
@@ -0,0 +1,112 @@
+import re
+import logging
+import contextvars
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and single punctuation marks; long words count about one token per 4 characters
+_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+# Usage reported by the backend for the call in progress (see report_usage)
+_reported: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("llm_reported_usage", default=None)
+
+
+def approx_tokens(text: Optional[str]) -> int:
+    """
+    Token count of text without a tokenizer or network.
+
+    An approximation of the subword tokenizers (a short word is one token, a
+    long one about one per 4 characters, each punctuation mark one); meant
+    for accounting, not for enforcing limits.
+    """
+    if not text:
+        return 0
+    return sum(max(1, (len(piece) + 1) // 4) for piece in _PIECES.findall(text))
+
+
+def report_usage(input_tokens: Optional[int] = None, output_tokens: Optional[int] = None, cached_tokens: Optional[int] = None):
+    """Called by a backend with the provider's token counts; they replace the estimates for this call."""
+    reported = _reported.get()
+    if reported is None:
+        return
+    for key, value in (("input_tokens", input_tokens), ("output_tokens", output_tokens), ("cached_tokens", cached_tokens)):
+        if value is not None:
+            reported[key] = value
+
+
+class UsageCapture:
+    """
+    Collects what report_usage() is told during one model call.
+
+    Example:
+        with UsageCapture() as reported:
+            response = await backend.generate_json(prompt)
+        reported.get("input_tokens")  # None when the backend did not report
+    """
+    def __enter__(self) -> dict:
+        self.reported = {}
+        self._token = _reported.set(self.reported)
+        return self.reported
+
+    def __exit__(self, exc_type, exc, tb):
+        _reported.reset(self._token)
+        return False
+
+
+class StageUsage:
+    """Token and latency totals of one pipeline stage."""
+    def __init__(self):
+        self.calls = 0
+        self.estimated_calls = 0
+        self.input_tokens = 0
+        self.prefix_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.latency = 0.0
+
+    def as_dict(self) -> dict:
+        calls = max(self.calls, 1)
+        return {
+            "calls": self.calls,
+            "estimated_calls": self.estimated_calls,
+            "input_tokens": self.input_tokens,
+            "prefix_tokens": self.prefix_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "input_tokens_per_call": self.input_tokens / calls,
+            "output_tokens_per_call": self.output_tokens / calls,
+            "mean_latency": self.latency / calls,
+        }
+
+
+class TokenUsage:
+    """
+    Input / output token counts and latency per pipeline stage.
+
+    Provider counts are used when the backend reports them; otherwise the
+    call is counted with approx_tokens and marked as estimated. prefix_tokens
+    is the (estimated) share of the input taken by the static, cacheable
+    prompt prefix; cached_tokens is what the provider served from its cache.
+    """
+    def __init__(self, log_every: int = 100):
+        self.log_every = log_every
+        self.stages: Dict[str, StageUsage] = {}
+        self.calls = 0
+
+    def record(self, stage: str, input_tokens: int, output_tokens: int, latency: float,
+               prefix_tokens: int = 0, cached_tokens: int = 0, estimated: bool = False):
+        usage = self.stages.setdefault(stage, StageUsage())
+        usage.calls += 1
+        usage.estimated_calls += int(estimated)
+        usage.input_tokens += input_tokens
+        usage.prefix_tokens += prefix_tokens
+        usage.cached_tokens += cached_tokens
+        usage.output_tokens += output_tokens
+        usage.latency += latency
+        self.calls += 1
+        if self.log_every and self.calls % self.log_every == 0:
+            logger.info(f"LLM token usage: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {stage: usage.as_dict() for stage, usage in self.stages.items()}
@@ -0,0 +1,292 @@
+import json
+import mmap
+import os
+import sys
+import struct
+from array import array
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from utils.department_tree import DepartmentNode
+
+MAGIC = b"DTSNAP01"
+FORMAT_VERSION = 1
+# magic, version, node_count, string_count, strings_blob_len, reserved x2
+HEADER = struct.Struct("<8sIIIIII")
+NO_STRING = 0xFFFFFFFF
+ARRAY_NAMES = ("name", "categ", "level", "first_child", "child_count", "sorted_children")
+
+
+def compile_tree(tree: List[dict]) -> bytes:
+    """
+    Compiles a department tree JSON (name / categ_id / level / children) into a snapshot.
+
+    Layout (little-endian, every array is uint32):
+        header
+        string_offsets[string_count + 1]   offsets into the strings blob
+        name[node_count]                   string id of the node name
+        categ[node_count]                  string id of categ_id, or 0xFFFFFFFF
+        level[node_count]                  level + 1 (the virtual root is node 0, level -1)
+        first_child[node_count]            children of a node are contiguous (BFS order)
+        child_count[node_count]
+        sorted_children[node_count]        per parent, its children ordered by name string id
+        strings blob                       utf-8, sorted, so a name is found by binary search
+    """
+    # Breadth-first numbering keeps every node's children contiguous
+    nodes = [{"name": "", "categ_id": None, "level": -1, "children": tree}]
+    first_child = [0]
+    child_count = [0]
+    queue = [0]
+    position = 0
+    while position < len(queue):
+        node_id = queue[position]
+        position += 1
+        first_child[node_id] = len(nodes)
+        seen = set()
+        for child in nodes[node_id]["children"] or []:
+            name = child.get("name")
+            if name in seen:
+                # Duplicate sibling names: the first one wins, as in DepartmentTree
+                continue
+            seen.add(name)
+            nodes.append({
+                "name": name,
+                "categ_id": child.get("categ_id"),
+                "level": int(child.get("level", nodes[node_id]["level"] + 1)),
+                "children": child.get("children", []),
+            })
+            first_child.append(0)
+            child_count.append(0)
+            queue.append(len(nodes) - 1)
+        child_count[node_id] = len(nodes) - first_child[node_id]
+
+    strings = set()
+    for node in nodes:
+        strings.add(node["name"])
+        if node["categ_id"] is not None:
+            strings.add(str(node["categ_id"]))
+    encoded = sorted(string.encode("utf-8") for string in strings)
+    string_ids = {string.decode("utf-8"): string_id for string_id, string in enumerate(encoded)}
+
+    string_offsets = array("I", [0])
+    for string in encoded:
+        string_offsets.append(string_offsets[-1] + len(string))
+    blob = b"".join(encoded)
+
+    arrays = {
+        "name": array("I", (string_ids[node["name"]] for node in nodes)),
+        "categ": array("I", (NO_STRING if node["categ_id"] is None else string_ids[str(node["categ_id"])] for node in nodes)),
+        "level": array("I", (node["level"] + 1 for node in nodes)),
+        "first_child": array("I", first_child),
+        "child_count": array("I", child_count),
+        "sorted_children": array("I", range(len(nodes))),
+    }
+    sorted_children = arrays["sorted_children"]
+    for node_id in range(len(nodes)):
+        start, count = first_child[node_id], child_count[node_id]
+        children = sorted(range(start, start + count), key=lambda child_id: arrays["name"][child_id])
+        sorted_children[start:start + count] = array("I", children)
+
+    if sys.byteorder != "little":
+        for values in (string_offsets, *arrays.values()):
+            values.byteswap()
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(nodes), len(encoded), len(blob), 0, 0)
+    return header + string_offsets.tobytes() + b"".join(arrays[name].tobytes() for name in ARRAY_NAMES) + blob
+
+
+def write_snapshot(tree_json_path: str, snapshot_path: Optional[str] = None) -> str:
+    """
+    Builds <Name>_tree.snap next to <Name>_tree.json (or at snapshot_path).
+
+    The snapshot is written to a temp file and renamed into place, so a server
+    watching the file only ever maps a complete snapshot.
+    """
+    if snapshot_path is None:
+        snapshot_path = os.path.splitext(tree_json_path)[0] + ".snap"
+    with open(tree_json_path, "r") as file:
+        data = compile_tree(json.load(file))
+    temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, snapshot_path)
+    return snapshot_path
+
+
+class TreeSnapshot:
+    """
+    Read-only department tree backed by a memory-mapped snapshot file.
+
+    Loading maps the file and casts the arrays in place; nothing is parsed,
+    and the pages are shared by every worker that maps the same file. It has
+    the same lookup interface as DepartmentTree. Names resolve to string ids
+    by binary search over the sorted string table and children by binary
+    search over each parent's sorted child list.
+
+    Example:
+        tree = TreeSnapshot.load("utils/Agriculture_tree.snap")
+        tree.children(["AGRICULTURE DEPARTMENT"])
+    """
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, node_count, string_count, blob_length, _, _ = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a department tree snapshot (or an unsupported version)")
+        if sys.byteorder != "little":
+            raise ValueError("Department tree snapshots are little-endian")
+
+        offset = HEADER.size
+        self._string_offsets = view[offset:offset + 4 * (string_count + 1)].cast("I")
+        offset += 4 * (string_count + 1)
+        for name in ARRAY_NAMES:
+            setattr(self, f"_{name}", view[offset:offset + 4 * node_count].cast("I"))
+            offset += 4 * node_count
+        self._blob = view[offset:offset + blob_length]
+        self.node_count = node_count
+        self.string_count = string_count
+        # Filled lazily as names are looked up; bounded by the string table
+        self._strings = {}
+        self._string_ids = {}
+
+    @classmethod
+    def load(cls, snapshot_path: str) -> "TreeSnapshot":
+        with open(snapshot_path, "rb") as file:
+            # The mapping stays valid after the file is replaced or closed
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def _string(self, string_id: int) -> str:
+        value = self._strings.get(string_id)
+        if value is None:
+            value = bytes(self._blob[self._string_offsets[string_id]:self._string_offsets[string_id + 1]]).decode("utf-8")
+            self._strings[string_id] = value
+        return value
+
+    def _string_id(self, value: str) -> Optional[int]:
+        if value in self._string_ids:
+            return self._string_ids[value]
+        string_id = self._search_string(value)
+        if string_id is not None:
+            self._string_ids[value] = string_id
+        return string_id
+
+    def _search_string(self, value: str) -> Optional[int]:
+        target = value.encode("utf-8")
+        low, high = 0, self.string_count
+        while low < high:
+            middle = (low + high) // 2
+            candidate = bytes(self._blob[self._string_offsets[middle]:self._string_offsets[middle + 1]])
+            if candidate < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.string_count and self._string(low) == value:
+            return low
+        return None
+
+    def _child(self, node_id: int, name_id: int) -> Optional[int]:
+        low = self._first_child[node_id]
+        high = low + self._child_count[node_id]
+        while low < high:
+            middle = (low + high) // 2
+            if self._name[self._sorted_children[middle]] < name_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._first_child[node_id] + self._child_count[node_id]:
+            child_id = self._sorted_children[low]
+            if self._name[child_id] == name_id:
+                return child_id
+        return None
+
+    def _node_id(self, dept_path: Sequence[str]) -> Optional[int]:
+        node_id = 0
+        for name in dept_path:
+            name_id = self._string_id(name)
+            if name_id is None:
+                return None
+            node_id = self._child(node_id, name_id)
+            if node_id is None:
+                return None
+        return node_id
+
+    def _children_names(self, node_id: int) -> List[str]:
+        start = self._first_child[node_id]
+        return [self._string(self._name[child_id]) for child_id in range(start, start + self._child_count[node_id])]
+
+    def get(self, dept_path: Sequence[str]) -> Optional[DepartmentNode]:
+        node_id = self._node_id(dept_path)
+        if node_id is None:
+            return None
+        categ = self._categ[node_id]
+        return DepartmentNode(
+            path=tuple(dept_path),
+            name=self._string(self._name[node_id]),
+            categ_id=None if categ == NO_STRING else self._string(categ),
+            level=self._level[node_id] - 1,
+            children=self._children_names(node_id),
+        )
+
+    def contains(self, dept_path: Sequence[str]) -> bool:
+        return self._node_id(dept_path) is not None
+
+    def children(self, dept_path: Sequence[str]) -> List[str]:
+        """Names of the children of dept_path; [] for a leaf or an unknown path."""
+        node_id = self._node_id(dept_path)
+        return self._children_names(node_id) if node_id is not None else []
+
+    def is_leaf(self, dept_path: Sequence[str]) -> bool:
+        if not dept_path:
+            return False
+        node_id = self._node_id(dept_path)
+        return node_id is not None and self._child_count[node_id] == 0
+
+    def iter_paths(self, max_depth: Optional[int] = None) -> Iterator[Tuple[Tuple[str, ...], int]]:
+        """Yields (path, node_id) for every node, parents before children."""
+        stack = [((), 0)]
+        while stack:
+            path, node_id = stack.pop()
+            if path:
+                yield path, node_id
+            if max_depth is not None and len(path) >= max_depth:
+                continue
+            start = self._first_child[node_id]
+            for child_id in reversed(range(start, start + self._child_count[node_id])):
+                stack.append((path + (self._string(self._name[child_id]),), child_id))
+
+    def leaf_paths(self) -> Iterator[Tuple[str, ...]]:
+        for path, node_id in self.iter_paths():
+            if self._child_count[node_id] == 0:
+                yield path
+
+    @property
+    def tree(self) -> List[dict]:
+        """The tree as the original nested JSON list (built on demand)."""
+        def build(node_id):
+            categ = self._categ[node_id]
+            start = self._first_child[node_id]
+            node = {
+                "name": self._string(self._name[node_id]),
+                "categ_id": None if categ == NO_STRING else self._string(categ),
+                "level": str(self._level[node_id] - 1),
+            }
+            # Leaves carry no "children" key in the tree files
+            if self._child_count[node_id]:
+                node["children"] = [build(child_id) for child_id in range(start, start + self._child_count[node_id])]
+            return node
+        return build(0).get("children", [])
+
+    def __len__(self):
+        return self.node_count - 1
+
+
+if __name__ == "__main__":
+    # python -m utils.tree_snapshot utils/Agriculture_tree.json data/RDPR_tree.json
+    if len(sys.argv) < 2:
+        print("Usage: python -m utils.tree_snapshot <tree.json> [<tree.json> ...]")
+        sys.exit(1)
+    for tree_json_path in sys.argv[1:]:
+        snapshot_path = write_snapshot(tree_json_path)
+        print(f"{tree_json_path} -> {snapshot_path} ({os.path.getsize(snapshot_path)} bytes)")